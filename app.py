@@ -1,6 +1,74 @@
+import argparse
+import sys
+
 from backend.loyverse_extractor import extract_loyverse_data
+from backend.reconciler import reconcile
+from backend.stock_sync import sync_stock
+from backend.tenants import load_tenants, run_tenants
 from backend.wcapi_inserter import insert_to_woocommerce
+from backend.wcapi_jobs import run_job_worker
+from backend.utils import WOOCOMMERCE_WORKERS
+from backend.utils.metrics import write_textfile
 
 if __name__ == '__main__':
-    extract_loyverse_data(debug=True)
-    insert_to_woocommerce(debug=True)
+    parser = argparse.ArgumentParser(description='Sync the Loyverse catalog to WooCommerce')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only sync the items changed in Loyverse since the last sync')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue a failed run: the Loyverse extraction from its last checkpoint and the '
+                             'WooCommerce push from its journal')
+    parser.add_argument('--workers', type=int, default=WOOCOMMERCE_WORKERS,
+                        help='Number of concurrent workers for the WooCommerce push')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='Rebuild the index of WooCommerce product ids before pushing')
+    parser.add_argument('--stock', action='store_true',
+                        help='Only sync stock levels, without the catalog')
+    parser.add_argument('--queue', action='store_true',
+                        help='Queue the WooCommerce push as jobs for job workers instead of pushing in this process')
+    parser.add_argument('--job-worker', action='store_true',
+                        help='Run a job worker pushing queued jobs to WooCommerce')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Compare the catalog with WooCommerce first and only send the changes, in batches')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print the operations and requests the push would send to WooCommerce, without sending '
+                             'them')
+    parser.add_argument('--prune', action='store_true',
+                        help='With --reconcile or --plan on a full sync, also delete the products and variations '
+                             'that are not in Loyverse anymore')
+    parser.add_argument('--tenants',
+                        help='Json file of tenants (Loyverse accounts and their WooCommerce shops) to sync, each in a '
+                             'process of its own. See backend/tenants.py')
+    parser.add_argument('--processes', type=int,
+                        help='With --tenants, maximum number of tenants synced at the same time. Defaults to all')
+    parser.add_argument('--log-dir', help="With --tenants, write the output of every tenant to <log-dir>/<name>.log")
+    args = parser.parse_args()
+
+    if args.tenants:
+        if args.queue or args.job_worker or args.plan:
+            parser.error("--tenants can't be combined with --queue, --job-worker or --plan")
+        exit_codes = run_tenants(load_tenants(args.tenants), processes=args.processes, incremental=args.incremental,
+                                 resume=args.resume, rebuild_index=args.rebuild_index, stock=args.stock,
+                                 use_reconciler=args.reconcile, prune=args.prune, log_directory=args.log_dir,
+                                 debug=True)
+        failed = [name for name in exit_codes if exit_codes[name] != 0]
+        if failed:
+            print('Failed tenants: {}'.format(', '.join(failed)))
+        sys.exit(1 if failed else 0)
+
+    try:
+        if args.stock:
+            sync_stock(workers=args.workers, debug=True)
+        elif args.job_worker:
+            run_job_worker(workers=args.workers, debug=True)
+        elif args.reconcile or args.plan:
+            full = extract_loyverse_data(resume=args.resume, incremental=args.incremental, debug=True)
+            reconcile(only_changed=not full, prune=args.prune, rebuild_index=args.rebuild_index, dry_run=args.plan,
+                      workers=args.workers, debug=True)
+        else:
+            full = extract_loyverse_data(resume=args.resume, incremental=args.incremental, debug=True)
+            insert_to_woocommerce(workers=args.workers, only_changed=not full, rebuild_index=args.rebuild_index,
+                                  queue=args.queue, resume=args.resume, debug=True)
+    finally:
+        # Also written when the run fails, since that's when the numbers matter most. Job workers write their own
+        if not args.job_worker:
+            write_textfile('stock' if args.stock else 'sync')
@@ -0,0 +1,111 @@
+"""
+Django app receiving Loyverse webhooks for real-time sync.
+
+Loyverse posts items.update and inventory_levels.update events to /webhooks/loyverse/. The affected ids are queued in
+redis and pushed to WooCommerce by the webhook worker (backend/webhook_worker.py), so the request returns right away.
+
+/metrics serves the metrics of the sync processes (see utils/metrics.py) for Prometheus to scrape.
+
+Every webhook must be signed with the secret of LOYVERSE_WEBHOOK_SECRET (or the LOYVERSE_WEBHOOK_SECRET environment
+variable). Without a secret the receiver refuses to start, and rejects webhooks if it is served otherwise. Django's
+SECRET_KEY is read from DJANGO_SECRET_KEY and the host names the receiver answers to from DJANGO_ALLOWED_HOSTS
+(comma separated, localhost only by default).
+
+Running:
+    DJANGO_SECRET_KEY=... DJANGO_ALLOWED_HOSTS=sync.example.com LOYVERSE_WEBHOOK_SECRET=... \
+        python -m backend.app runserver 0.0.0.0:8000
+"""
+import json
+import os
+import secrets
+import sys
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=False,
+        # Nothing signed with it outlives the process, so a random key is safe when none is set
+        SECRET_KEY=os.environ.get('DJANGO_SECRET_KEY') or secrets.token_urlsafe(50),
+        ALLOWED_HOSTS=os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(','),
+        ROOT_URLCONF=__name__,
+        # Validates the Host header against ALLOWED_HOSTS
+        MIDDLEWARE=['django.middleware.common.CommonMiddleware'],
+        INSTALLED_APPS=[],
+    )
+
+from django.http import HttpResponse, JsonResponse  # noqa: E402
+from django.urls import path  # noqa: E402
+from django.views.decorators.csrf import csrf_exempt  # noqa: E402
+from django.views.decorators.http import require_GET, require_POST  # noqa: E402
+
+from backend.utils import LOYVERSE_WEBHOOK_SECRET  # noqa: E402
+from backend.utils.webhooks import verify_signature, enqueue_item_ids, enqueue_variant_ids  # noqa: E402
+from backend.utils.metrics import Counter, render_metrics, merge_metrics, read_textfiles  # noqa: E402
+
+WEBHOOK_SECRET = os.environ.get('LOYVERSE_WEBHOOK_SECRET') or LOYVERSE_WEBHOOK_SECRET
+WEBHOOK_EVENTS = Counter('loyverse_sync_webhook_events_total', 'Webhook events received by type', ('type',))
+
+
+# ===================
+# ROUTES
+# ===================
+
+
+@csrf_exempt
+@require_POST
+def loyverse_webhook(request):
+    """
+    View to queue the ids of the items or variants a Loyverse webhook reports as changed.
+
+    :param request: Django request with the webhook json as body
+    :return: JsonResponse with the event type and the number of newly queued ids
+    """
+    if not WEBHOOK_SECRET:
+        return JsonResponse({'error': 'webhook secret not configured'}, status=503)
+    if not verify_signature(request.body, request.headers.get('X-Loyverse-Signature'), WEBHOOK_SECRET):
+        return JsonResponse({'error': 'invalid signature'}, status=401)
+
+    try:
+        event = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'invalid json'}, status=400)
+
+    event_type = event.get('type')
+    WEBHOOK_EVENTS.inc(str(event_type))
+    if event_type == 'items.update':
+        queued = enqueue_item_ids([item.get('id') for item in event.get('items', [])])
+    elif event_type == 'inventory_levels.update':
+        queued = enqueue_variant_ids([level.get('variant_id') for level in event.get('inventory_levels', [])])
+    else:
+        # Acknowledge other events so Loyverse doesn't retry them
+        queued = 0
+
+    return JsonResponse({'type': event_type, 'queued': queued})
+
+
+@require_GET
+def metrics(request):
+    """
+    View to expose the metrics the sync processes wrote to METRICS_TEXTFILE_DIR, with the ones of this process, in
+    the Prometheus text format.
+
+    :param request: Django request
+    :return: HttpResponse with the metrics
+    """
+    text = merge_metrics([render_metrics('webhooks')] + read_textfiles())
+    return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+urlpatterns = [
+    path('webhooks/loyverse/', loyverse_webhook),
+    path('metrics', metrics),
+]
+
+
+if __name__ == '__main__':
+    from django.core.management import execute_from_command_line
+
+    if not WEBHOOK_SECRET:
+        sys.exit('Set LOYVERSE_WEBHOOK_SECRET (backend/utils/vars.py or environment) to verify the webhooks')
+    execute_from_command_line(sys.argv)
@@ -0,0 +1,77 @@
+"""
+Synthetic Loyverse catalogs for the benchmarks. The same arguments always give the same catalog.
+"""
+import random
+
+# Number of variants of each item, drawn uniformly: about half of the items are single products
+VARIANT_COUNTS = (1, 1, 1, 2, 3, 4, 6)
+OPTION_NAMES = ('Size', 'Color', 'Flavor', 'Volume')
+UPDATED_AT = '2020-01-01T00:00:00.000Z'
+
+
+def generate_categories(count):
+    """
+    :param count: Number of categories
+    :return: list of Loyverse category dicts
+    """
+    return [{'id': 'cat-{}'.format(index), 'name': 'Category {}'.format(index), 'color': 'GREY',
+             'created_at': UPDATED_AT, 'deleted_at': None} for index in range(count)]
+
+
+def generate_items(skus, categories, images=100, seed=0):
+    """
+    Function to generate Loyverse items until the catalog holds the requested number of SKUs.
+
+    :param skus: Total number of variants (SKUs) in the catalog
+    :param categories: List of category dicts from generate_categories
+    :param images: Number of distinct image urls shared by the items. 0 for items without image
+    :param seed: Seed of the random generator
+    :return: list of Loyverse item dicts
+    """
+    rng = random.Random(seed)
+    items = list()
+    count = 0
+    while count < skus:
+        index = len(items)
+        variants_count = min(rng.choice(VARIANT_COUNTS), skus - count)
+        option_name = rng.choice(OPTION_NAMES) if variants_count > 1 else None
+        item_id = 'item-{}'.format(index)
+        variants = list()
+        for variant_index in range(variants_count):
+            variants.append({
+                'variant_id': 'variant-{}-{}'.format(index, variant_index),
+                'item_id': item_id,
+                'sku': str(10000 + count + variant_index),
+                'option1_value': '{} {}'.format(option_name, variant_index) if option_name else None,
+                'cost': round(rng.uniform(1, 100), 2),
+                'default_price': None,
+                'created_at': UPDATED_AT,
+                'updated_at': UPDATED_AT,
+                'deleted_at': None,
+            })
+        items.append({
+            'id': item_id,
+            'handle': 'item-{}'.format(index),
+            'item_name': 'Item {}'.format(index),
+            'category_id': rng.choice(categories)['id'] if categories else None,
+            'option1_name': option_name,
+            'image_url': 'https://images.example.com/{}'.format(rng.randrange(images)) if images else None,
+            'created_at': UPDATED_AT,
+            'updated_at': UPDATED_AT,
+            'deleted_at': None,
+            'variants': variants,
+        })
+        count += variants_count
+    return items
+
+
+def generate_catalog(skus, categories=20, images=100, seed=0):
+    """
+    :param skus: Total number of variants (SKUs) in the catalog
+    :param categories: Number of categories
+    :param images: Number of distinct image urls
+    :param seed: Seed of the random generator
+    :return: tuple with the list of item dicts and the list of category dicts
+    """
+    category_dicts = generate_categories(categories)
+    return generate_items(skus, category_dicts, images=images, seed=seed), category_dicts
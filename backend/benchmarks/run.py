@@ -0,0 +1,186 @@
+"""
+Benchmark of the sync against the local stand-in servers.
+
+For every catalog size, a stand-in Loyverse server is started with a synthetic catalog and an empty stand-in
+WooCommerce server next to it. Then these phases run one after the other:
+- extract: extract_loyverse_data, a full extraction into redis
+- insert: insert_to_woocommerce into the empty shop
+- insert (unchanged): insert_to_woocommerce again, nothing changed since the previous push
+With --reconcile, the insert phases plan and apply the push with the reconciler instead.
+
+Each phase reports its wall time, the requests each server received (the 429s Loyverse answered, and the requests
+WooCommerce failed with any other 4xx), and the peak memory allocated by Python during the phase (tracemalloc, which
+slows the phase down; see --no-memory).
+
+Needs a redis server. The database given with --redis-db is FLUSHED before every catalog size, so don't point it to
+the database of a real shop.
+
+Usage: python -m backend.benchmarks.run --skus 1000 10000 --workers 4 --wc-latency 0.02
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import requests
+
+from backend.benchmarks.servers import start_server, create_loyverse, create_woocommerce
+from backend.drivers import loyapi, wcapi
+from backend.loyverse_extractor import extract_loyverse_data
+from backend.reconciler import reconcile
+from backend.wcapi_inserter import insert_to_woocommerce
+from backend.utils import REDIS_HOST, REDIS_PORT, WOOCOMMERCE_MAX_IN_FLIGHT
+from backend.utils.http import create_session, create_wcapi_client
+from backend.utils.redis import configure_redis, get_redis_connection
+from backend.utils.slugs import clear_slug_cache
+
+
+def get_server_stats(url):
+    """
+    :param url: Base url of a stand-in server
+    :return: dict of the request counters of the server
+    """
+    return requests.get('{}/_bench/stats'.format(url)).json()
+
+
+def reset_server_stats(url):
+    """
+    :param url: Base url of a stand-in server
+    """
+    requests.post('{}/_bench/reset'.format(url))
+
+
+def measure(phase, function, servers, trace_memory=True):
+    """
+    Function to run a phase of the benchmark and collect its numbers.
+
+    :param phase: Name of the phase
+    :param function: Function without arguments running the phase
+    :param servers: Dict of server name -> base url
+    :param trace_memory: Measure the peak memory with tracemalloc
+    :return: dict with the 'phase', its 'wall_time' in seconds, its 'peak_memory' in bytes (None without
+                trace_memory) and the stats of every server
+    """
+    for url in servers.values():
+        reset_server_stats(url)
+    if trace_memory:
+        tracemalloc.start()
+
+    started_at = time.perf_counter()
+    function()
+    wall_time = time.perf_counter() - started_at
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {'phase': phase, 'wall_time': wall_time, 'peak_memory': peak_memory}
+    for name, url in servers.items():
+        result[name] = get_server_stats(url)
+    return result
+
+
+def run_benchmark(skus, args):
+    """
+    Function to benchmark the sync of one catalog size.
+
+    :param skus: Number of SKUs of the catalog
+    :param args: Parsed command line arguments
+    :return: list of the results of every phase
+    """
+    loyverse_process, loyverse_url = start_server(create_loyverse, skus=skus, seed=args.seed,
+                                                  latency=args.loyverse_latency, throttle_every=args.throttle_every,
+                                                  retry_after=args.retry_after)
+    woocommerce_process, woocommerce_url = start_server(create_woocommerce, latency=args.wc_latency,
+                                                        item_latency=args.wc_item_latency,
+                                                        image_latency=args.wc_image_latency)
+    try:
+        get_redis_connection().flushdb()
+        wcapi.clear_taxonomy_cache()
+        clear_slug_cache()
+        loyapi.configure_api(loyverse_url, create_session(headers={'Authorization': 'Bearer benchmark'}))
+        wcapi.configure_request_limits(rate=args.rate, burst=max(args.rate, 1), max_in_flight=args.max_in_flight,
+                                       client=create_wcapi_client(woocommerce_url, 'ck_benchmark', 'cs_benchmark'))
+
+        servers = {'loyverse': loyverse_url, 'woocommerce': woocommerce_url}
+        trace_memory = not args.no_memory
+        if args.reconcile:
+            def insert():
+                reconcile(workers=args.workers)
+        else:
+            def insert():
+                insert_to_woocommerce(workers=args.workers)
+        phases = (
+            ('extract', lambda: extract_loyverse_data()),
+            ('insert', insert),
+            ('insert (unchanged)', insert),
+        )
+        results = list()
+        for phase, function in phases:
+            result = measure(phase, function, servers, trace_memory=trace_memory)
+            result['skus'] = skus
+            results.append(result)
+        return results
+    finally:
+        loyverse_process.terminate()
+        woocommerce_process.terminate()
+
+
+def print_results(results):
+    """
+    :param results: List of the results of every phase
+    """
+    header = '{:>8}  {:<20} {:>10} {:>10} {:>6} {:>12} {:>7} {:>10}'
+    row = '{:>8}  {:<20} {:>10.2f} {:>10} {:>6} {:>12} {:>7} {:>10}'
+    print(header.format('SKUs', 'Phase', 'Wall (s)', 'Loyverse', '429s', 'WooCommerce', 'Failed', 'Peak (MB)'))
+    for result in results:
+        peak_memory = '{:.1f}'.format(result['peak_memory'] / 2 ** 20) if result['peak_memory'] is not None else '-'
+        print(row.format(result['skus'], result['phase'], result['wall_time'],
+                         result['loyverse'].get('requests', 0), result['loyverse'].get('throttled', 0),
+                         result['woocommerce'].get('requests', 0), result['woocommerce'].get('failed', 0),
+                         peak_memory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sync against local stand-in servers')
+    parser.add_argument('--skus', type=int, nargs='+', default=[1000, 10000],
+                        help='Catalog sizes to benchmark, in SKUs (e.g. 1000 10000 100000)')
+    parser.add_argument('--workers', type=int, default=4, help='Workers of insert_to_woocommerce')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='Push with the reconciler (plan and apply) instead of insert_to_woocommerce')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalogs')
+    parser.add_argument('--loyverse-latency', type=float, default=0.0, help='Seconds added to every Loyverse request')
+    parser.add_argument('--throttle-every', type=int, default=0,
+                        help='Loyverse answers every Nth request with a 429. 0 never throttles')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After of the 429s, in seconds')
+    parser.add_argument('--wc-latency', type=float, default=0.0, help='Seconds added to every WooCommerce request')
+    parser.add_argument('--wc-item-latency', type=float, default=0.0,
+                        help='Seconds added for every product or variation WooCommerce writes')
+    parser.add_argument('--wc-image-latency', type=float, default=0.0,
+                        help='Seconds added for every image WooCommerce downloads')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Client rate limit for WooCommerce in requests per second. 0 disables it')
+    parser.add_argument('--max-in-flight', type=int, default=WOOCOMMERCE_MAX_IN_FLIGHT,
+                        help='Maximum concurrent WooCommerce requests')
+    parser.add_argument('--redis-host', default=REDIS_HOST)
+    parser.add_argument('--redis-port', type=int, default=REDIS_PORT)
+    parser.add_argument('--redis-db', type=int, default=15, help='Redis database to use. FLUSHED by the benchmark')
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Don't trace memory, so wall times aren't slowed down by tracemalloc")
+    parser.add_argument('--output', help='Write the results to this json file as well')
+    args = parser.parse_args()
+
+    configure_redis(args.redis_host, args.redis_port, args.redis_db)
+    results = list()
+    for skus in args.skus:
+        results.extend(run_benchmark(skus, args))
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
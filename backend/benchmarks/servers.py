@@ -0,0 +1,606 @@
+"""
+Local stand-in HTTP servers for the Loyverse API and the WooCommerce REST endpoints used by the drivers.
+
+Both keep their data in memory and emulate what matters for the sync's performance: cursor pagination and 429
+throttling on Loyverse, paged lists, batch endpoints, duplicate SKU errors and image downloads on WooCommerce, and a
+configurable latency on every request. Each server runs in a process of its own (start_server), so it doesn't compete
+with the benchmarked code for the GIL or show up in its memory.
+
+Every server also answers GET /_bench/stats with its request counters and POST /_bench/reset to zero them.
+"""
+import gzip
+import itertools
+import json
+import multiprocessing
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from backend.benchmarks.catalog import generate_catalog
+
+GZIP_MIN_SIZE = 1024  # Smaller responses are sent uncompressed
+
+
+class FakeAPI:
+    """
+    Base class of the stand-in APIs: routing, latency, throttling and request counters.
+    Subclasses list their routes as (method, regex, handler name). Handlers take the match groups, the query
+    parameters and the json body, and return a tuple of status code, json response and extra headers.
+    """
+    routes = ()
+
+    def __init__(self, latency=0.0, throttle_every=0, retry_after=0):
+        """
+        :param latency: Seconds added to every request
+        :param throttle_every: Answer every Nth request with a 429. 0 never throttles
+        :param retry_after: Retry-After header sent with a 429, in seconds
+        """
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.lock = threading.RLock()
+        self.stats = Counter()
+        self._compiled = [(method, re.compile(pattern), handler) for method, pattern, handler in self.routes]
+
+    def get_stats(self):
+        """
+        :return: dict with the total of 'requests', 'throttled' requests, 'failed' requests (any other 4xx),
+                    'bytes_in', 'bytes_out' and the number of requests of every route
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+
+    def dispatch(self, method, path, params, body, body_size=0):
+        """
+        :param method: HTTP method
+        :param path: Path of the url, without the query string
+        :param params: Dict of query parameters (single values)
+        :param body: Json body or None
+        :param body_size: Size of the request body in bytes
+        :return: tuple of status code, json response and dict of extra headers
+        """
+        if path == '/_bench/stats':
+            return 200, self.get_stats(), {}
+        if path == '/_bench/reset':
+            self.reset_stats()
+            return 200, {}, {}
+
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_in'] += body_size
+            throttled = self.throttle_every and self.stats['requests'] % self.throttle_every == 0
+            if throttled:
+                self.stats['throttled'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return 429, {'errors': [{'code': 'RATE_LIMITED'}]}, {'Retry-After': str(self.retry_after)}
+
+        for route_method, pattern, handler in self._compiled:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                with self.lock:
+                    self.stats['{} {}'.format(method, pattern.pattern)] += 1
+                status, response, headers = getattr(self, handler)(*match.groups(), params=params, body=body)
+                if 400 <= status < 500:
+                    with self.lock:
+                        self.stats['failed'] += 1
+                return status, response, headers
+        with self.lock:
+            self.stats['failed'] += 1
+        return 404, {'code': 'rest_no_route', 'message': 'No route was found matching the URL and request method'}, {}
+
+
+class FakeLoyverse(FakeAPI):
+    """
+    Stand-in for the Loyverse API: /items, /categories and /inventory with cursor pagination.
+    """
+    routes = (
+        ('GET', r'/items', 'list_items'),
+        ('GET', r'/categories', 'list_categories'),
+        ('GET', r'/inventory', 'list_inventory'),
+    )
+
+    def __init__(self, items, categories, page_limit=250, store_ids=('store-0',), **kwargs):
+        """
+        :param items: List of Loyverse item dicts
+        :param categories: List of Loyverse category dicts
+        :param page_limit: Maximum page size, like the real API
+        :param store_ids: Stores holding stock of every variant
+        :param kwargs: Latency and throttling options of FakeAPI
+        """
+        super().__init__(**kwargs)
+        self.items = items
+        self.categories = categories
+        self.page_limit = page_limit
+        self.inventory = [{'variant_id': variant['variant_id'], 'store_id': store_id, 'in_stock': 10,
+                           'updated_at': variant['updated_at']}
+                          for item in items for variant in item['variants'] for store_id in store_ids]
+
+    def _page(self, objects, key, params):
+        limit = min(int(params.get('limit', 50)), self.page_limit)
+        start = int(params.get('cursor') or 0)
+        response = {key: objects[start:start + limit]}
+        if start + limit < len(objects):
+            # Opaque to the client, which sends it back as is
+            response['cursor'] = str(start + limit)
+        return 200, response, {}
+
+    def list_items(self, params, body):
+        items = self.items
+        if 'items_ids' in params:
+            item_ids = set(params['items_ids'].split(','))
+            items = [item for item in items if item['id'] in item_ids]
+        if 'updated_at_min' in params:
+            items = [item for item in items if item['updated_at'] >= params['updated_at_min']]
+        if params.get('show_deleted') != 'true':
+            items = [item for item in items if not item.get('deleted_at')]
+        return self._page(items, 'items', params)
+
+    def list_categories(self, params, body):
+        categories = self.categories
+        if 'categories_ids' in params:
+            category_ids = set(params['categories_ids'].split(','))
+            categories = [category for category in categories if category['id'] in category_ids]
+        return self._page(categories, 'categories', params)
+
+    def list_inventory(self, params, body):
+        levels = self.inventory
+        if 'store_ids' in params:
+            store_ids = set(params['store_ids'].split(','))
+            levels = [level for level in levels if level['store_id'] in store_ids]
+        if 'variant_ids' in params:
+            variant_ids = set(params['variant_ids'].split(','))
+            levels = [level for level in levels if level['variant_id'] in variant_ids]
+        if 'updated_at_min' in params:
+            levels = [level for level in levels if level['updated_at'] >= params['updated_at_min']]
+        return self._page(levels, 'inventory_levels', params)
+
+
+def _error(code, message, status=400, **data):
+    return {'code': code, 'message': message, 'data': dict(status=status, **data)}
+
+
+def _unique_slug(slug, terms):
+    """
+    :return: the slug, with a numeric suffix if one of the terms has it already, like WordPress does
+    """
+    taken = {term['slug'] for term in terms}
+    suffix = 2
+    unique_slug = slug
+    while unique_slug in taken:
+        unique_slug = '{}-{}'.format(slug, suffix)
+        suffix += 1
+    return unique_slug
+
+
+class FakeWooCommerce(FakeAPI):
+    """
+    Stand-in for the WooCommerce REST API (wc/v3): attributes, attribute terms, categories, products and variations,
+    with their batch endpoints.
+    """
+    prefix = r'/wp-json/wc/v3/'
+    routes = (
+        ('GET', prefix + r'products/attributes', 'list_attributes'),
+        ('POST', prefix + r'products/attributes', 'create_attribute'),
+        ('POST', prefix + r'products/attributes/batch', 'batch_attributes'),
+        ('GET', prefix + r'products/attributes/(\d+)', 'get_attribute'),
+        ('GET', prefix + r'products/attributes/(\d+)/terms', 'list_terms'),
+        ('POST', prefix + r'products/attributes/(\d+)/terms', 'create_term'),
+        ('POST', prefix + r'products/attributes/(\d+)/terms/batch', 'batch_terms'),
+        ('GET', prefix + r'products/attributes/(\d+)/terms/(\d+)', 'get_term'),
+        ('GET', prefix + r'products/categories', 'list_categories'),
+        ('POST', prefix + r'products/categories', 'create_category'),
+        ('POST', prefix + r'products/categories/batch', 'batch_categories'),
+        ('GET', prefix + r'products/categories/(\d+)', 'get_category'),
+        ('GET', prefix + r'products', 'list_products'),
+        ('POST', prefix + r'products', 'create_product'),
+        ('POST', prefix + r'products/batch', 'batch_products'),
+        ('GET', prefix + r'products/(\d+)', 'get_product'),
+        ('DELETE', prefix + r'products/(\d+)', 'delete_product'),
+        ('GET', prefix + r'products/(\d+)/variations', 'list_variations'),
+        ('POST', prefix + r'products/(\d+)/variations', 'create_variation'),
+        ('POST', prefix + r'products/(\d+)/variations/batch', 'batch_variations'),
+        ('DELETE', prefix + r'products/(\d+)/variations/(\d+)', 'delete_variation'),
+    )
+
+    def __init__(self, batch_limit=100, item_latency=0.0, image_latency=0.0, **kwargs):
+        """
+        :param batch_limit: Maximum number of objects in a batch request, like the real API
+        :param item_latency: Seconds added for every product or variation written
+        :param image_latency: Seconds added for every image downloaded from a `src`
+        :param kwargs: Latency and throttling options of FakeAPI
+        """
+        super().__init__(**kwargs)
+        self.batch_limit = batch_limit
+        self.item_latency = item_latency
+        self.image_latency = image_latency
+        self.ids = itertools.count(1)
+        self.attributes = dict()
+        self.terms = dict()
+        self.categories = dict()
+        self.products = dict()
+        self.variations = dict()
+        self.skus = dict()
+        self.media = dict()
+
+    # Lists
+
+    def _page(self, objects, params):
+        per_page = min(int(params.get('per_page', 10)), 100)
+        page = int(params.get('page', 1))
+        total_pages = max(1, -(-len(objects) // per_page))
+        headers = {'X-WP-Total': str(len(objects)), 'X-WP-TotalPages': str(total_pages)}
+        return 200, objects[(page - 1) * per_page:page * per_page], headers
+
+    def _get(self, store, object_id):
+        with self.lock:
+            found = store.get(int(object_id))
+        if found is None:
+            return 404, _error('woocommerce_rest_invalid_id', 'Invalid ID.', status=404), {}
+        return 200, found, {}
+
+    # Attributes, terms and categories
+
+    def list_attributes(self, params, body):
+        with self.lock:
+            return 200, list(self.attributes.values()), {}
+
+    def get_attribute(self, attribute_id, params, body):
+        return self._get(self.attributes, attribute_id)
+
+    def create_attribute(self, params, body):
+        slug = 'pa_{}'.format(body.get('slug') or body['name'].lower())
+        with self.lock:
+            if any(attribute['slug'] == slug for attribute in self.attributes.values()):
+                return 400, _error('woocommerce_rest_cannot_create', 'Slug "{}" is already in use.'.format(slug)), {}
+            attribute = dict(body, id=next(self.ids), slug=slug)
+            self.attributes[attribute['id']] = attribute
+            self.terms[attribute['id']] = dict()
+        return 201, attribute, {}
+
+    def list_terms(self, attribute_id, params, body):
+        with self.lock:
+            return self._page(list(self.terms.get(int(attribute_id), {}).values()), params)
+
+    def get_term(self, attribute_id, term_id, params, body):
+        return self._get(self.terms.get(int(attribute_id), {}), term_id)
+
+    def create_term(self, attribute_id, params, body):
+        with self.lock:
+            terms = self.terms.get(int(attribute_id))
+            if terms is None:
+                return 404, _error('woocommerce_rest_taxonomy_invalid', 'Resource does not exist.', status=404), {}
+            for term in terms.values():
+                if term['name'] == body['name']:
+                    return 400, _error('term_exists', 'A term with the name provided already exists.',
+                                       resource_id=term['id']), {}
+            term = dict(body, id=next(self.ids))
+            term['slug'] = _unique_slug(body.get('slug') or body['name'].lower(), terms.values())
+            terms[term['id']] = term
+        return 201, term, {}
+
+    def list_categories(self, params, body):
+        with self.lock:
+            return self._page(list(self.categories.values()), params)
+
+    def get_category(self, category_id, params, body):
+        return self._get(self.categories, category_id)
+
+    def create_category(self, params, body):
+        with self.lock:
+            for category in self.categories.values():
+                if category['name'] == body['name']:
+                    return 400, _error('term_exists', 'A term with the name provided already exists.',
+                                       resource_id=category['id']), {}
+            category = dict(body, id=next(self.ids))
+            category['slug'] = _unique_slug(body.get('slug') or body['name'].lower(), self.categories.values())
+            self.categories[category['id']] = category
+        return 201, category, {}
+
+    # Products and variations
+
+    def _set_images(self, target, data, variation):
+        """
+        Function to resolve the images of a write into media items, downloading the ones sent by `src`.
+
+        :return: error dict or None
+        """
+        images = [data['image']] if variation and data.get('image') else data.get('images') or []
+        resolved = list()
+        for image in images:
+            if image.get('id'):
+                with self.lock:
+                    src = self.media.get(image['id'])
+                if src is None:
+                    kind = 'variation' if variation else 'product'
+                    return _error('woocommerce_{}_invalid_image_id'.format(kind),
+                                  '#{} is an invalid image ID.'.format(image['id']))
+                resolved.append({'id': image['id'], 'src': src})
+            elif image.get('src'):
+                if self.image_latency:
+                    time.sleep(self.image_latency)
+                with self.lock:
+                    self.stats['images_downloaded'] += 1
+                    media_id = next(self.ids)
+                    self.media[media_id] = image['src']
+                resolved.append({'id': media_id, 'src': image['src']})
+        if variation and 'image' in data:
+            target['image'] = resolved[0] if resolved else None
+        elif 'images' in data:
+            target['images'] = resolved
+        return None
+
+    def _write(self, data, parent_id=None, object_id=None):
+        """
+        Function to create (object_id None) or update a product or a variation.
+
+        :return: the object or an error dict
+        """
+        variation = parent_id is not None
+        if self.item_latency:
+            time.sleep(self.item_latency)
+
+        with self.lock:
+            store = self.variations.get(parent_id) if variation else self.products
+            if store is None:
+                return _error('woocommerce_rest_product_invalid_id', 'Invalid ID.', status=404)
+            if object_id is not None and object_id not in store:
+                return _error('woocommerce_rest_product_invalid_id', 'Invalid ID.', status=404)
+            sku = data.get('sku')
+            if sku and sku in self.skus and self.skus[sku] != object_id:
+                return _error('product_invalid_sku', 'Invalid or duplicated SKU.', resource_id=self.skus[sku],
+                              unique_sku=sku)
+
+        fields = {key: value for key, value in data.items() if key not in ('image', 'images', 'id')}
+        target = dict()
+        error = self._set_images(target, data, variation)
+        if error:
+            return error
+
+        with self.lock:
+            if object_id is None:
+                obj = dict(id=next(self.ids), parent_id=parent_id or 0, sku='', images=[],
+                           type='variation' if variation else fields.get('type', 'simple'))
+                if not variation:
+                    obj['slug'] = fields.get('slug') or 'product-{}'.format(obj['id'])
+                    self.variations[obj['id']] = dict()
+                store[obj['id']] = obj
+            else:
+                obj = store[object_id]
+                if obj.get('sku') and fields.get('sku', obj['sku']) != obj['sku']:
+                    self.skus.pop(obj['sku'], None)
+            obj.update(fields)
+            obj.update(target)
+            if obj.get('sku'):
+                self.skus[obj['sku']] = obj['id']
+            return dict(obj)
+
+    def _remove(self, parent_id, object_id):
+        with self.lock:
+            store = self.variations.get(parent_id, {}) if parent_id is not None else self.products
+            obj = store.pop(object_id, None)
+            if obj is None:
+                return None
+            if obj.get('sku'):
+                self.skus.pop(obj['sku'], None)
+            if parent_id is None:
+                for variation in self.variations.pop(object_id, {}).values():
+                    if variation.get('sku'):
+                        self.skus.pop(variation['sku'], None)
+            return obj
+
+    def _single(self, result, created=True):
+        if 'code' in result:
+            return result['data']['status'], result, {}
+        return 201 if created else 200, result, {}
+
+    def _check_batch_size(self, body):
+        """
+        :return: error response tuple if the batch holds too many objects, None otherwise
+        """
+        size = sum(len(body.get(action, [])) for action in ('create', 'update', 'delete'))
+        if size > self.batch_limit:
+            return 413, _error('woocommerce_rest_request_entity_too_large',
+                               'Unable to accept more than {} items for this request.'.format(self.batch_limit),
+                               status=413), {}
+        return None
+
+    def _batch_entry(self, result, object_id=0):
+        """
+        :return: entry of a batch response for the result of a write, counting the failed ones
+        """
+        if 'code' in result:
+            with self.lock:
+                self.stats['failed_items'] += 1
+            return {'id': object_id, 'error': result}
+        return result
+
+    def _batch_taxonomy(self, create_handler, body, *args):
+        """
+        Function to run the creates of a batch of attributes, terms or categories through their single create handler.
+        """
+        too_large = self._check_batch_size(body)
+        if too_large:
+            return too_large
+        created = [create_handler(*args, params={}, body=data)[1] for data in body.get('create', [])]
+        return 200, {'create': [self._batch_entry(result) for result in created], 'update': [], 'delete': []}, {}
+
+    def batch_attributes(self, params, body):
+        return self._batch_taxonomy(self.create_attribute, body)
+
+    def batch_terms(self, attribute_id, params, body):
+        return self._batch_taxonomy(self.create_term, body, attribute_id)
+
+    def batch_categories(self, params, body):
+        return self._batch_taxonomy(self.create_category, body)
+
+    def _batch(self, body, parent_id=None):
+        create = body.get('create', [])
+        update = body.get('update', [])
+        delete = body.get('delete', [])
+        too_large = self._check_batch_size(body)
+        if too_large:
+            return too_large
+        if parent_id is not None and parent_id not in self.variations:
+            return 404, _error('woocommerce_rest_product_invalid_id', 'Invalid ID.', status=404), {}
+
+        as_entry = self._batch_entry
+
+        response = {
+            'create': [as_entry(self._write(data, parent_id)) for data in create],
+            'update': [as_entry(self._write(data, parent_id, data.get('id')), data.get('id')) for data in update],
+        }
+        deleted = list()
+        for object_id in delete:
+            obj = self._remove(parent_id, object_id)
+            deleted.append(obj or as_entry(_error('woocommerce_rest_invalid_id', 'Invalid ID.', status=404), object_id))
+        response['delete'] = deleted
+        return 200, response, {}
+
+    def list_products(self, params, body):
+        with self.lock:
+            if 'sku' in params:
+                object_id = self.skus.get(params['sku'])
+                found = self.products.get(object_id)
+                if found is None:
+                    found = next((variations[object_id] for variations in self.variations.values()
+                                  if object_id in variations), None)
+                return self._page([found] if found else [], params)
+            products = list(self.products.values())
+        if 'slug' in params:
+            products = [product for product in products if product.get('slug') == params['slug']]
+        return self._page(products, params)
+
+    def get_product(self, product_id, params, body):
+        return self._get(self.products, product_id)
+
+    def create_product(self, params, body):
+        return self._single(self._write(body))
+
+    def batch_products(self, params, body):
+        return self._batch(body)
+
+    def delete_product(self, product_id, params, body):
+        obj = self._remove(None, int(product_id))
+        if obj is None:
+            return 404, _error('woocommerce_rest_product_invalid_id', 'Invalid ID.', status=404), {}
+        return 200, obj, {}
+
+    def list_variations(self, product_id, params, body):
+        with self.lock:
+            return self._page(list(self.variations.get(int(product_id), {}).values()), params)
+
+    def create_variation(self, product_id, params, body):
+        return self._single(self._write(body, int(product_id)))
+
+    def batch_variations(self, product_id, params, body):
+        return self._batch(body, int(product_id))
+
+    def delete_variation(self, product_id, variation_id, params, body):
+        obj = self._remove(int(product_id), int(variation_id))
+        if obj is None:
+            return 404, _error('woocommerce_rest_product_invalid_id', 'Invalid ID.', status=404), {}
+        return 200, obj, {}
+
+
+def make_handler(api):
+    """
+    :param api: FakeAPI object
+    :return: BaseHTTPRequestHandler class serving the api with keep-alive connections
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _handle(self, method):
+            url = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+            body = json.loads(raw_body) if raw_body else None
+
+            status, response, headers = api.dispatch(method, url.path, params, body, len(raw_body))
+
+            payload = json.dumps(response).encode()
+            if 'gzip' in self.headers.get('Accept-Encoding', '') and len(payload) >= GZIP_MIN_SIZE:
+                payload = gzip.compress(payload, compresslevel=1)
+                headers = dict(headers, **{'Content-Encoding': 'gzip'})
+            if not url.path.startswith('/_bench/'):
+                with api.lock:
+                    api.stats['bytes_out'] += len(payload)
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PUT(self):
+            self._handle('PUT')
+
+        def do_DELETE(self):
+            self._handle('DELETE')
+
+    return Handler
+
+
+def create_loyverse(skus, categories=20, images=100, seed=0, **options):
+    """
+    :param skus: Number of SKUs of the synthetic catalog
+    :param categories: Number of categories
+    :param images: Number of distinct image urls
+    :param seed: Seed of the catalog
+    :param options: Options of FakeLoyverse
+    :return: FakeLoyverse serving a synthetic catalog
+    """
+    items, category_dicts = generate_catalog(skus, categories=categories, images=images, seed=seed)
+    return FakeLoyverse(items, category_dicts, **options)
+
+
+def create_woocommerce(**options):
+    """
+    :param options: Options of FakeWooCommerce
+    :return: empty FakeWooCommerce
+    """
+    return FakeWooCommerce(**options)
+
+
+def _serve(factory, options, ready):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(factory(**options)))
+    server.daemon_threads = True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(factory, **options):
+    """
+    Function to start a stand-in server in a process of its own.
+
+    :param factory: create_loyverse or create_woocommerce
+    :param options: Arguments of the factory
+    :return: tuple with the process (terminate it to stop the server) and the base url of the server
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(factory, options, ready), daemon=True)
+    process.start()
+    port = ready.get()
+    return process, 'http://127.0.0.1:{}'.format(port)
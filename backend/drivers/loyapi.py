@@ -1,135 +1,190 @@
-import requests
-
-from backend.utils import LOYVERSE_API_BASE, LOYVERSE_ALL_ITEMS_ENDPOINT, LOYVERSE_ALL_CATEGORIES_ENDPOINT, Loytoken
+from backend.utils import (LOYVERSE_API_BASE, LOYVERSE_ALL_ITEMS_ENDPOINT, LOYVERSE_ALL_CATEGORIES_ENDPOINT,
+                           LOYVERSE_INVENTORY_ENDPOINT, LOYVERSE_PAGE_LIMIT, LOYVERSE_POOL_SIZE,
+                           LOYVERSE_PREFETCH_PAGES, Loytoken)
+from backend.utils.concurrency import prefetch
+from backend.utils.http import create_session
 from backend.utils.loyverse import determine_cursor
+from backend.utils.retry import RetryPolicy, CircuitBreaker, request_with_retry
+from backend.utils.metrics import timed_request
+
+_session = None
+_api_base = LOYVERSE_API_BASE
+retry_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
 
 
-def get_items_all(debug=False):
+class LoyverseAPIError(Exception):
+    """
+    Raised when Loyverse keeps answering with an error after all retries.
     """
-    Function to get all items (make recurring calls) from Loyverse database
 
-    :param debug: Boolean to print stuff on console for debugging
-    :returns: list of dicts containing information about every item in Loyverse system
+    def __init__(self, response):
+        self.response = response
+        super().__init__('Loyverse API error {}: {}'.format(response.status_code, response.text))
+
+
+def get_session():
     """
-    get_items_url = LOYVERSE_API_BASE + LOYVERSE_ALL_ITEMS_ENDPOINT
-    headers = {
-        'Authorization': Loytoken,
-    }
+    Function to get the HTTP session used for every Loyverse call.
+    The session keeps connections alive between pages instead of opening a new connection for every request.
 
-    # First call
-    params = {
-        'limit': 250
-    }
-    response = requests.get(get_items_url, params=params, headers=headers)
+    :return: PooledSession object with the Loyverse authorization header set
+    """
+    global _session
+    if _session is None:
+        _session = create_session(headers={'Authorization': Loytoken}, pool_size=LOYVERSE_POOL_SIZE)
+    return _session
 
-    if response.status_code == 200:
-        response_json = response.json()
-    else:
-        response_json = None
-        if debug:
-            print("Error encountered: {}".format(response.text))
-        exit()
 
-    # Variable to store all items in...
-    all_items = response_json['items']
+def configure_api(api_base=LOYVERSE_API_BASE, session=None):
+    """
+    Function to point the driver to another Loyverse account or server, e.g. a stand-in server for benchmarks.
+
+    :param api_base: Base url of the API
+    :param session: Session to use for every call, e.g. from utils.http.create_session with the account's token.
+                None keeps the current session
+    """
+    global _api_base, _session
+    _api_base = api_base
+    if session is not None:
+        _session = session
 
-    # Check if more results are needed
-    cursor = determine_cursor(response_json)
 
-    # Iterate until the last batch of items received
-    pages = 1
-    while cursor:
+def iter_pages(endpoint, results_key, params=None, cursor=None, debug=False, client=None):
+    """
+    Function to go through every page of a Loyverse list endpoint, following the cursor.
+    Throttled (429) and failed requests are retried with the shared backoff policy. If a page still fails, a
+    LoyverseAPIError is raised; everything yielded before that stays valid and the cursor of the last good page can be
+    used to resume.
+
+    :param endpoint: Loyverse endpoint to call, e.g. LOYVERSE_ALL_ITEMS_ENDPOINT
+    :param results_key: Key of the list in the response json, e.g. 'items'
+    :param params: Extra query parameters
+    :param cursor: Cursor to start from instead of the first page
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: Session to use instead of the driver's, e.g. from utils.http.create_session
+    :return: generator yielding tuples of the list of results of every page and the cursor of the next page (None on
+                the last page)
+    """
+    url = _api_base + endpoint
+    session = client if client is not None else get_session()
+    params = dict(params or {})
+    params.setdefault('limit', LOYVERSE_PAGE_LIMIT)
+    if cursor:
         params['cursor'] = cursor
-        response = requests.get(get_items_url, params=params, headers=headers)
 
-        if response.status_code == 200:
-            response_json = response.json()
-            if debug:
-                print("{} pages recieved.".format(pages))
-                pages += 1
-        elif response.status_code == 429:
-            if debug:
-                print("Rerunning page: {}.".format(pages))
-            continue
-        else:
-            response_json = None
-            # TODO: Decision: Try again, add logic based on error, or stop iteration but still use the items that are
-            #  received in previous iterations
+    def send():
+        return timed_request('loyverse', 'GET', endpoint, lambda: session.get(url, params=params))
+
+    pages = 0
+    while True:
+        response = request_with_retry(send, retry_policy, circuit_breaker,
+                                      description='page {} of {}'.format(pages + 1, endpoint),
+                                      metric_labels=('loyverse', 'GET', endpoint), debug=debug)
+        if response.status_code != 200:
             if debug:
                 print("Error encountered: {}".format(response.text))
-            exit()
+            raise LoyverseAPIError(response)
+
+        response_json = response.json()
+        pages += 1
+        if debug:
+            print("{} pages recieved.".format(pages))
 
-        all_items = all_items + response_json['items']
+        # Check if more results are needed
         cursor = determine_cursor(response_json)
+        yield response_json[results_key], cursor
+
+        if not cursor:
+            return
+        params['cursor'] = cursor
+
+
+def iter_items_pages(cursor=None, updated_at_min=None, show_deleted=False, item_ids=None,
+                     prefetch_pages=LOYVERSE_PREFETCH_PAGES, debug=False, client=None):
+    """
+    Function to stream all items from Loyverse page by page.
+    The next pages are downloaded on a background thread while the caller processes the current one.
+
+    :param cursor: Cursor to start from instead of the first page, e.g. a checkpoint of a failed run
+    :param updated_at_min: Only get items updated at or after this ISO 8601 timestamp
+    :param show_deleted: Include deleted items (and deleted variants). They have a 'deleted_at' timestamp
+    :param item_ids: Only get the items with these ids
+    :param prefetch_pages: Number of pages to download ahead of the caller
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: Session to use instead of the driver's, e.g. from utils.http.create_session
+    :return: generator yielding tuples of a list of dicts containing information about the items of each page and the
+                cursor of the next page
+    """
+    params = dict()
+    if updated_at_min:
+        params['updated_at_min'] = updated_at_min
+    if show_deleted:
+        params['show_deleted'] = 'true'
+    if item_ids:
+        params['items_ids'] = ','.join(item_ids)
+
+    return prefetch(iter_pages(LOYVERSE_ALL_ITEMS_ENDPOINT, 'items', params=params, cursor=cursor, debug=debug,
+                               client=client), size=prefetch_pages)
+
+
+def get_items_all(debug=False, client=None):
+    """
+    Function to get all items (make recurring calls) from Loyverse database
+
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: Session to use instead of the driver's, e.g. from utils.http.create_session
+    :returns: list of dicts containing information about every item in Loyverse system
+    """
+    all_items = list()
+    for items, _ in iter_items_pages(debug=debug, client=client):
+        all_items.extend(items)
 
     return all_items
 
 
-def get_categories_all(categories, debug=False):
+def get_categories_all(categories, debug=False, client=None):
     """
     Function to get all categories specified by the arguments from Loyverse
 
     :param categories: list of category ids
     :param debug: Boolean to print stuff on console for debugging
+    :param client: Session to use instead of the driver's, e.g. from utils.http.create_session
     :return: dict containing dicts of categories with their id as key
     """
     # Comma-separated string containing all the categories of interest we need
-    categories_ids = ','.join(categories)
-
-    get_categories_url = LOYVERSE_API_BASE + LOYVERSE_ALL_CATEGORIES_ENDPOINT
-    headers = {
-        'Authorization': Loytoken,
-    }
-
-    # First call
     params = {
-        'limit': 250,
-        'categories_ids': categories_ids
+        'categories_ids': ','.join(categories)
     }
-    response = requests.get(get_categories_url, params=params, headers=headers)
-
-    if response.status_code == 200:
-        response_json = response.json()
-    else:
-        response_json = None
-        if debug:
-            print("Error encountered: {}".format(response.text))
-        exit()
 
-    # Variable to store all items in...
-    all_categories = response_json['categories']
-
-    # Check if more results are needed
-    cursor = determine_cursor(response_json)
-
-    # Iterate until the last batch of items received
-    pages = 1
-    while cursor:
-        params['cursor'] = cursor
-        response = requests.get(get_categories_url, params=params, headers=headers)
+    all_categories_dict = dict()
+    for categories_page, _ in iter_pages(LOYVERSE_ALL_CATEGORIES_ENDPOINT, 'categories', params=params, debug=debug,
+                                         client=client):
+        for category in categories_page:
+            all_categories_dict[category['id']] = category
 
-        if response.status_code == 200:
-            response_json = response.json()
-            if debug:
-                print("{} pages recieved.".format(pages))
-                pages += 1
-        elif response.status_code == 429:
-            if debug:
-                print("Rerunning page: {}.".format(pages))
-            continue
-        else:
-            response_json = None
-            # TODO: Decision: Try again, add logic based on error, or stop iteration but still use the items that are
-            #  received in previous iterations
-            if debug:
-                print("Error encountered: {}".format(response.text))
-            exit()
+    return all_categories_dict
 
-        all_categories = all_categories + response_json['categories']
-        cursor = determine_cursor(response_json)
 
-    all_categories_dict = dict()
-    for category in all_categories:
-        all_categories_dict[category['id']] = category
+def iter_inventory_pages(store_ids=None, variant_ids=None, updated_at_min=None, debug=False, client=None):
+    """
+    Function to stream inventory levels from Loyverse page by page.
 
-    return all_categories_dict
+    :param store_ids: List of store ids to get levels for. None gets every store
+    :param variant_ids: List of variant ids to get levels for. None gets every variant
+    :param updated_at_min: Only get levels updated at or after this ISO 8601 timestamp
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: Session to use instead of the driver's, e.g. from utils.http.create_session
+    :return: generator yielding lists of inventory level dicts ('variant_id', 'store_id', 'in_stock', 'updated_at')
+    """
+    params = dict()
+    if store_ids:
+        params['store_ids'] = ','.join(store_ids)
+    if variant_ids:
+        params['variant_ids'] = ','.join(variant_ids)
+    if updated_at_min:
+        params['updated_at_min'] = updated_at_min
+
+    for inventory_levels, _ in iter_pages(LOYVERSE_INVENTORY_ENDPOINT, 'inventory_levels', params=params, debug=debug,
+                                          client=client):
+        yield inventory_levels
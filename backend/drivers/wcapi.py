@@ -1,40 +1,319 @@
 """
 Driver to make changes to WooCommerce System using the API
 """
+import html
 import json
+import threading
+
 from backend.utils import (WOOCOMMERCE_ATTRIBUTES_ENDPOINT, WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F,
                            WOOCOMMERCE_CATEGORIES_ENDPOINT, WOOCOMMERCE_PRODUCTS_ENDPOINT,
-                           WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F, wcapi)
+                           WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F, WOOCOMMERCE_PRODUCTS_BATCH_ENDPOINT,
+                           WOOCOMMERCE_PRODUCT_VARIATIONS_BATCH_ENDPOINT_F, WOOCOMMERCE_CATEGORIES_BATCH_ENDPOINT,
+                           WOOCOMMERCE_ATTRIBUTES_BATCH_ENDPOINT, WOOCOMMERCE_ATTRIBUTE_TERMS_BATCH_ENDPOINT_F,
+                           WOOCOMMERCE_BATCH_SIZE,
+                           WOOCOMMERCE_RATE_LIMIT, WOOCOMMERCE_RATE_BURST, WOOCOMMERCE_MAX_IN_FLIGHT,
+                           WOOCOMMERCE_PAGE_SIZE, SLUG_PREFIXES, PRODUCT_FINGERPRINTS_KEY, VARIANT_FINGERPRINTS_KEY,
+                           chunk_list)
+from backend.utils import wcapi as wcapi_settings
+from backend.utils.http import create_wcapi_client_from
+from backend.utils.images import get_image_src, lookup_image, register_images, forget_images
+from backend.utils.concurrency import RateLimitedClient, get_host_limiter, run_in_pool
+from backend.utils.retry import RetryPolicy, CircuitBreaker, RetryingClient
+from backend.utils.slugs import register_slugs, get_slug
+from backend.utils.metrics import InstrumentedClient
+from backend.utils.wc_index import (is_index_warm, clear_index, mark_index_warm, index_products, lookup_slug,
+                                    lookup_sku, remove_from_index, iter_indexed_slugs, iter_indexed_skus)
+from backend.utils.fingerprint import forget_missing
+from backend.utils.stock import forget_pushed_stock
+
+
+class WooCommerceAPIError(Exception):
+    """
+    Raised when WooCommerce answers a page of a list with an error, so nothing is built from part of the list.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        super().__init__('WooCommerce API error {}: {}'.format(response.status_code, response.text))
 
 
-def get_attribute(att_id):
+# Pooled client with the credentials of auth.py. Every driver function uses the rate limited and retrying wrapper
+# (wcapi) unless it is given another client
+wcapi_client = create_wcapi_client_from(wcapi_settings)
+wcapi = None
+retry_policy = RetryPolicy()
+circuit_breaker = CircuitBreaker()
+
+
+def wrap_client(client, rate=WOOCOMMERCE_RATE_LIMIT, burst=WOOCOMMERCE_RATE_BURST,
+                max_in_flight=WOOCOMMERCE_MAX_IN_FLIGHT, policy=retry_policy, breaker=None):
+    """
+    Function to put a client behind the rate limiter of its host, a cap on concurrent requests and retries.
+    Every attempt is recorded in the metrics.
+
+    :param client: Client with get/post/put/delete/options methods, e.g. from utils.http.create_wcapi_client
+    :param rate: Requests per second allowed for the WooCommerce host. None or 0 disables the rate limit
+    :param burst: Requests that can be sent at once before the rate limit kicks in
+    :param max_in_flight: Maximum number of requests running at the same time
+    :param policy: RetryPolicy object
+    :param breaker: CircuitBreaker object. Defaults to a new one for this client
+    :return: client to pass to the driver functions
+    """
+    instrumented = InstrumentedClient(client)
+    rate_limited = RateLimitedClient(instrumented, get_host_limiter(client.url, rate, burst), max_in_flight)
+    # Retry outside of the rate limiter so a request waiting for its backoff doesn't hold an in-flight slot
+    return RetryingClient(rate_limited, policy, breaker if breaker is not None else CircuitBreaker())
+
+
+def configure_request_limits(rate=WOOCOMMERCE_RATE_LIMIT, burst=WOOCOMMERCE_RATE_BURST,
+                             max_in_flight=WOOCOMMERCE_MAX_IN_FLIGHT, client=None):
+    """
+    Function to set the rate limit and the cap on concurrent requests for every call made by this driver.
+    Every call is also retried with backoff on throttling and server errors, and stops when the circuit breaker opens.
+
+    :param rate: Requests per second allowed for the WooCommerce host. None or 0 disables the rate limit
+    :param burst: Requests that can be sent at once before the rate limit kicks in
+    :param max_in_flight: Maximum number of requests running at the same time
+    :param client: Client to use from now on instead of the one built from auth.py, e.g. for another shop
+    """
+    global wcapi, wcapi_client
+    if client is not None:
+        wcapi_client = client
+    wcapi = wrap_client(wcapi_client, rate, burst, max_in_flight, retry_policy, circuit_breaker)
+
+
+def get_client(client=None):
+    """
+    :param client: Client given to a driver function or None
+    :return: the client, or the driver's rate limited and retrying client if it is None
+    """
+    return client if client is not None else wcapi
+
+
+configure_request_limits()
+
+# In-memory cache of attributes (by slug), attribute terms (by attribute id and slug) and categories (by slug).
+# Loaded with a few list calls by load_taxonomy_cache. While loaded, post_attribute, post_attribute_term and
+# post_category only call the API for objects missing from the cache, and add what they create to it.
+_taxonomy_cache = {
+    'loaded': False,
+    'attributes': dict(),
+    'terms': dict(),
+    'categories': dict(),
+}
+_taxonomy_lock = threading.Lock()
+
+
+def _attribute_cache_key(slug):
+    # WooCommerce recognizes 'color' and 'pa_color' as same slug.
+    return slug[3:] if slug.startswith('pa_') else slug
+
+
+def _cache_taxonomy(kind, key, value):
+    """
+    Function to write an object returned by the API back into the taxonomy cache, if it is loaded.
+
+    :param kind: 'attributes', 'terms' or 'categories'
+    :param key: Cache key of the object
+    :param value: Dict of the object. Ignored unless it has an 'id'
+    """
+    if not value or not isinstance(value, dict) or not value.get('id'):
+        return
+    with _taxonomy_lock:
+        if _taxonomy_cache['loaded']:
+            _taxonomy_cache[kind][key] = value
+
+
+def _get_cached_taxonomy(kind, key):
+    """
+    :param kind: 'attributes', 'terms' or 'categories'
+    :param key: Cache key of the object
+    :return: cached dict or None if the cache isn't loaded or the object isn't in it
+    """
+    with _taxonomy_lock:
+        if not _taxonomy_cache['loaded']:
+            return None
+        return _taxonomy_cache[kind].get(key)
+
+
+def load_taxonomy_cache(workers=1, debug=False, client=None):
+    """
+    Function to load every attribute, attribute term and category from WooCommerce into the taxonomy cache.
+    The cache is only marked loaded once every list was read, so missing objects are never mistaken for new ones.
+
+    :param workers: Number of attributes whose terms are listed concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :raises WooCommerceAPIError: if a list could not be read. The cache is left as it was
+    """
+    # Same call as get_attributes_all, but an error must not pass for a shop without attributes
+    response = get_client(client).get(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, params={'context': 'edit'})
+    if response.status_code != 200:
+        raise WooCommerceAPIError(response)
+    attributes = dict()
+    for attribute in response.json():
+        attributes[_attribute_cache_key(attribute['slug'])] = attribute
+
+    terms = dict()
+
+    def load_terms(attribute):
+        for attribute_terms in iter_list(WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F.format(attribute['id']), client=client):
+            for term in attribute_terms:
+                terms[(attribute['id'], term['slug'])] = term
+
+    run_in_pool(load_terms, list(attributes.values()), workers=workers)
+
+    categories = dict()
+    for categories_page in iter_list(WOOCOMMERCE_CATEGORIES_ENDPOINT, client=client):
+        for category in categories_page:
+            categories[category['slug']] = category
+
+    with _taxonomy_lock:
+        _taxonomy_cache['attributes'] = attributes
+        _taxonomy_cache['terms'] = terms
+        _taxonomy_cache['categories'] = categories
+        _taxonomy_cache['loaded'] = True
+
+    if debug:
+        print("Cached {} attributes, {} attribute terms and {} categories".format(len(attributes), len(terms),
+                                                                                len(categories)))
+
+
+def lookup_attribute(slug):
+    """
+    :param slug: Slug of an attribute, with or without the 'pa_' prefix
+    :return: WooCommerce id of the attribute or None if it isn't in the taxonomy cache
+    """
+    return (_get_cached_taxonomy('attributes', _attribute_cache_key(slug)) or {}).get('id')
+
+
+def lookup_attribute_term(attribute_id, slug):
+    """
+    :param attribute_id: ID of the attribute of the term
+    :param slug: Slug of the attribute term
+    :return: WooCommerce id of the term or None if it isn't in the taxonomy cache
+    """
+    return (_get_cached_taxonomy('terms', (attribute_id, slug)) or {}).get('id')
+
+
+def lookup_category(slug):
+    """
+    :param slug: Slug of a category
+    :return: WooCommerce id of the category or None if it isn't in the taxonomy cache
+    """
+    return (_get_cached_taxonomy('categories', slug) or {}).get('id')
+
+
+def _get_cached_slugs(kind, prefix, attribute_id=None):
+    """
+    :param kind: 'attributes', 'terms' or 'categories'
+    :param prefix: Prefix of the slugs this driver creates. Objects without it were not created by the sync
+    :param attribute_id: Id of the attribute, for its terms
+    :return: dict of name -> slug of the cached objects. The oldest object wins if several have the same name. Empty
+                if the cache isn't loaded
+    """
+    with _taxonomy_lock:
+        if not _taxonomy_cache['loaded']:
+            return dict()
+        if kind == 'terms':
+            cached = [(key[1], term) for key, term in _taxonomy_cache['terms'].items() if key[0] == attribute_id]
+        else:
+            cached = list(_taxonomy_cache[kind].items())
+
+    slugs = dict()
+    for slug, value in sorted(cached, key=lambda item: item[1]['id']):
+        # WooCommerce returns names with HTML entities, e.g. 'Fish &amp; Chips'
+        if slug.startswith(prefix):
+            slugs.setdefault(html.unescape(value['name']), slug)
+    return slugs
+
+
+def _print_collisions(entity_type, collisions):
+    for name, other_name, slug in collisions:
+        print("Slug collision: {} {!r} has the slug of {!r}, using {}".format(entity_type, name, other_name, slug))
+
+
+def register_category_slugs(names, debug=False):
+    """
+    Function to register the slugs of category names in the slug registry before any of them is created.
+    Categories already in the taxonomy cache keep their slug.
+
+    :param names: Iterable of category names
+    :param debug: Boolean to print stuff on console for debugging
+    :return: list of collisions from register_slugs
+    """
+    collisions = register_slugs('category', names,
+                                existing=_get_cached_slugs('categories', SLUG_PREFIXES['category']))
+    if debug:
+        _print_collisions('category', collisions)
+    return collisions
+
+
+def register_attribute_slugs(attributes, debug=False):
+    """
+    Function to register the slugs of attributes and of their terms in the slug registry before any of them is
+    created. Terms are registered per attribute, since their slugs only need to be unique within it. Attributes and
+    terms already in the taxonomy cache keep their slug.
+
+    :param attributes: Dict of attribute name -> Attribute record or dict with the 'terms' of the attribute
+    :param debug: Boolean to print stuff on console for debugging
+    :return: list of collisions from register_slugs
+    """
+    collisions = register_slugs('attribute', attributes,
+                                existing=_get_cached_slugs('attributes', SLUG_PREFIXES['attribute']))
+    if debug:
+        _print_collisions('attribute', collisions)
+    for name in attributes:
+        attribute_id = lookup_attribute(get_slug('attribute', name))
+        existing = _get_cached_slugs('terms', SLUG_PREFIXES['attribute_term'], attribute_id) if attribute_id else None
+        term_collisions = register_slugs('attribute_term', attributes[name]['terms'], scope=name, existing=existing)
+        if debug:
+            _print_collisions('attribute term', term_collisions)
+        collisions += term_collisions
+    return collisions
+
+
+def clear_taxonomy_cache():
+    """
+    Function to empty and unload the taxonomy cache. Create calls go straight to the API again afterwards.
+    """
+    with _taxonomy_lock:
+        _taxonomy_cache['attributes'] = dict()
+        _taxonomy_cache['terms'] = dict()
+        _taxonomy_cache['categories'] = dict()
+        _taxonomy_cache['loaded'] = False
+
+
+def get_attribute(att_id, client=None):
     """
     Function to get attribute information using the provided id.
 
     :param att_id: ID of the Attribute to get.
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: dictionary containing attribute information or None if attribute was not found
     """
-    response = wcapi.get("{}/{}".format(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, att_id))
+    response = get_client(client).get("{}/{}".format(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, att_id))
     if response.status_code == 404:
         return None
     return response.json()
 
 
-def get_attributes_all():
+def get_attributes_all(client=None):
     """
     Function to get all attributes.
 
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: list of dicts containing attribute information
     """
     params = {'context': 'edit'}
-    response = wcapi.get(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, params=params)
+    response = get_client(client).get(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, params=params)
     if response.status_code != 200:
         return None
 
     return response.json()
 
 
-def post_attribute(name, slug, att_type='select', order_by='menu_order', has_archives=True):
+def post_attribute(name, slug, att_type='select', order_by='menu_order', has_archives=True, client=None):
     """
     Function to create an attribute in WooCommerce System.
     Attributes are unique on slug in WooCommerce System
@@ -44,9 +323,14 @@ def post_attribute(name, slug, att_type='select', order_by='menu_order', has_arc
     :param att_type: Type of the attribute. Default: 'select'
     :param order_by: How to order in the menu. Default: 'menu_order'
     :param has_archives: Attribute has archives or not. Default: 'True'
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
 
     :return: dictionary containing attribute information
     """
+    cached = _get_cached_taxonomy('attributes', _attribute_cache_key(slug))
+    if cached:
+        return cached
+
     data = {
         "name": name,
         "slug": slug,
@@ -55,35 +339,40 @@ def post_attribute(name, slug, att_type='select', order_by='menu_order', has_arc
         "has_archives": has_archives
     }
 
-    response = wcapi.post(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, data)
+    response = get_client(client).post(WOOCOMMERCE_ATTRIBUTES_ENDPOINT, data)
 
     # If the attribute was not found, search for the Attribute with this slug
     if response.status_code == 400 and response.json()['code'] == 'woocommerce_rest_cannot_create':
-        response_json = get_attributes_all()
+        response_json = get_attributes_all(client=client)
 
         # WooCommerce recognizes 'color' and 'pa_color' as same slug.
         for item in response_json:
             if item['slug'] == slug or item['slug'] == 'pa_{}'.format(slug):
+                _cache_taxonomy('attributes', _attribute_cache_key(slug), item)
                 return item
     else:
-        return response.json()
+        response_json = response.json()
+        _cache_taxonomy('attributes', _attribute_cache_key(slug), response_json)
+        return response_json
 
 
-def get_attribute_term(attribute_id, term_id):
+def get_attribute_term(attribute_id, term_id, client=None):
     """
     Function to get attribute term information using the provided id.
 
     :param attribute_id: ID of the Attribute
     :param term_id: ID of the term to get
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: dictionary containing attribute term information or None if attribute was not found
     """
-    response = wcapi.get("{}/{}".format(WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F.format(attribute_id), term_id))
+    response = get_client(client).get("{}/{}".format(WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F.format(attribute_id),
+                                                     term_id))
     if response.status_code == 404:
         return None
     return response.json()
 
 
-def post_attribute_term(attribute_id, name, slug, html_description=None, menu_order=None):
+def post_attribute_term(attribute_id, name, slug, html_description=None, menu_order=None, client=None):
     """
     Function to create an attribute term in WooCommerce System.
     Attribute terms are unique on name in WooCommerce System
@@ -93,9 +382,14 @@ def post_attribute_term(attribute_id, name, slug, html_description=None, menu_or
     :param slug: Slug of the attribute term
     :param html_description: HTML description for the attribute term
     :param menu_order: Order in Menu for this term
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
 
     :return: dictionary containing attribute term information
     """
+    cached = _get_cached_taxonomy('terms', (attribute_id, slug))
+    if cached:
+        return cached
+
     data = {
         "name": name,
         "slug": slug,
@@ -105,30 +399,32 @@ def post_attribute_term(attribute_id, name, slug, html_description=None, menu_or
     if menu_order:
         data['menu_order']: menu_order
 
-    response = wcapi.post(WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F.format(attribute_id), data)
+    response = get_client(client).post(WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F.format(attribute_id), data)
 
     # If the attribute was not found, search for the Attribute with this slug
     if response.status_code == 400 and response.json()['code'] == 'term_exists':
-        response_json = response.json()
-        return get_attribute_term(attribute_id, response_json['data']['resource_id'])
+        response_json = get_attribute_term(attribute_id, response.json()['data']['resource_id'], client=client)
     else:
-        return response.json()
+        response_json = response.json()
+    _cache_taxonomy('terms', (attribute_id, slug), response_json)
+    return response_json
 
 
-def get_category(cat_id):
+def get_category(cat_id, client=None):
     """
     Function to get category information based on id.
 
     :param cat_id: ID of the Attribute
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: dictionary containing category information or None if attribute was not found
     """
-    response = wcapi.get('{}/{}'.format(WOOCOMMERCE_CATEGORIES_ENDPOINT, cat_id))
+    response = get_client(client).get('{}/{}'.format(WOOCOMMERCE_CATEGORIES_ENDPOINT, cat_id))
     if response.status_code == 404:
         return None
     return response.json()
 
 
-def post_category(name, slug, parent_id=None, html_description=None, display=None, menu_order=None):
+def post_category(name, slug, parent_id=None, html_description=None, display=None, menu_order=None, client=None):
     """
     Function to create an attribute term in WooCommerce System.
     Attribute terms are unique on name in WooCommerce System
@@ -139,9 +435,14 @@ def post_category(name, slug, parent_id=None, html_description=None, display=Non
     :param html_description: HTML description for the attribute term
     :param display: Category archive display type. Options: 'default', 'products', 'subcategories' and 'both'
     :param menu_order: Order in Menu for this category
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
 
     :return: dictionary containing attribute term information
     """
+    cached = _get_cached_taxonomy('categories', slug)
+    if cached:
+        return cached
+
     data = {
         "name": name,
         "slug": slug,
@@ -155,94 +456,177 @@ def post_category(name, slug, parent_id=None, html_description=None, display=Non
     if menu_order:
         data['menu_order']: menu_order
 
-    response = wcapi.post(WOOCOMMERCE_CATEGORIES_ENDPOINT, data)
+    response = get_client(client).post(WOOCOMMERCE_CATEGORIES_ENDPOINT, data)
     # If the attribute was not found, search for the Attribute with this slug
     if response.status_code == 400 and response.json()['code'] == 'term_exists':
-        response_json = response.json()
-        return get_category(response_json['data']['resource_id'])
+        response_json = get_category(response.json()['data']['resource_id'], client=client)
     else:
-        return response.json()
+        response_json = response.json()
+    _cache_taxonomy('categories', slug, response_json)
+    return response_json
 
 
-def get_product(product_id):
+def get_product(product_id, client=None):
     """
     Function to get product based on it's id.
 
     :param product_id: ID of the product
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: Dict containing information of the product or None if the product wasn't found
     """
-    response = wcapi.get('{}/{}'.format(WOOCOMMERCE_PRODUCTS_ENDPOINT, product_id))
+    response = get_client(client).get('{}/{}'.format(WOOCOMMERCE_PRODUCTS_ENDPOINT, product_id))
     if response.status_code == 404:
         return None
     return response.json()
 
 
-def search_product(slug):
+def search_product(slug, client=None):
     """
     Function to search for a product using it's slug
 
     :param slug: Slug to use for searching the product
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: dictionary containing information of the product or None if product wasn't found
     """
     params = {
         'slug': slug
     }
-    response = wcapi.get(WOOCOMMERCE_PRODUCTS_ENDPOINT, params=params)
+    response = get_client(client).get(WOOCOMMERCE_PRODUCTS_ENDPOINT, params=params)
     if len(response.json()) > 0:
         return response.json()[0]
     else:
         return None
 
 
-def post_product(product_name, slug, product_type, status='publish', description=None, short_description=None,
-                 sku: str = None, regular_price: str = None, manage_stock=True, stock_quantity=None, weight: str = None,
-                 image_urls=None, dimensions=None, category_id=None, tags_ids=None, attribute_id=None,
-                 attribute_options=None, attribute_variation=None, attribute_visible=True, attribute_term_name=None,
-                 default_attributes=None, menu_order=None):
+def search_product_by_sku(sku, client=None):
     """
-    Function to create a product in WooCommerce System.
+    Function to search for a product or product variation using it's SKU
 
-    Notes
-    =====
-    - Dev Decided on this: Creating a variable product without a SKU will duplicate the product. So, we need to use the slug to search for
-        that product manually before sending POST.
-    - OR Another Option: Set a SKU for the variable product as well. How do we generate this SKU such that it can be replicated
-            across multiple reruns needs to be decided.
+    :param sku: SKU to use for searching the product
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: dictionary containing information of the product (variations have a 'parent_id') or None if product
+                wasn't found. When the product id index is warm, only the 'id' and 'parent_id' are returned
+    """
+    if is_index_warm():
+        return lookup_sku(sku)
 
-    :param product_name: Name of the product
-    :param slug: Slug of the product
-    :param product_type: Type (Main ones are 'simple' and 'variable'
-    :param status: Status of the product. Options: 'draft', 'pending', 'private' and 'publish'
-    :param description: Description of the product
-    :param short_description: Short description of the product
-    :param sku: SKU of the product. Must Str type
-    :param regular_price: Price of the product. Must Str type
-    :param manage_stock: Whether to manage stock for this product or not
-    :param stock_quantity: Quantity of the product in stock
-    :param weight: Weight of the product. Must Str type
-    :param image_urls: List of image urls to for the product
-    :param dimensions: Dimensions of the product. A dict object with 'length', 'width', and 'height' information
-    :param category_id: Category ID of the product. Will be processed into a category object for WooCommerce API
-    :param tags_ids: Tag ids of the product. Will be processed into a Tag array object for WooCommerce API
-    :param attribute_id: ONLY FOR VARIABLE PRODUCT - Attribute id of the Product Variation. Will be processed into an
-                Attribute object for WooCommerce API
-    :param attribute_options: List of term names for the product's attribute based on which the variants exist
-    :param attribute_variation: Boolean whether the attribute terms names are used to change product variations
-    :param attribute_visible: Boolean whether the attribute and it's options are visible in the product page
-    :param attribute_term_name: ONLY FOR VARIABLE PRODUCT - Attribute term name of the Product Variation. Will be
-                processed into an Attribute object for WooCommerce API
-    :param default_attributes: Default Attributes of the product. Will be processed into a Default Attributes array
-                object for WooCommerce API. A list of dict objects with 'id', 'name', and 'option' information
-    :param menu_order: Menu order of the product. To Custom sort the product
-    :return: a tuple with a boolean of whether the product already exists and a dictionary containing information
-                of the product
+    params = {
+        'sku': sku
+    }
+    response = get_client(client).get(WOOCOMMERCE_PRODUCTS_ENDPOINT, params=params)
+    if response.status_code == 200 and len(response.json()) > 0:
+        return response.json()[0]
+    else:
+        return None
+
+
+def delete_product(product_id, force=True, client=None):
     """
-    # Check if exists
-    product_exists = search_product(slug)
-    if product_exists:
-        return True, product_exists
+    Function to delete a product. Deleting a variable product deletes its variations as well.
 
-    # Create new
+    :param product_id: ID of the product
+    :param force: Delete permanently instead of moving the product to the trash
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: Dict containing information of the deleted product or None if the product wasn't found
+    """
+    response = get_client(client).delete('{}/{}'.format(WOOCOMMERCE_PRODUCTS_ENDPOINT, product_id),
+                                         params={'force': force})
+    if response.status_code == 404:
+        return None
+    response_json = response.json()
+    remove_from_index(slugs=[response_json.get('slug')], skus=[response_json.get('sku')])
+    return response_json
+
+
+def delete_product_variation(product_id, variation_id, force=True, client=None):
+    """
+    Function to delete a product variation.
+
+    :param product_id: Product ID of the parent product
+    :param variation_id: Variation ID to delete
+    :param force: Delete permanently. Variations don't support the trash
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: Dict containing information of the deleted variation or None if the variation wasn't found
+    """
+    endpoint = WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F.format(product_id)
+    response = get_client(client).delete('{}/{}'.format(endpoint, variation_id), params={'force': force})
+    if response.status_code == 404:
+        return None
+    response_json = response.json()
+    remove_from_index(skus=[response_json.get('sku')])
+    return response_json
+
+
+def build_image_data(product_name, image_urls):
+    """
+    Function to compile the images array of a product or product variation.
+    Images already in the media library are referenced by id, so WooCommerce doesn't download them again.
+
+    :param product_name: Name of the product, used for the image name and alt text
+    :param image_urls: List of image urls for the product
+    :return: list of dicts for the WooCommerce API images array or None if there are no images
+    """
+    if not image_urls:
+        return None
+
+    counter = 0
+    image_dicts = list()
+    for image_url in image_urls:
+        counter += 1
+        media_id = lookup_image(image_url)
+        if media_id:
+            image_dicts.append({'id': media_id})
+            continue
+        image_dicts.append(
+            {
+                'src': get_image_src(image_url),
+                'name': "{} Image {}".format(product_name, counter),
+                'alt': product_name
+            }
+        )
+    return image_dicts
+
+
+def _get_images(data):
+    """
+    :param data: Data sent for a product or variation, or the object WooCommerce returned
+    :return: list of image dicts. Variations have a single 'image' instead of the 'images' array
+    """
+    if data.get('images'):
+        return data['images']
+    if data.get('image'):
+        return [data['image']]
+    return []
+
+
+def update_image_registry(data, result):
+    """
+    Function to register the media ids of the images sent by `src` once WooCommerce created them. If WooCommerce
+    rejected a media id (deleted from the media library), the images of the request are forgotten, so they are sent by
+    `src` next time.
+
+    :param data: Data sent for a product or variation
+    :param result: Object WooCommerce returned, or the error
+    """
+    error = result.get('error', result)
+    if 'invalid_image_id' in str(error.get('code', '')):
+        forget_images([image['id'] for image in _get_images(data) if image.get('id')])
+    elif result.get('id'):
+        register_images(_get_images(data), _get_images(result))
+
+
+def build_product_data(product_name, slug, product_type, status='publish', description=None, short_description=None,
+                       sku: str = None, regular_price: str = None, manage_stock=True, stock_quantity=None,
+                       weight: str = None, image_urls=None, dimensions=None, category_id=None, tags_ids=None,
+                       attribute_id=None, attribute_options=None, attribute_variation=None, attribute_visible=True,
+                       attribute_term_name=None, default_attributes=None, menu_order=None):
+    """
+    Function to compile the data of a product for the WooCommerce API.
+    Used for single POST requests as well as batch create/update requests.
+    See post_product for the description of the parameters.
+
+    :return: dict containing the product data
+    """
     data = {
         'name': product_name,
         'slug': slug,
@@ -309,76 +693,120 @@ def post_product(product_name, slug, product_type, status='publish', description
         data['menu_order'] = menu_order
 
     # Add urls of images to the POST data
-    if image_urls:
-        if len(image_urls) != 0:
-            counter = 0
-            image_dicts = list()
-            for image_url in image_urls:
-                counter += 1
-                image_dicts.append(
-                    {
-                        # WE NEED TO FORCE A FILETYPE IN THE IMAGE URL OR WOOCOMMERCE WON'T ACCEPT IT
-                        'src': '{}.png'.format(image_url),
-                        'name': "{} Image {}".format(product_name, counter),
-                        'alt': product_name
-                    }
-                )
-            data['images'] = image_dicts
-
-    response = wcapi.post(WOOCOMMERCE_PRODUCTS_ENDPOINT, data)
+    image_dicts = build_image_data(product_name, image_urls)
+    if image_dicts:
+        data['images'] = image_dicts
+
+    return data
+
+
+def post_product(product_name, slug, product_type, status='publish', description=None, short_description=None,
+                 sku: str = None, regular_price: str = None, manage_stock=True, stock_quantity=None, weight: str = None,
+                 image_urls=None, dimensions=None, category_id=None, tags_ids=None, attribute_id=None,
+                 attribute_options=None, attribute_variation=None, attribute_visible=True, attribute_term_name=None,
+                 default_attributes=None, menu_order=None, client=None):
+    """
+    Function to create a product in WooCommerce System.
+
+    Notes
+    =====
+    - Dev Decided on this: Creating a variable product without a SKU will duplicate the product. So, we need to use the slug to search for
+        that product manually before sending POST.
+    - OR Another Option: Set a SKU for the variable product as well. How do we generate this SKU such that it can be replicated
+            across multiple reruns needs to be decided.
+
+    :param product_name: Name of the product
+    :param slug: Slug of the product
+    :param product_type: Type (Main ones are 'simple' and 'variable'
+    :param status: Status of the product. Options: 'draft', 'pending', 'private' and 'publish'
+    :param description: Description of the product
+    :param short_description: Short description of the product
+    :param sku: SKU of the product. Must Str type
+    :param regular_price: Price of the product. Must Str type
+    :param manage_stock: Whether to manage stock for this product or not
+    :param stock_quantity: Quantity of the product in stock
+    :param weight: Weight of the product. Must Str type
+    :param image_urls: List of image urls to for the product
+    :param dimensions: Dimensions of the product. A dict object with 'length', 'width', and 'height' information
+    :param category_id: Category ID of the product. Will be processed into a category object for WooCommerce API
+    :param tags_ids: Tag ids of the product. Will be processed into a Tag array object for WooCommerce API
+    :param attribute_id: ONLY FOR VARIABLE PRODUCT - Attribute id of the Product Variation. Will be processed into an
+                Attribute object for WooCommerce API
+    :param attribute_options: List of term names for the product's attribute based on which the variants exist
+    :param attribute_variation: Boolean whether the attribute terms names are used to change product variations
+    :param attribute_visible: Boolean whether the attribute and it's options are visible in the product page
+    :param attribute_term_name: ONLY FOR VARIABLE PRODUCT - Attribute term name of the Product Variation. Will be
+                processed into an Attribute object for WooCommerce API
+    :param default_attributes: Default Attributes of the product. Will be processed into a Default Attributes array
+                object for WooCommerce API. A list of dict objects with 'id', 'name', and 'option' information
+    :param menu_order: Menu order of the product. To Custom sort the product
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: a tuple with a boolean of whether the product already exists and a dictionary containing information
+                of the product
+    """
+    # Check if exists. Once the id index is warm a miss means the product doesn't exist, so no search is needed
+    if is_index_warm():
+        product_id = lookup_slug(slug)
+        product_exists = {'id': product_id, 'slug': slug} if product_id else None
+    else:
+        product_exists = search_product(slug, client=client)
+    if product_exists:
+        return True, product_exists
+
+    # Create new
+    data = build_product_data(product_name, slug, product_type, status=status, description=description,
+                              short_description=short_description, sku=sku, regular_price=regular_price,
+                              manage_stock=manage_stock, stock_quantity=stock_quantity, weight=weight,
+                              image_urls=image_urls, dimensions=dimensions, category_id=category_id,
+                              tags_ids=tags_ids, attribute_id=attribute_id, attribute_options=attribute_options,
+                              attribute_variation=attribute_variation, attribute_visible=attribute_visible,
+                              attribute_term_name=attribute_term_name, default_attributes=default_attributes,
+                              menu_order=menu_order)
+
+    response = get_client(client).post(WOOCOMMERCE_PRODUCTS_ENDPOINT, data)
     if response.status_code == 400 and response.json()['code'] == 'product_invalid_sku':
         response_json = response.json()
-        if 'resource_id' in response_json['data']:
-            return True, get_product(response_json['data']['resource_id'])
+        resource_id = response_json['data'].get('resource_id')
+        product = get_product(resource_id, client=client) if resource_id else None
+        # A SKU held by a variation is not this product
+        if product and not product.get('parent_id'):
+            return True, product
         else:
             return None, response_json
     else:
-        return False, response.json()
+        response_json = response.json()
+        index_products([response_json])
+        update_image_registry(data, response_json)
+        return False, response_json
 
 
-def get_product_variation(product_id, variation_id):
+def get_product_variation(product_id, variation_id, client=None):
     """
     Function to get product variation information.
 
     :param product_id: Product ID of the parent product
     :param variation_id: Variation ID to get
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
     :return: dict containing information of the variation or None if not found
     """
-    response = wcapi.get('{}\{}'.format(WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F.format(product_id), variation_id))
+    endpoint = WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F.format(product_id)
+    response = get_client(client).get('{}\{}'.format(endpoint, variation_id))
     if response.status_code == 404:
         return None
     return response.json()
 
 
-def post_product_variation(product_name, product_id, sku: str, regular_price: str = None, status='publish',
-                           description=None, manage_stock=True, stock_quantity=None, weight: str = None,
-                           image_urls=None, dimensions=None, attribute_id=None, attribute_term_name=None,
-                           menu_order=None):
+def build_product_variation_data(product_name, sku: str, regular_price: str = None, status='publish',
+                                 description=None, manage_stock=True, stock_quantity=None, weight: str = None,
+                                 image_urls=None, dimensions=None, attribute_id=None, attribute_term_name=None,
+                                 menu_order=None):
     """
-    Function to create a product variations in WooCommerce System.
-    # TODO: Add image to the POST
-
-    :param product_name: Name of the parent product
-    :param product_id: Id of the parent product
-    :param sku: SKU of the product. Must Str type
-    :param regular_price: Price of the product. Must Str type
-    :param status: Status of the product. Options: 'draft', 'pending', 'private' and 'publish'
-    :param description: Description of the product
-    :param manage_stock: Whether to manage stock for this product or not
-    :param stock_quantity: Quantity of the product in stock
-    :param weight: Weight of the product. Must Str type
-        :param image_urls: List of image urls to for the product
+    Function to compile the data of a product variation for the WooCommerce API.
+    Used for single POST requests as well as batch create/update requests.
+    See post_product_variation for the description of the parameters.
 
-    :param dimensions: Dimensions of the product. A dict object with 'length', 'width', and 'height' information
-    :param attribute_id: ONLY FOR VARIABLE PRODUCT - Attribute id of the Product Variation. Will be processed into an
-                Attribute object for WooCommerce API
-    :param attribute_term_name: ONLY FOR VARIABLE PRODUCT - Attribute term name of the Product Variation. Will be
-                processed into an Attribute object for WooCommerce API
-    :param menu_order: Menu order of the product. To Custom sort the product
-    :return: a tuple with a boolean of whether the product already exists and a dictionary containing information
-                of the product
+    :return: dict containing the product variation data
     """
-    # Create new
     data = {
         'sku': str(sku)
     }
@@ -406,29 +834,389 @@ def post_product_variation(product_name, product_id, sku: str, regular_price: st
     if menu_order:
         data['menu_order'] = menu_order
 
-    # Add urls of images to the POST data
-    if image_urls:
-        if len(image_urls) != 0:
-            counter = 0
-            image_dicts = list()
-            for image_url in image_urls:
-                counter += 1
-                image_dicts.append(
-                    {
-                        # WE NEED TO FORCE A FILETYPE IN THE IMAGE URL OR WOOCOMMERCE WON'T ACCEPT IT
-                        'src': '{}.png'.format(image_url),
-                        'name': "{} Image {}".format(product_name, counter),
-                        'alt': product_name
-                    }
-                )
-            data['images'] = image_dicts
-
-    response = wcapi.post(WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F.format(product_id), data)
+    # Add the image to the POST data. Variations only have one
+    image_dicts = build_image_data(product_name, image_urls)
+    if image_dicts:
+        data['image'] = image_dicts[0]
+
+    return data
+
+
+def post_product_variation(product_name, product_id, sku: str, regular_price: str = None, status='publish',
+                           description=None, manage_stock=True, stock_quantity=None, weight: str = None,
+                           image_urls=None, dimensions=None, attribute_id=None, attribute_term_name=None,
+                           menu_order=None, client=None):
+    """
+    Function to create a product variations in WooCommerce System.
+
+    :param product_name: Name of the parent product
+    :param product_id: Id of the parent product
+    :param sku: SKU of the product. Must Str type
+    :param regular_price: Price of the product. Must Str type
+    :param status: Status of the product. Options: 'draft', 'pending', 'private' and 'publish'
+    :param description: Description of the product
+    :param manage_stock: Whether to manage stock for this product or not
+    :param stock_quantity: Quantity of the product in stock
+    :param weight: Weight of the product. Must Str type
+        :param image_urls: List of image urls to for the product
+
+    :param dimensions: Dimensions of the product. A dict object with 'length', 'width', and 'height' information
+    :param attribute_id: ONLY FOR VARIABLE PRODUCT - Attribute id of the Product Variation. Will be processed into an
+                Attribute object for WooCommerce API
+    :param attribute_term_name: ONLY FOR VARIABLE PRODUCT - Attribute term name of the Product Variation. Will be
+                processed into an Attribute object for WooCommerce API
+    :param menu_order: Menu order of the product. To Custom sort the product
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: a tuple with a boolean of whether the product already exists and a dictionary containing information
+                of the product
+    """
+    # Check if exists
+    indexed = lookup_sku(str(sku))
+    if indexed and indexed['parent_id'] == product_id:
+        return True, indexed
+
+    # Create new
+    data = build_product_variation_data(product_name, sku, regular_price=regular_price, status=status,
+                                        description=description, manage_stock=manage_stock,
+                                        stock_quantity=stock_quantity, weight=weight, image_urls=image_urls,
+                                        dimensions=dimensions, attribute_id=attribute_id,
+                                        attribute_term_name=attribute_term_name, menu_order=menu_order)
+
+    response = get_client(client).post(WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F.format(product_id), data)
     if response.status_code == 400 and response.json()['code'] == 'product_invalid_sku':
         response_json = response.json()
-        if 'resource_id' in response_json['data']:
-            return True, get_product(response_json['data']['resource_id'])
+        # A SKU held by a product or a variation of another parent is not this variation
+        if 'resource_id' in response_json['data'] and \
+                get_sku_holder(response_json['data']['resource_id'], sku, product_id, client=client):
+            return True, {'id': response_json['data']['resource_id']}
         else:
             return None, response_json
     else:
-        return False, response.json()
+        response_json = response.json()
+        index_products([response_json], parent_id=product_id)
+        update_image_registry(data, response_json)
+        return False, response_json
+
+
+def get_sku_holder(resource_id, sku=None, parent_id=0, client=None):
+    """
+    Function to check the object WooCommerce reported as holding a SKU (product_invalid_sku) before it is taken for
+    the one being pushed. It is looked up in the index of WooCommerce ids, or fetched if the index doesn't know it.
+
+    :param resource_id: Id of the object holding the SKU
+    :param sku: SKU that was sent
+    :param parent_id: Id of the parent product for variations, 0 for products
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: dict with the 'id' and 'parent_id' of the object, or None if it is not a product (parent_id 0) or not a
+                variation of the same parent
+    """
+    indexed = lookup_sku(str(sku)) if sku else None
+    if not indexed or indexed['id'] != resource_id:
+        product = get_product(resource_id, client=client)
+        if not product or not product.get('id'):
+            return None
+        indexed = {'id': product['id'], 'parent_id': product.get('parent_id') or 0}
+    return indexed if indexed['parent_id'] == (parent_id or 0) else None
+
+
+def _parse_batch_result(result, created, sku=None, parent_id=0, client=None):
+    """
+    Function to turn a single entry of a batch response into the same tuple returned by post_product.
+
+    :param result: dict for one item of the 'create', 'update' or 'delete' list of a batch response
+    :param created: Boolean whether the item was sent as a create (True) or an update (False)
+    :param sku: SKU that was sent for the item, if any
+    :param parent_id: Id of the parent product for variations, 0 for products
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: a tuple with a boolean of whether the product already exists (None on error) and a dictionary
+                containing information of the product or the error
+    """
+    if 'error' not in result:
+        return not created, result
+
+    error = result['error']
+    if not error.get('data') or 'resource_id' not in error['data']:
+        return None, error
+    # Same as a single POST: a duplicate SKU (or term slug) of a create points us to the object that already holds it.
+    # A SKU held by an object of another type or parent, or by another object than the one updated, is an error for
+    # the caller to delete or report that object
+    if created and error.get('code') == 'product_invalid_sku' and \
+            get_sku_holder(error['data']['resource_id'], sku, parent_id, client=client):
+        return True, {'id': error['data']['resource_id']}
+    if error.get('code') == 'term_exists':
+        return True, {'id': error['data']['resource_id']}
+    return None, error
+
+
+def _post_batch(endpoint, create=None, update=None, delete=None, workers=1, debug=False, client=None, on_chunk=None,
+                parent_id=0):
+    """
+    Function to send creates, updates and deletes to a WooCommerce batch endpoint in chunks of WOOCOMMERCE_BATCH_SIZE.
+
+    :param endpoint: Batch endpoint to POST to
+    :param create: Dict of key -> data for objects to create. Keys are only used to map the results back
+    :param update: Dict of key -> data for objects to update. Data must contain the 'id' of the object
+    :param delete: Dict of key -> id of objects to delete. Deletes are always forced
+    :param workers: Number of chunks to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :param on_chunk: Function called with the results of every chunk as soon as they are back, e.g. to journal them
+    :param parent_id: Id of the parent product for the variations batch, 0 for products. An object holding a SKU that
+                was sent is only taken for the one sent if it has that parent
+    :return: dict of key -> tuple (already_exists, dict) in the same format as post_product. Deleted objects are
+                reported as already existing
+    """
+    # WooCommerce returns the results of each list in the same order they were sent, so the position in the chunk
+    # is enough to map results back to keys
+    operations = ([(key, 'create') for key in (create or {})] + [(key, 'update') for key in (update or {})] +
+                  [(key, 'delete') for key in (delete or {})])
+
+    def post_chunk(chunk):
+        create_keys = [key for key, action in chunk if action == 'create']
+        update_keys = [key for key, action in chunk if action == 'update']
+        delete_keys = [key for key, action in chunk if action == 'delete']
+        data = dict()
+        if create_keys:
+            data['create'] = [create[key] for key in create_keys]
+        if update_keys:
+            data['update'] = [update[key] for key in update_keys]
+        if delete_keys:
+            data['delete'] = [delete[key] for key in delete_keys]
+
+        chunk_results = dict()
+        response = get_client(client).post(endpoint, data)
+        try:
+            response_json = response.json()
+        except ValueError:
+            # Gateways answer timeouts with an html page (502, 504)
+            response_json = None
+        if response.status_code != 200 or not isinstance(response_json, dict):
+            # The whole chunk failed, report the same error for every item in it
+            error = response.text if response_json is None else response_json
+            if debug:
+                print("Batch request failed: {}".format(error))
+            for key, action in chunk:
+                chunk_results[key] = (None, error)
+            return chunk_results
+
+        for key, result in zip(create_keys, response_json.get('create', [])):
+            chunk_results[key] = _parse_batch_result(result, True, create[key].get('sku'), parent_id, client=client)
+            update_image_registry(create[key], result)
+        for key, result in zip(update_keys, response_json.get('update', [])):
+            chunk_results[key] = _parse_batch_result(result, False)
+            update_image_registry(update[key], result)
+        for key, result in zip(delete_keys, response_json.get('delete', [])):
+            chunk_results[key] = _parse_batch_result(result, False)
+        for key, action in chunk:
+            if key not in chunk_results:
+                # Fewer results than items sent: nothing says whether this one was written
+                chunk_results[key] = (None, {'code': 'missing_result',
+                                             'message': 'No result for the {} of {}'.format(action, key)})
+        if on_chunk is not None:
+            on_chunk(chunk_results)
+        return chunk_results
+
+    results = dict()
+    for chunk_results in run_in_pool(post_chunk, chunk_list(operations, WOOCOMMERCE_BATCH_SIZE), workers=workers):
+        results.update(chunk_results)
+
+    return results
+
+
+def _remove_deleted(results, delete):
+    """
+    Function to remove the products or variations a batch deleted from the index.
+
+    :param results: Results of _post_batch
+    :param delete: Dict of key -> id that was sent for deletion
+    """
+    deleted = [results[key][1] for key in (delete or {}) if key in results and results[key][0] is not None]
+    remove_from_index(slugs=[product.get('slug') for product in deleted if not product.get('parent_id')],
+                      skus=[product.get('sku') for product in deleted])
+
+
+def batch_products(create=None, update=None, delete=None, workers=1, debug=False, client=None, on_chunk=None):
+    """
+    Function to create, update and delete products in WooCommerce System with the products batch endpoint.
+    Unlike post_product, this does not search for the slug before creating, so products sent here should have a SKU
+    or be known not to exist.
+
+    :param create: Dict of key (handle, SKU, ...) -> product data from build_product_data
+    :param update: Dict of key -> product data. Data must contain the 'id' of the product
+    :param delete: Dict of key -> id of the product to delete. Its variations are deleted with it
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :param on_chunk: Function called with the results of every batch request as soon as they are back
+    :return: dict of key -> tuple with a boolean of whether the product already exists (None on error) and a dictionary
+                containing information of the product or the error
+    """
+    results = _post_batch(WOOCOMMERCE_PRODUCTS_BATCH_ENDPOINT, create=create, update=update, delete=delete,
+                          workers=workers, debug=debug, client=client, on_chunk=on_chunk)
+    index_products([results[key][1] for key in results if results[key][0] is not None and key not in (delete or {})])
+    _remove_deleted(results, delete)
+    return results
+
+
+def batch_product_variations(product_id, create=None, update=None, delete=None, workers=1, debug=False, client=None,
+                             on_chunk=None):
+    """
+    Function to create, update and delete variations of a product in WooCommerce System with the variations batch
+    endpoint.
+
+    :param product_id: Id of the parent product
+    :param create: Dict of key (SKU, ...) -> variation data from build_product_variation_data
+    :param update: Dict of key -> variation data. Data must contain the 'id' of the variation
+    :param delete: Dict of key -> id of the variation to delete
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :param on_chunk: Function called with the results of every batch request as soon as they are back
+    :return: dict of key -> tuple with a boolean of whether the variation already exists (None on error) and a
+                dictionary containing information of the variation or the error
+    """
+    results = _post_batch(WOOCOMMERCE_PRODUCT_VARIATIONS_BATCH_ENDPOINT_F.format(product_id), create=create,
+                          update=update, delete=delete, workers=workers, debug=debug, client=client,
+                          on_chunk=on_chunk, parent_id=product_id)
+    index_products([results[key][1] for key in results if results[key][0] is not None and key not in (delete or {})],
+                   parent_id=product_id)
+    _remove_deleted(results, delete)
+    return results
+
+
+def batch_categories(create, workers=1, debug=False, client=None):
+    """
+    Function to create categories in WooCommerce System with the categories batch endpoint.
+    A category whose slug already exists is reported with its id, like post_category.
+
+    :param create: Dict of key (category name, ...) -> dict with the 'name' and 'slug' of the category
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: dict of key -> tuple with a boolean of whether the category already exists (None on error) and a
+                dictionary containing information of the category or the error
+    """
+    results = _post_batch(WOOCOMMERCE_CATEGORIES_BATCH_ENDPOINT, create=create, workers=workers, debug=debug,
+                          client=client)
+    for key in results:
+        if results[key][0] is False:
+            _cache_taxonomy('categories', create[key]['slug'], results[key][1])
+    return results
+
+
+def batch_attributes(create, att_type='select', order_by='menu_order', has_archives=True, workers=1, debug=False,
+                     client=None):
+    """
+    Function to create attributes in WooCommerce System with the attributes batch endpoint.
+
+    :param create: Dict of key (attribute name, ...) -> dict with the 'name' and 'slug' of the attribute
+    :param att_type: Type of the attributes. Default: 'select'
+    :param order_by: How to order in the menu. Default: 'menu_order'
+    :param has_archives: Attributes have archives or not. Default: 'True'
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: dict of key -> tuple with a boolean of whether the attribute already exists (None on error) and a
+                dictionary containing information of the attribute or the error
+    """
+    create = {key: dict(create[key], type=att_type, order_by=order_by, has_archives=has_archives) for key in create}
+    results = _post_batch(WOOCOMMERCE_ATTRIBUTES_BATCH_ENDPOINT, create=create, workers=workers, debug=debug,
+                          client=client)
+    for key in results:
+        if results[key][0] is False:
+            _cache_taxonomy('attributes', _attribute_cache_key(create[key]['slug']), results[key][1])
+    return results
+
+
+def batch_attribute_terms(attribute_id, create, workers=1, debug=False, client=None):
+    """
+    Function to create terms of an attribute in WooCommerce System with the attribute terms batch endpoint.
+    A term whose slug already exists is reported with its id, like post_attribute_term.
+
+    :param attribute_id: ID of parent attribute
+    :param create: Dict of key (term name, ...) -> dict with the 'name' and 'slug' of the term
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: dict of key -> tuple with a boolean of whether the term already exists (None on error) and a dictionary
+                containing information of the term or the error
+    """
+    results = _post_batch(WOOCOMMERCE_ATTRIBUTE_TERMS_BATCH_ENDPOINT_F.format(attribute_id), create=create,
+                          workers=workers, debug=debug, client=client)
+    for key in results:
+        if results[key][0] is False:
+            _cache_taxonomy('terms', (attribute_id, create[key]['slug']), results[key][1])
+    return results
+
+
+def iter_list(endpoint, params=None, per_page=WOOCOMMERCE_PAGE_SIZE, client=None):
+    """
+    Function to go through every page of a WooCommerce list endpoint.
+
+    :param endpoint: Endpoint to list, e.g. WOOCOMMERCE_PRODUCTS_ENDPOINT
+    :param params: Extra query parameters
+    :param per_page: Number of objects per page
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :return: generator yielding the list of objects of every page
+    :raises WooCommerceAPIError: if a page is answered with an error, so callers never take part of a list for all
+    """
+    params = dict(params or {})
+    params['per_page'] = per_page
+    page = 1
+    while True:
+        params['page'] = page
+        response = get_client(client).get(endpoint, params=params)
+        if response.status_code != 200:
+            raise WooCommerceAPIError(response)
+        objects = response.json()
+        if objects:
+            yield objects
+
+        total_pages = response.headers.get('X-WP-TotalPages') if response.headers else None
+        if len(objects) < per_page or (total_pages and page >= int(total_pages)):
+            return
+        page += 1
+
+
+def warm_product_index(rebuild=False, workers=1, debug=False, client=None):
+    """
+    Function to build the index of product and variation ids by going through every product in WooCommerce once.
+    The index is kept in redis and updated as products are written, so it only needs to be built again if products
+    are changed outside of this program. The index is only marked warm once every page of products and variations was
+    read, so a build that failed halfway is done again by the next call. Fingerprints and pushed stock quantities of
+    products and variations that are not in WooCommerce anymore are forgotten, so they are pushed again.
+
+    :param rebuild: Build the index again even if it is already warm
+    :param workers: Number of variable products whose variations are listed concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :param client: WooCommerce client to use instead of the driver's, e.g. from wrap_client
+    :raises WooCommerceAPIError: if a page could not be read
+    """
+    if is_index_warm() and not rebuild:
+        return
+    clear_index()
+
+    variable_product_ids = list()
+    products_count = 0
+    for products in iter_list(WOOCOMMERCE_PRODUCTS_ENDPOINT, params={'context': 'edit'}, client=client):
+        index_products(products)
+        products_count += len(products)
+        variable_product_ids.extend(product['id'] for product in products if product.get('type') == 'variable')
+
+    def index_variations(product_id):
+        for variations in iter_list(WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F.format(product_id), client=client):
+            index_products(variations, parent_id=product_id)
+
+    run_in_pool(index_variations, variable_product_ids, workers=workers)
+    mark_index_warm()
+    if debug:
+        print("Indexed {} products ({} variable)".format(products_count, len(variable_product_ids)))
+
+    # Products deleted outside of this program would otherwise be skipped as unchanged forever
+    indexed_skus = dict(iter_indexed_skus())
+    wc_ids = {product_id for slug, product_id in iter_indexed_slugs()}
+    wc_ids.update(indexed['id'] for indexed in indexed_skus.values())
+    forgotten = (forget_missing(PRODUCT_FINGERPRINTS_KEY, wc_ids) + forget_missing(VARIANT_FINGERPRINTS_KEY, wc_ids) +
+                 forget_pushed_stock(set(indexed_skus)))
+    if debug and forgotten:
+        print("Forgot {} fingerprints and stock quantities of objects missing from WooCommerce".format(forgotten))
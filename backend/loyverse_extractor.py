@@ -3,36 +3,166 @@ Driver to extract information out of Loyverse and send to staging phase
 """
 import json
 
-from .drivers.loyapi import get_categories_all, get_items_all
-from .utils.redis import get_redis_connection, flush_data, add_to_redis
-from .utils.vars import PROCESSED_DATA_PREFIX, RAW_DATA_PREFIX
-from .utils.loyverse import extract_catids, merge_items_categories, extract_variant_information
+from .drivers.loyapi import get_categories_all, iter_items_pages
+from .utils.redis import get_redis_connection, flush_data, add_to_redis, save_checkpoint, get_checkpoint, \
+    clear_checkpoint
+from .utils import chunk_list
+from .utils.vars import PROCESSED_DATA_PREFIX, RAW_DATA_PREFIX, LOYVERSE_ITEM_IDS_PER_REQUEST
+from .utils.loyverse import extract_catids, transform_items
+from .utils.delta import get_timestamp, get_watermark, set_watermark, record_handle_skus, record_deleted_handles
+from .utils.stock import record_variant_skus
+from .utils.records import Category
+from .utils.staging_index import index_variants, unindex_handles
+from .utils.metrics import time_stage, time_iteration
 
 
-def extract_loyverse_data(save_raw=False, flush_redis=True, debug=False):
+ITEMS_CHECKPOINT = 'loyverse_items_cursor'
+STARTED_AT_CHECKPOINT = 'loyverse_items_started_at'
+
+
+def split_deleted_items(items):
+    """
+    Function to separate deleted items from live ones and drop deleted variants from live items.
+    Only needed when items are requested with show_deleted.
+
+    :param items: list of dicts containing item information
+    :return: tuple with the list of live items and the list of deleted items
+    """
+    live_items = list()
+    deleted_items = list()
+    for item in items:
+        if item.get('deleted_at'):
+            deleted_items.append(item)
+            continue
+        if any(variant.get('deleted_at') for variant in item['variants']):
+            item['variants'] = [variant for variant in item['variants'] if not variant.get('deleted_at')]
+        live_items.append(item)
+
+    return live_items, deleted_items
+
+
+def count_page_items(page):
+    """
+    :param page: Tuple of the items of a page and the next cursor, from iter_items_pages
+    :return: number of items in the page
+    """
+    return len(page[0])
+
+
+def stage_items(items, all_categories, full=False, save_raw=False, debug=False):
+    """
+    Function to stage a page of Loyverse items in redis and record which SKUs changed or were deleted.
+
+    :param items: list of dicts containing item information from Loyverse, deleted ones included
+    :param all_categories: Dict of the Category records fetched so far. Missing categories are fetched and added to it
+    :param full: Whether this is part of a full extraction
+    :param save_raw: Whether to save raw unfiltered data from Loyverse to Redis or not
+    :param debug: Boolean to print stuff on console for debugging
+    :return: list of de-normalized Variant records that were staged
+    """
+    items, deleted_items = split_deleted_items(items)
+
+    category_ids = [category_id for category_id in extract_catids(items) if category_id not in all_categories]
+    if category_ids:
+        with time_stage('extract'):
+            categories = get_categories_all(category_ids, debug=debug)
+        all_categories.update({category_id: Category.from_dict(categories[category_id])
+                               for category_id in categories})
+
+    with time_stage('transform') as stage:
+        products_variants = list(transform_items(items, all_categories))
+        stage.items = len(products_variants)
+
+    # Add variant data
+    with time_stage('stage') as stage:
+        add_to_redis(products_variants, 'SKU', PROCESSED_DATA_PREFIX, debug=debug)
+        removed_skus = record_handle_skus(products_variants, full=full)
+        removed_skus += record_deleted_handles([item['handle'] for item in deleted_items])
+        index_variants(products_variants)
+        unindex_handles([item['handle'] for item in deleted_items])
+        record_variant_skus(items)
+        stage.items = len(products_variants)
+    if debug and not full:
+        print("Changed SKUs: {}. Deleted SKUs: {}".format(len(products_variants), len(removed_skus)))
+
+    # Add raw data if directed. Items were merged with their categories in place
+    if save_raw:
+        with time_stage('stage'):
+            add_to_redis(items, 'id', RAW_DATA_PREFIX, debug=debug)
+
+    return products_variants
+
+
+def extract_loyverse_items(item_ids, debug=False):
+    """
+    Function to stage only the given items, e.g. the ones a webhook reported as changed.
+    Their SKUs are marked as changed or deleted like in an incremental extraction.
+
+    :param item_ids: List of Loyverse item ids
+    :param debug: Boolean to print stuff on console for debugging
+    :return: list of de-normalized variants that were staged
+    """
+    all_categories = dict()
+    products_variants = list()
+    for item_ids_chunk in chunk_list(list(item_ids), LOYVERSE_ITEM_IDS_PER_REQUEST):
+        for items, _ in time_iteration('extract', iter_items_pages(item_ids=item_ids_chunk, show_deleted=True,
+                                                                   debug=debug), count=count_page_items):
+            products_variants.extend(stage_items(items, all_categories, debug=debug))
+
+    return products_variants
+
+
+def extract_loyverse_data(save_raw=False, flush_redis=True, resume=False, incremental=False, debug=False):
     """
     Main pipeline
 
+    Items are streamed from Loyverse page by page. Each page is merged with its categories, de-normalized and staged in
+    redis while the next pages are still downloading. Categories are fetched once, the first time a page refers to them.
+    After each page is staged, the cursor of the next page is saved as a checkpoint. If the extraction fails, running
+    it again with resume=True continues from that cursor instead of the first page.
+
+    In incremental mode, redis is not flushed and only items updated since the last successful extraction (the
+    watermark) are requested, deleted ones included. Their SKUs are marked as changed or deleted so
+    insert_to_woocommerce(only_changed=True) pushes just those. Without a watermark, a full extraction is run.
+
     :param save_raw: Whether to save raw unfiltered data from Loyverse to Redis or not
-    :param flush_redis: Flush redis database before adding latest information
+    :param flush_redis: Flush redis database before adding latest information. Ignored when resuming or incremental
+    :param resume: Continue from the checkpoint of a failed extraction, if there is one
+    :param incremental: Only extract the items changed since the last extraction
     :param debug: Boolean to print stuff on console for debugging
+    :return: True if a full extraction was run, False if only the changes were extracted
     """
-    all_items = get_items_all(debug=debug)
-    category_ids = extract_catids(all_items)
-    all_categories = get_categories_all(category_ids, debug=debug)
-    all_products = merge_items_categories(all_items, all_categories, debug=debug)
-    all_products_variants = extract_variant_information(all_products, debug=debug)
+    cursor = get_checkpoint(ITEMS_CHECKPOINT) if resume else None
+    if cursor:
+        started_at = get_checkpoint(STARTED_AT_CHECKPOINT)
+        if debug:
+            print("Resuming extraction from cursor: {}".format(cursor))
+    else:
+        started_at = get_timestamp()
+
+    watermark = get_watermark() if incremental else None
+    if incremental and not watermark and debug:
+        print("No previous sync found. Running a full extraction.")
+    full = not watermark
 
     # Add data to redis
-    if flush_redis:
+    if flush_redis and full and not cursor:
         flush_data()
+    save_checkpoint(STARTED_AT_CHECKPOINT, started_at)
 
-    # Add variant data
-    add_to_redis(all_products_variants, 'SKU', PROCESSED_DATA_PREFIX)
+    all_categories = dict()
+    pages = iter_items_pages(cursor=cursor, updated_at_min=watermark, show_deleted=not full, debug=debug)
+    for items, next_cursor in time_iteration('extract', pages, count=count_page_items):
+        stage_items(items, all_categories, full=full, save_raw=save_raw, debug=debug)
 
-    # Add raw data if directed
-    if save_raw:
-        add_to_redis(all_products, 'id', RAW_DATA_PREFIX)
+        if next_cursor:
+            save_checkpoint(ITEMS_CHECKPOINT, next_cursor)
+
+    set_watermark(started_at)
+    clear_checkpoint(ITEMS_CHECKPOINT)
+    clear_checkpoint(STARTED_AT_CHECKPOINT)
+
+    return full
 
 
 if __name__ == '__main__':
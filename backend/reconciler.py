@@ -0,0 +1,742 @@
+"""
+Reconciler computing every change WooCommerce needs to match the staged Loyverse catalog before sending any of them.
+
+insert_to_woocommerce finds out what exists by trial and error: it sends creates and reacts to the errors of the objects
+that were already there. The reconciler loads both sides first:
+- the staged catalog, from the staging indexes (or the changes recorded by an incremental extraction)
+- a snapshot of WooCommerce: the index of product and variation ids by slug and SKU (see warm_product_index) and the
+  taxonomy cache of attributes, attribute terms and categories (see load_taxonomy_cache)
+and compares them in memory into a Plan of creates, updates and deletes. SKU conflicts are resolved in the plan as
+well, e.g. a single product that became variable is deleted before its SKUs are created as variations.
+
+Applying the plan only sends requests expected to succeed, grouped into batch calls:
+1. Deletes, so the SKUs and slugs they hold are free again
+2. Categories, attributes and attribute terms
+3. Single and variable (parent) products
+4. Variations of every variable product
+
+Usage:
+    plan = build_plan(only_changed=False, prune=False)
+    print(plan.describe())
+    apply_plan(plan)
+"""
+from collections import Counter, defaultdict
+
+from .utils import SLUG_PREFIXES, WOOCOMMERCE_BATCH_SIZE, WOOCOMMERCE_WORKERS, PRODUCT_FINGERPRINTS_KEY, \
+    VARIANT_FINGERPRINTS_KEY, get_milli_time
+from .utils.concurrency import run_in_pool
+from .utils.delta import get_changed_products, get_deleted, clear_changes
+from .utils.fingerprint import get_fingerprints, is_unchanged, save_fingerprints, delete_fingerprints
+from .utils.records import Record, Attribute
+from .utils.staging_index import iter_indexed_products, get_indexed_categories, get_indexed_attributes
+from .utils.wc_index import lookup_slugs, lookup_skus, iter_indexed_slugs, iter_indexed_skus, \
+    remove_variations_from_index
+from .utils.slugs import get_slug
+from .utils.metrics import time_stage
+from .drivers.wcapi import build_product_data, build_product_variation_data, batch_products, \
+    batch_product_variations, batch_categories, batch_attributes, batch_attribute_terms, warm_product_index, \
+    load_taxonomy_cache, lookup_category, lookup_attribute, lookup_attribute_term, register_category_slugs, \
+    register_attribute_slugs
+from .wcapi_inserter import determine_product_types, determine_attributes, get_all_categories, \
+    iter_staged_products, get_update_data, get_variable_product_record, get_attribute_terms
+
+ACTIONS = ('delete', 'create', 'update')
+KINDS = ('category', 'attribute', 'attribute_term', 'product', 'variation')
+
+
+class Operation(Record):
+    """
+    Single change to WooCommerce.
+    - key: what the object is on the Loyverse side. Slug of a category or attribute, (attribute name, term slug) of a
+        term, handle of a product, SKU of a variation
+    - record: staged record of products and variations, name of taxonomy objects
+    - wc_id: id of the object to update or delete
+    - parent: handle of the variable product of a variation to create or update, id of the product of a variation to
+        delete
+    - hash: fingerprint of the record, saved once the change is applied
+    - saved: fingerprint saved after the last push, so updates leave out images that didn't change
+    """
+    __slots__ = ('action', 'kind', 'key', 'record', 'wc_id', 'parent', 'hash', 'saved')
+
+    def __init__(self, action=None, kind=None, key=None, record=None, wc_id=None, parent=None, hash=None, saved=None):
+        self.action = action
+        self.kind = kind
+        self.key = key
+        self.record = record
+        self.wc_id = wc_id
+        self.parent = parent
+        self.hash = hash
+        self.saved = saved
+
+
+class Plan:
+    """
+    Operations needed to bring WooCommerce in line with the staged catalog, with the staged data they were computed
+    from.
+    """
+
+    def __init__(self, only_changed=False):
+        """
+        :param only_changed: The plan only covers the changes recorded by an incremental extraction
+        """
+        self.only_changed = only_changed
+        self.operations = list()
+        self.unchanged = Counter()  # kind -> number of objects already up to date
+        self.collisions = list()  # (name, name that had its slug, slug given instead) of every slug collision
+        self.categories = dict()  # category name -> WooCommerce id, None until created
+        self.attributes = dict()  # attribute name -> Attribute record
+        self.single_products = dict()
+        self.variable_products = dict()
+        self.changed_skus = None
+        self.deleted_skus = None
+        self.deleted_handles = None
+        self._deleted_ids = set()
+
+    def add(self, action, kind, key, record=None, wc_id=None, parent=None, hash=None, saved=None):
+        """
+        Function to add an operation. Deleting the same object twice is only planned once.
+
+        :return: the Operation, or None for a repeated delete
+        """
+        if action == 'delete':
+            if (kind, wc_id) in self._deleted_ids:
+                return None
+            self._deleted_ids.add((kind, wc_id))
+        operation = Operation(action, kind, key, record, wc_id, parent, hash, saved)
+        self.operations.append(operation)
+        return operation
+
+    def is_deleted(self, kind, wc_id):
+        """
+        :return: True if the plan deletes the object
+        """
+        return (kind, wc_id) in self._deleted_ids
+
+    def get_operations(self, action=None, kind=None):
+        """
+        :param action: Only operations with this action
+        :param kind: Only operations on this kind of object
+        :return: list of Operation records, in the order they were planned
+        """
+        return [operation for operation in self.operations
+                if (action is None or operation.action == action) and (kind is None or operation.kind == kind)]
+
+    def count_operations(self):
+        """
+        :return: Counter of (action, kind) -> number of operations
+        """
+        return Counter((operation.action, operation.kind) for operation in self.operations)
+
+    def count_requests(self):
+        """
+        Function to count the batch requests apply_plan sends, per step. Deletes are sent apart from creates and
+        updates, since WooCommerce runs the deletes of a batch last.
+
+        :return: Counter of step ('delete', 'taxonomy', 'products', 'variations') -> number of requests
+        """
+        batches = Counter()
+        for operation in self.operations:
+            if operation.action == 'delete' and operation.kind == 'variation' and \
+                    self.is_deleted('product', operation.parent):
+                # Deleted with their product
+                continue
+            if operation.action == 'delete':
+                batches[('delete', operation.kind, operation.parent)] += 1
+            elif operation.kind == 'category':
+                batches[('taxonomy', 'categories')] += 1
+            elif operation.kind == 'attribute':
+                batches[('taxonomy', 'attributes')] += 1
+            elif operation.kind == 'attribute_term':
+                batches[('taxonomy', 'terms', operation.key[0])] += 1
+            elif operation.kind == 'product':
+                batches[('products',)] += 1
+            else:
+                batches[('variations', operation.parent)] += 1
+
+        requests = Counter()
+        for batch, count in batches.items():
+            requests[batch[0]] += -(-count // WOOCOMMERCE_BATCH_SIZE)
+        return requests
+
+    def is_empty(self):
+        """
+        :return: True if WooCommerce is already up to date
+        """
+        return not self.operations
+
+    def describe(self):
+        """
+        :return: text summary of the operations and the requests needed to apply them
+        """
+        counts = self.count_operations()
+        requests = self.count_requests()
+        lines = ['Plan: {} operations in {} requests'.format(len(self.operations), sum(requests.values()))]
+        for action in ACTIONS:
+            for kind in KINDS:
+                if counts[(action, kind)]:
+                    lines.append('  {:<7} {:<15} {:>8}'.format(action, kind, counts[(action, kind)]))
+        for kind in KINDS:
+            if self.unchanged[kind]:
+                lines.append('  {:<7} {:<15} {:>8}'.format('keep', kind, self.unchanged[kind]))
+        lines.append('Requests: {}'.format(', '.join('{} {}'.format(step, requests[step])
+                                                     for step in ('delete', 'taxonomy', 'products', 'variations')
+                                                     if requests[step]) or 'none'))
+        for name, other_name, slug in self.collisions:
+            lines.append('Slug collision: {!r} has the slug of {!r}, using {}'.format(name, other_name, slug))
+        return '\n'.join(lines)
+
+
+def get_product_slug(handle):
+    """
+    :param handle: Handle of a product
+    :return: slug of the product in WooCommerce
+    """
+    return '{}{}'.format(SLUG_PREFIXES['product'], handle)
+
+
+def get_product_handle(slug):
+    """
+    :param slug: Slug of a product in WooCommerce
+    :return: handle of the product or None if the slug wasn't given by the sync
+    """
+    prefix = SLUG_PREFIXES['product']
+    return slug[len(prefix):] if slug and slug.startswith(prefix) else None
+
+
+def build_plan(only_changed=False, prune=False, rebuild_index=False, workers=WOOCOMMERCE_WORKERS, debug=False):
+    """
+    Function to load the staged catalog and the WooCommerce snapshot and compare them into a plan. Only list
+    requests are sent to WooCommerce, and only if the index of product ids isn't warm yet or rebuild_index is set.
+
+    :param only_changed: Only plan the products changed or deleted since the last push, as recorded by an incremental
+                extraction
+    :param prune: Also delete the products and variations this program created that aren't staged anymore. Only
+                used for full plans
+    :param rebuild_index: Build the index of WooCommerce product ids again, e.g. after products were edited in the
+                WooCommerce admin
+    :param workers: Number of concurrent list requests while loading the snapshot
+    :param debug: Boolean to print stuff on console for debugging
+    :return: Plan object
+    """
+    plan = Plan(only_changed)
+    if only_changed:
+        plan.changed_skus, product_list = get_changed_products()
+        plan.deleted_skus, plan.deleted_handles = get_deleted()
+    else:
+        product_list = iter_indexed_products()
+    plan.single_products, plan.variable_products = determine_product_types(product_list)
+
+    warm_product_index(rebuild=rebuild_index, workers=workers, debug=debug)
+    load_taxonomy_cache(workers=workers, debug=debug)
+
+    if only_changed:
+        categories = get_all_categories(iter_staged_products(plan.single_products, plan.variable_products))
+        attributes = determine_attributes(plan.variable_products)
+    else:
+        categories = dict.fromkeys(get_indexed_categories())
+        attributes = {attribute: Attribute(name=attribute, terms=dict.fromkeys(terms))
+                      for attribute, terms in get_indexed_attributes().items()}
+
+    plan_categories(plan, categories)
+    plan_attributes(plan, attributes)
+    plan_single_products(plan)
+    plan_variable_products(plan)
+    if only_changed:
+        plan_deletes(plan)
+    elif prune:
+        plan_prune(plan)
+
+    if debug:
+        print(plan.describe())
+    return plan
+
+
+def plan_categories(plan, categories):
+    """
+    Function to plan the creation of the categories missing from the taxonomy cache. Every name is registered in the
+    slug registry first, so each of them has a slug of its own.
+
+    :param plan: Plan object
+    :param categories: Dict with category names as keys
+    """
+    plan.collisions += register_category_slugs(categories)
+    for name in categories:
+        slug = get_slug('category', name)
+        plan.categories[name] = lookup_category(slug)
+        if plan.categories[name]:
+            plan.unchanged['category'] += 1
+        else:
+            plan.add('create', 'category', slug, record=name)
+
+
+def plan_attributes(plan, attributes):
+    """
+    Function to plan the creation of the attributes and attribute terms missing from the taxonomy cache.
+
+    :param plan: Plan object
+    :param attributes: Dict of Attribute records with their terms
+    """
+    plan.collisions += register_attribute_slugs(attributes)
+    for name in attributes:
+        slug = get_slug('attribute', name)
+        attribute_id = lookup_attribute(slug)
+        plan.attributes[name] = Attribute(name=name, terms=dict(), wc_id=attribute_id)
+        if attribute_id:
+            plan.unchanged['attribute'] += 1
+        else:
+            plan.add('create', 'attribute', slug, record=name)
+
+        for term in attributes[name]['terms']:
+            term_slug = get_slug('attribute_term', term, scope=name)
+            plan.attributes[name]['terms'][term] = lookup_attribute_term(attribute_id, term_slug) if attribute_id \
+                else None
+            if plan.attributes[name]['terms'][term]:
+                plan.unchanged['attribute_term'] += 1
+            else:
+                plan.add('create', 'attribute_term', (name, term_slug), record=term)
+
+
+def plan_single_products(plan):
+    """
+    Function to plan the creates and updates of single products. A product is matched by its slug, or by its SKU
+    if no product has the slug. Conflicting holders of the SKU are deleted first.
+
+    :param plan: Plan object
+    """
+    single_products = plan.single_products
+    fingerprints = get_fingerprints(PRODUCT_FINGERPRINTS_KEY, single_products)
+    product_ids = lookup_slugs(get_product_slug(handle) for handle in single_products)
+    indexed_skus = lookup_skus(single_products[handle]['SKU'] for handle in single_products)
+
+    for handle in single_products:
+        product = single_products[handle]
+        new_hash, saved = fingerprints[handle]
+        product_id = product_ids[get_product_slug(handle)]
+        indexed = indexed_skus[product['SKU']]
+        if indexed and indexed['parent_id']:
+            # The SKU is held by a variation, e.g. the item had variants before
+            plan.add('delete', 'variation', product['SKU'], wc_id=indexed['id'], parent=indexed['parent_id'])
+        elif indexed and product_id and indexed['id'] != product_id:
+            # Another product holds the SKU
+            plan.add('delete', 'product', product['SKU'], wc_id=indexed['id'])
+        elif indexed:
+            product_id = indexed['id']
+
+        if not product_id:
+            plan.add('create', 'product', handle, record=product, hash=new_hash)
+        elif is_unchanged(new_hash, saved) and saved['wc_id'] == product_id:
+            product['wc_id'] = product_id
+            plan.unchanged['product'] += 1
+        else:
+            plan.add('update', 'product', handle, record=product, wc_id=product_id, hash=new_hash, saved=saved)
+
+
+def plan_variable_products(plan):
+    """
+    Function to plan the creates and updates of variable products and their variations. A product that still holds
+    one of the SKUs (it was a single product before) is deleted and created again as variable.
+
+    :param plan: Plan object
+    """
+    variable_products = plan.variable_products
+    records = {handle: get_variable_product_record(variable_products[handle]) for handle in variable_products}
+    fingerprints = get_fingerprints(PRODUCT_FINGERPRINTS_KEY, records)
+    product_ids = lookup_slugs(get_product_slug(handle) for handle in variable_products)
+    variants = {variant['SKU']: variant for handle in variable_products
+                for variant in variable_products[handle]['variants']}
+    indexed_skus = lookup_skus(variants)
+    variant_fingerprints = get_fingerprints(VARIANT_FINGERPRINTS_KEY, variants)
+
+    for handle in variable_products:
+        variable_product = variable_products[handle]
+        skus = [variant['SKU'] for variant in variable_product['variants']]
+        new_hash, saved = fingerprints[handle]
+        product_id = product_ids[get_product_slug(handle)]
+        if product_id and any(indexed_skus[sku] and not indexed_skus[sku]['parent_id'] and
+                              indexed_skus[sku]['id'] == product_id for sku in skus):
+            plan.add('delete', 'product', handle, wc_id=product_id)
+            product_id = None
+
+        if not product_id:
+            plan.add('create', 'product', handle, record=variable_product, hash=new_hash)
+        elif is_unchanged(new_hash, saved) and saved['wc_id'] == product_id:
+            variable_product['wc_id'] = product_id
+            plan.unchanged['product'] += 1
+        else:
+            plan.add('update', 'product', handle, record=variable_product, wc_id=product_id, hash=new_hash,
+                     saved=saved)
+
+        for sku in skus:
+            variant = variants[sku]
+            variant_hash, variant_saved = variant_fingerprints[sku]
+            indexed = indexed_skus[sku]
+            variation_id = None
+            if indexed and indexed['parent_id'] and indexed['parent_id'] == product_id:
+                variation_id = indexed['id']
+            elif indexed and indexed['parent_id']:
+                # The variation moved to another parent
+                plan.add('delete', 'variation', sku, wc_id=indexed['id'], parent=indexed['parent_id'])
+            elif indexed and indexed['id'] != product_id:
+                # A product holds the SKU, e.g. it was a single product before
+                plan.add('delete', 'product', sku, wc_id=indexed['id'])
+
+            if not variation_id:
+                plan.add('create', 'variation', sku, record=variant, parent=handle, hash=variant_hash)
+            elif is_unchanged(variant_hash, variant_saved) and variant_saved['wc_id'] == variation_id and \
+                    variant_saved.get('parent_id') == product_id:
+                variant['wc_id'] = variation_id
+                plan.unchanged['variation'] += 1
+            else:
+                plan.add('update', 'variation', sku, record=variant, wc_id=variation_id, parent=handle,
+                         hash=variant_hash)
+
+
+def plan_deletes(plan):
+    """
+    Function to plan the deletion of the products and variations deleted in Loyverse since the last push. SKUs and
+    handles staged again since are left to the creates and updates.
+
+    :param plan: Plan object
+    """
+    staged_skus = {product['SKU'] for product in iter_staged_products(plan.single_products, plan.variable_products)}
+    staged_handles = set(plan.single_products) | set(plan.variable_products)
+
+    deleted_skus = [sku for sku in plan.deleted_skus or [] if sku not in staged_skus]
+    for sku, indexed in lookup_skus(deleted_skus).items():
+        if indexed and indexed['parent_id']:
+            plan.add('delete', 'variation', sku, wc_id=indexed['id'], parent=indexed['parent_id'])
+        elif indexed:
+            plan.add('delete', 'product', sku, wc_id=indexed['id'])
+
+    deleted_handles = [handle for handle in plan.deleted_handles or [] if handle not in staged_handles]
+    product_ids = lookup_slugs(get_product_slug(handle) for handle in deleted_handles)
+    for handle in deleted_handles:
+        product_id = product_ids[get_product_slug(handle)]
+        if product_id:
+            plan.add('delete', 'product', handle, wc_id=product_id)
+
+
+def plan_prune(plan):
+    """
+    Function to plan the deletion of the products (by the product slug prefix) and variations that are in WooCommerce
+    but not staged anymore. Variations are pruned under the staged products only, e.g. the leftovers of a variable
+    product that became a single product.
+
+    :param plan: Plan object
+    """
+    kept_ids = {operation.wc_id for operation in plan.get_operations('update', 'product')}
+    kept_ids.update(product['wc_id'] for product in iter_staged_products(plan.single_products, {}) if product['wc_id'])
+    kept_ids.update(product['wc_id'] for product in plan.variable_products.values() if product['wc_id'])
+
+    prefix = SLUG_PREFIXES['product']
+    for slug, product_id in iter_indexed_slugs():
+        if slug.startswith(prefix) and product_id not in kept_ids:
+            plan.add('delete', 'product', slug[len(prefix):], wc_id=product_id)
+
+    variation_skus = {variant['SKU'] for variant in iter_staged_products({}, plan.variable_products)}
+    for sku, indexed in iter_indexed_skus():
+        if indexed['parent_id'] in kept_ids and sku not in variation_skus:
+            plan.add('delete', 'variation', sku, wc_id=indexed['id'], parent=indexed['parent_id'])
+
+
+def apply_plan(plan, workers=WOOCOMMERCE_WORKERS, debug=False):
+    """
+    Function to send the operations of a plan to WooCommerce with batch calls, in dependency order. Fingerprints of
+    the pushed objects are saved (and forgotten for deleted ones) like insert_to_woocommerce does.
+
+    :param plan: Plan object from build_plan
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :return: Counter of (action, kind, 'done' or 'failed') -> number of operations
+    """
+    results = Counter()
+    start_time = get_milli_time()
+    steps = (('delete', apply_deletes), ('categories', apply_categories), ('attributes', apply_attributes),
+             ('products', apply_products), ('variants', apply_variations))
+    for stage_name, apply_step in steps:
+        with time_stage(stage_name) as stage:
+            applied = sum(results.values())
+            apply_step(plan, results, workers=workers, debug=debug)
+            stage.items = sum(results.values()) - applied
+    if plan.only_changed:
+        # Single products are fingerprinted by handle, variations by SKU
+        delete_fingerprints(VARIANT_FINGERPRINTS_KEY, plan.deleted_skus)
+        delete_fingerprints(PRODUCT_FINGERPRINTS_KEY, plan.deleted_handles)
+        clear_changes(plan.changed_skus, plan.deleted_skus, plan.deleted_handles)
+
+    if debug:
+        failed = sum(count for (action, kind, outcome), count in results.items() if outcome == 'failed')
+        end_time = get_milli_time() - start_time
+        print('Applied {} operations ({} failed) in {}ms'.format(sum(results.values()), failed, end_time))
+    return results
+
+
+def _count_results(operations, batch_results, results, debug=False):
+    """
+    Function to count the outcome of the operations sent in a batch.
+
+    :param operations: Dict of batch key -> Operation
+    :param batch_results: Results of the batch driver function
+    :param results: Counter of apply_plan
+    :param debug: Boolean to print stuff on console for debugging
+    :return: list of the keys whose operation succeeded
+    """
+    succeeded = list()
+    for key in operations:
+        operation = operations[key]
+        already_exists, result = batch_results.get(key, (None, None))
+        if already_exists is None:
+            results[(operation.action, operation.kind, 'failed')] += 1
+            if debug:
+                print('Could not {} {}: {}. Error: {}'.format(operation.action, operation.kind, operation.key, result))
+        else:
+            results[(operation.action, operation.kind, 'done')] += 1
+            succeeded.append(key)
+    return succeeded
+
+
+def apply_deletes(plan, results, workers=1, debug=False):
+    """
+    Function to delete products and variations. Variations go first, as deleting a product deletes its variations.
+    """
+    variations = defaultdict(dict)
+    for operation in plan.get_operations('delete', 'variation'):
+        if plan.is_deleted('product', operation.parent):
+            # Deleted with their product
+            results[('delete', 'variation', 'done')] += 1
+        else:
+            variations[operation.parent][operation.wc_id] = operation
+
+    def delete_variations(parent_id):
+        operations = variations[parent_id]
+        batch_results = batch_product_variations(parent_id, delete={key: key for key in operations}, debug=debug)
+        _count_results(operations, batch_results, results, debug=debug)
+
+    run_in_pool(delete_variations, list(variations), workers=workers)
+
+    products = {operation.wc_id: operation for operation in plan.get_operations('delete', 'product')}
+    if products:
+        batch_results = batch_products(delete={key: key for key in products}, workers=workers, debug=debug)
+        deleted = _count_results(products, batch_results, results, debug=debug)
+        remove_variations_from_index(deleted)
+        # Products deleted for holding a SKU are planned by SKU, so the handle is taken from the deleted product
+        handles = [get_product_handle(batch_results[product_id][1].get('slug')) for product_id in deleted]
+        delete_fingerprints(PRODUCT_FINGERPRINTS_KEY, [handle for handle in handles if handle])
+
+
+def apply_categories(plan, results, workers=1, debug=False):
+    """
+    Function to create the planned categories and give their ids to the category names of the plan.
+    """
+    operations = {operation.key: operation for operation in plan.get_operations('create', 'category')}
+    if not operations:
+        return
+    batch_results = batch_categories({slug: {'name': operations[slug].record, 'slug': slug} for slug in operations},
+                                     workers=workers, debug=debug)
+    _count_results(operations, batch_results, results, debug=debug)
+    for name in plan.categories:
+        slug = get_slug('category', name)
+        if not plan.categories[name] and batch_results.get(slug, (None,))[0] is not None:
+            plan.categories[name] = batch_results[slug][1]['id']
+
+
+def apply_attributes(plan, results, workers=1, debug=False):
+    """
+    Function to create the planned attributes, then the planned terms of every attribute, and give their ids to the
+    attributes of the plan.
+    """
+    operations = {operation.key: operation for operation in plan.get_operations('create', 'attribute')}
+    if operations:
+        batch_results = batch_attributes({slug: {'name': operations[slug].record, 'slug': slug}
+                                          for slug in operations}, workers=workers, debug=debug)
+        for slug in _count_results(operations, batch_results, results, debug=debug):
+            plan.attributes[operations[slug].record]['wc_id'] = batch_results[slug][1]['id']
+
+    terms = defaultdict(dict)
+    for operation in plan.get_operations('create', 'attribute_term'):
+        terms[operation.key[0]][operation.key[1]] = operation
+
+    def create_terms(name):
+        attribute = plan.attributes[name]
+        operations = terms[name]
+        if not attribute['wc_id']:
+            results[('create', 'attribute_term', 'failed')] += len(operations)
+            return
+        batch_results = batch_attribute_terms(attribute['wc_id'], {slug: {'name': operations[slug].record,
+                                                                          'slug': slug} for slug in operations},
+                                              debug=debug)
+        _count_results(operations, batch_results, results, debug=debug)
+        for term in attribute['terms']:
+            term_slug = get_slug('attribute_term', term, scope=name)
+            if not attribute['terms'][term] and batch_results.get(term_slug, (None,))[0] is not None:
+                attribute['terms'][term] = batch_results[term_slug][1]['id']
+
+    run_in_pool(create_terms, list(terms), workers=workers)
+
+
+def get_image_url(plan, handle, record):
+    """
+    :return: image url of a single product, or of the parent of a variable product
+    """
+    if handle in plan.variable_products:
+        return record['variants'][0].get('image_url')
+    return record.get('image_url')
+
+
+def get_single_product_data(plan, handle, product):
+    """
+    :return: product data of a single product for build_product_data, None if its category couldn't be created
+    """
+    category_id = None
+    if product['category_name']:
+        category_id = plan.categories.get(product['category_name'])
+        if not category_id:
+            return None
+    image_urls = [product['image_url']] if product.get('image_url') else None
+    return build_product_data(product['name'], get_product_slug(handle), 'simple', sku=product['SKU'],
+                              category_id=category_id, regular_price=str(product['price']), manage_stock=None,
+                              image_urls=image_urls)
+
+
+def get_variable_product_data(plan, handle, variable_product):
+    """
+    :return: product data of a variable (parent) product, None if its category or attribute couldn't be created
+    """
+    product = variable_product['variants'][0]
+    category_id = None
+    if product['category_name']:
+        category_id = plan.categories.get(product['category_name'])
+        if not category_id:
+            return None
+    attribute = plan.attributes.get(product['option_1_name'])
+    if not attribute or not attribute['wc_id']:
+        return None
+    image_urls = [product['image_url']] if product.get('image_url') else None
+    return build_product_data(product['name'], get_product_slug(handle), 'variable', category_id=category_id,
+                              manage_stock=False, image_urls=image_urls, attribute_id=attribute['wc_id'],
+                              attribute_options=get_attribute_terms(variable_product), attribute_variation=True,
+                              attribute_visible=True)
+
+
+def apply_products(plan, results, workers=1, debug=False):
+    """
+    Function to create and update single and variable products, and give their ids to the staged records.
+    """
+    operations = dict()
+    products_create = dict()
+    products_update = dict()
+    for operation in plan.operations:
+        if operation.kind != 'product' or operation.action == 'delete':
+            continue
+        handle = operation.key
+        if handle in plan.variable_products:
+            data = get_variable_product_data(plan, handle, operation.record)
+        else:
+            data = get_single_product_data(plan, handle, operation.record)
+        if data is None:
+            results[(operation.action, 'product', 'failed')] += 1
+            if debug:
+                print('Could not {} product: {}. Its category or attribute is missing'.format(operation.action,
+                                                                                             handle))
+            continue
+
+        operations[handle] = operation
+        if operation.action == 'create' or plan.is_deleted('product', operation.wc_id):
+            # Also create the products whose match was deleted to free a SKU
+            products_create[handle] = data
+        else:
+            products_update[handle] = get_update_data(data, operation.wc_id, operation.saved,
+                                                      get_image_url(plan, handle, operation.record))
+
+    batch_results = batch_products(create=products_create, update=products_update, workers=workers, debug=debug)
+
+    # A product created since the snapshot was taken holds the SKU. Update it instead, like the inserter does
+    products_update = {handle: get_update_data(products_create[handle], batch_results[handle][1]['id'])
+                       for handle in products_create if batch_results.get(handle, (None, None))[0]}
+    if products_update:
+        batch_results.update(batch_products(update=products_update, workers=workers, debug=debug))
+
+    pushed = dict()
+    for handle in _count_results(operations, batch_results, results, debug=debug):
+        operation = operations[handle]
+        operation.record['wc_id'] = batch_results[handle][1]['id']
+        pushed[handle] = {'hash': operation.hash, 'wc_id': operation.record['wc_id'],
+                          'image_url': get_image_url(plan, handle, operation.record)}
+    save_fingerprints(PRODUCT_FINGERPRINTS_KEY, pushed)
+
+
+def apply_variations(plan, results, workers=1, debug=False):
+    """
+    Function to create and update the variations of every variable product, one parent at a time.
+    """
+    variations = defaultdict(dict)
+    for operation in plan.operations:
+        if operation.kind == 'variation' and operation.action != 'delete':
+            variations[operation.parent][operation.key] = operation
+
+    def push_variations(handle):
+        operations = variations[handle]
+        parent_id = plan.variable_products[handle]['wc_id']
+        if not parent_id:
+            for operation in operations.values():
+                results[(operation.action, 'variation', 'failed')] += 1
+            if debug:
+                print("Skipping variations of product: {}. Parent product was not created.".format(handle))
+            return
+
+        variants_create = dict()
+        variants_update = dict()
+        for sku in operations:
+            operation = operations[sku]
+            variant = operation.record
+            attribute = plan.attributes[variant['option_1_name']]
+            if not attribute['wc_id']:
+                results[(operation.action, 'variation', 'failed')] += 1
+                continue
+            image_urls = [variant['image_url']] if variant.get('image_url') else None
+            data = build_product_variation_data(variant['name'], sku, variant['price'], image_urls=image_urls,
+                                                attribute_id=attribute['wc_id'],
+                                                attribute_term_name=variant['option_1_value'], manage_stock=None)
+            if operation.action == 'create':
+                variants_create[sku] = data
+            else:
+                variants_update[sku] = get_update_data(data, operation.wc_id)
+
+        batch_results = batch_product_variations(parent_id, create=variants_create, update=variants_update,
+                                                 debug=debug)
+        pushed = dict()
+        for sku in _count_results(operations, batch_results, results, debug=debug):
+            operations[sku].record['wc_id'] = batch_results[sku][1]['id']
+            pushed[sku] = {'hash': operations[sku].hash, 'wc_id': batch_results[sku][1]['id'], 'parent_id': parent_id}
+        save_fingerprints(VARIANT_FINGERPRINTS_KEY, pushed)
+
+    run_in_pool(push_variations, list(variations), workers=workers)
+
+
+def reconcile(only_changed=False, prune=False, rebuild_index=False, dry_run=False, workers=WOOCOMMERCE_WORKERS,
+              debug=False):
+    """
+    Function to plan and apply the push of the staged catalog to WooCommerce. Replaces insert_to_woocommerce.
+
+    :param only_changed: Only push the products changed or deleted since the last push
+    :param prune: Also delete the products and variations this program created that aren't staged anymore
+    :param rebuild_index: Build the index of WooCommerce product ids again before planning
+    :param dry_run: Only print the plan, without applying it
+    :param workers: Number of concurrent requests
+    :param debug: Boolean to print stuff on console for debugging
+    :return: the Plan object
+    """
+    with time_stage('plan') as stage:
+        plan = build_plan(only_changed=only_changed, prune=prune, rebuild_index=rebuild_index, workers=workers,
+                          debug=debug)
+        stage.items = len(plan.operations)
+    if dry_run:
+        if not debug:
+            print(plan.describe())
+        return plan
+    apply_plan(plan, workers=workers, debug=debug)
+    return plan
+
+
+if __name__ == '__main__':
+    reconcile(dry_run=True, debug=True)
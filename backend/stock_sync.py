@@ -0,0 +1,153 @@
+"""
+Script to push stock levels from Loyverse to WooCommerce, separately from the catalog sync.
+Light enough to run every minute: only levels changed since the last run are requested and only quantities that differ
+from what was last pushed are sent, through batch updates.
+"""
+from .drivers.loyapi import iter_inventory_pages
+from .drivers.wcapi import batch_products, batch_product_variations, warm_product_index
+from .utils import LOYVERSE_STOCK_STORE_IDS, LOYVERSE_VARIANT_IDS_PER_REQUEST, WOOCOMMERCE_WORKERS, chunk_list, \
+    get_milli_time
+from .utils.concurrency import run_in_pool
+from .utils.delta import get_timestamp
+from .utils.stock import get_variant_skus, get_pushed_stock, save_pushed_stock, get_pending_stock, \
+    save_pending_stock, get_stock_watermark, set_stock_watermark
+from .utils.wc_index import lookup_sku
+
+
+def sync_stock(full=False, variant_ids=None, workers=WOOCOMMERCE_WORKERS, debug=False):
+    """
+    Main pipeline
+
+    Steps:
+    ======
+    1. Find the variants whose inventory changed since the last stock sync (every variant on the first run)
+    2. Get their levels in every store and sum them up per SKU
+    3. Add the quantities a previous stock sync could not push and compare with the quantities last pushed
+    4. Send the changed quantities through batch updates of products and variations
+    5. Keep the quantities that could not be pushed (SKU not in WooCommerce yet, failed batch) for the next stock
+       sync, so the watermark can move on without them
+
+    :param full: Check the stock of every variant instead of only the ones changed since the last stock sync
+    :param variant_ids: Only check the stock of these Loyverse variants, e.g. the ones a webhook reported. The stock
+                sync watermark is left untouched
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    """
+    start_time = get_milli_time()
+    started_at = get_timestamp()
+    watermark = None if full else get_stock_watermark()
+
+    pending = get_pending_stock()
+    # Levels read now are more recent than the ones kept from a previous stock sync
+    stock = dict(pending, **get_stock_levels(updated_since=watermark, variant_ids=variant_ids, debug=debug))
+    pushed = get_pushed_stock(list(stock))
+    changed = {sku: stock[sku] for sku in stock if pushed.get(sku) != stock[sku]}
+    if debug:
+        print("Stock levels checked: {}. Changed: {}".format(len(stock), len(changed)))
+
+    updated = dict()
+    if changed:
+        warm_product_index(workers=workers, debug=debug)
+        updated = push_stock(changed, workers=workers, debug=debug)
+        save_pushed_stock(updated)
+
+    unpushed = {sku: changed[sku] for sku in changed if sku not in updated}
+    save_pending_stock(unpushed, done=[sku for sku in pending if sku not in unpushed])
+    if debug and unpushed:
+        print("Stock of {} SKUs not pushed, retrying on the next stock sync".format(len(unpushed)))
+    if variant_ids is None:
+        set_stock_watermark(started_at)
+    end_time = get_milli_time() - start_time
+    if debug:
+        print('Stock sync Time Taken: {}ms ({}s)'.format(end_time, end_time / 1000))
+
+
+def get_stock_levels(updated_since=None, variant_ids=None, debug=False):
+    """
+    Function to get the stock of every SKU summed up across stores.
+
+    :param updated_since: Only get SKUs with a level updated at or after this timestamp. None gets every SKU
+    :param variant_ids: Only get the SKUs of these Loyverse variants. Takes precedence over updated_since
+    :param debug: Boolean to print stuff on console for debugging
+    :return: dict of SKU -> stock quantity
+    """
+    if updated_since and variant_ids is None:
+        # Levels changed in one store still have to be summed with the other stores, so get every level of the
+        # variants that changed
+        variant_ids = set()
+        for inventory_levels in iter_inventory_pages(store_ids=LOYVERSE_STOCK_STORE_IDS,
+                                                     updated_at_min=updated_since, debug=debug):
+            variant_ids.update(level['variant_id'] for level in inventory_levels)
+
+    if variant_ids is not None:
+        inventory_pages = (inventory_levels
+                           for variant_ids_chunk in chunk_list(sorted(variant_ids), LOYVERSE_VARIANT_IDS_PER_REQUEST)
+                           for inventory_levels in iter_inventory_pages(store_ids=LOYVERSE_STOCK_STORE_IDS,
+                                                                        variant_ids=variant_ids_chunk, debug=debug))
+    else:
+        inventory_pages = iter_inventory_pages(store_ids=LOYVERSE_STOCK_STORE_IDS, debug=debug)
+
+    variant_stock = dict()
+    for inventory_levels in inventory_pages:
+        for level in inventory_levels:
+            variant_stock[level['variant_id']] = variant_stock.get(level['variant_id'], 0) + (level['in_stock'] or 0)
+
+    variant_skus = get_variant_skus(list(variant_stock))
+    stock = dict()
+    for variant_id in variant_skus:
+        sku = variant_skus[variant_id]
+        # WooCommerce only accepts whole quantities
+        stock[sku] = stock.get(sku, 0) + int(variant_stock[variant_id])
+
+    return stock
+
+
+def push_stock(stock, workers=1, debug=False):
+    """
+    Function to send stock quantities to WooCommerce with batch updates.
+    Products and variations are found through the index of WooCommerce ids.
+
+    :param stock: Dict of SKU -> stock quantity
+    :param workers: Number of batch requests to send concurrently
+    :param debug: Boolean to print stuff on console for debugging
+    :return: dict of SKU -> stock quantity for the SKUs that were updated
+    """
+    products_update = dict()
+    variations_update = dict()
+    for sku in stock:
+        indexed = lookup_sku(sku)
+        if not indexed:
+            if debug:
+                print("Skipping stock of SKU: {}. Not found in WooCommerce.".format(sku))
+            continue
+        data = {'id': indexed['id'], 'manage_stock': True, 'stock_quantity': stock[sku]}
+        if indexed['parent_id']:
+            variations_update.setdefault(indexed['parent_id'], dict())[sku] = data
+        else:
+            products_update[sku] = data
+
+    results = batch_products(update=products_update, workers=workers, debug=debug)
+
+    def update_variations(parent_id):
+        return batch_product_variations(parent_id, update=variations_update[parent_id], debug=debug)
+
+    for variation_results in run_in_pool(update_variations, variations_update, workers=workers):
+        results.update(variation_results)
+
+    updated = dict()
+    for sku in results:
+        already_exists, wc_product = results[sku]
+        if already_exists is None:
+            if debug:
+                print("Could not update stock of SKU: {}. Error: {}".format(sku, wc_product))
+            continue
+        updated[sku] = stock[sku]
+
+    if debug:
+        print("Stock updated for {} SKUs".format(len(updated)))
+
+    return updated
+
+
+if __name__ == '__main__':
+    sync_stock(debug=True)
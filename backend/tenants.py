@@ -0,0 +1,180 @@
+"""
+Multi-tenant runner syncing several Loyverse accounts to their WooCommerce shops at the same time.
+
+Tenants are read from a json file holding a list of objects, e.g.
+
+    [{"name": "shop-a", "loyverse_token": "...", "woocommerce_url": "https://shop-a.example.com",
+      "woocommerce_key": "ck_...", "woocommerce_secret": "cs_...", "redis_db": 1, "rate_limit": 5, "workers": 2}]
+
+Only name, the Loyverse token and the WooCommerce url and keys are required, the other fields default to the settings
+of vars.py (see Tenant). Every tenant is synced in a process of its own with its own Loyverse session, WooCommerce
+client, rate limiter, retry state, circuit breaker and redis database, so a slow or failing shop doesn't hold back the
+others. Those are module state of the drivers, which is why tenants run in processes and not in threads.
+"""
+import json
+import multiprocessing
+import os
+import sys
+from multiprocessing.connection import wait
+
+from backend.drivers import loyapi, wcapi
+from backend.loyverse_extractor import extract_loyverse_data
+from backend.reconciler import reconcile
+from backend.stock_sync import sync_stock
+from backend.wcapi_inserter import insert_to_woocommerce
+from backend.utils import (LOYVERSE_API_BASE, LOYVERSE_POOL_SIZE, REDIS_HOST, REDIS_PORT, REDIS_DB,
+                           WOOCOMMERCE_RATE_LIMIT, WOOCOMMERCE_RATE_BURST, WOOCOMMERCE_MAX_IN_FLIGHT,
+                           WOOCOMMERCE_WORKERS)
+from backend.utils.http import create_session, create_wcapi_client
+from backend.utils.metrics import write_textfile
+from backend.utils.records import Record
+from backend.utils.redis import configure_redis
+from backend.utils.slugs import clear_slug_cache
+
+REQUIRED_FIELDS = ('name', 'loyverse_token', 'woocommerce_url', 'woocommerce_key', 'woocommerce_secret')
+
+
+class Tenant(Record):
+    """
+    A Loyverse account and the WooCommerce shop it is synced to.
+    """
+    __slots__ = ('name', 'loyverse_token', 'woocommerce_url', 'woocommerce_key', 'woocommerce_secret',
+                 'loyverse_api_base', 'redis_host', 'redis_port', 'redis_db', 'rate_limit', 'rate_burst',
+                 'max_in_flight', 'workers')
+
+    def __init__(self, name=None, loyverse_token=None, woocommerce_url=None, woocommerce_key=None,
+                 woocommerce_secret=None, loyverse_api_base=LOYVERSE_API_BASE, redis_host=REDIS_HOST,
+                 redis_port=REDIS_PORT, redis_db=REDIS_DB, rate_limit=WOOCOMMERCE_RATE_LIMIT,
+                 rate_burst=WOOCOMMERCE_RATE_BURST, max_in_flight=WOOCOMMERCE_MAX_IN_FLIGHT,
+                 workers=WOOCOMMERCE_WORKERS):
+        self.name = name
+        self.loyverse_token = loyverse_token
+        self.woocommerce_url = woocommerce_url
+        self.woocommerce_key = woocommerce_key
+        self.woocommerce_secret = woocommerce_secret
+        self.loyverse_api_base = loyverse_api_base
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.redis_db = redis_db
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.max_in_flight = max_in_flight
+        self.workers = workers
+
+
+def load_tenants(path):
+    """
+    Function to read the tenants from a json file.
+    Tenants must have a unique name and a redis database of their own, since every key the sync writes (staged data,
+    fingerprints, index of WooCommerce ids, ...) has the same name for every shop.
+
+    :param path: Path of the json file
+    :return: list of Tenant records
+    :raises ValueError: if a tenant misses a required field, or shares its name or redis database with another one
+    """
+    with open(path) as tenants_file:
+        tenants = [Tenant.from_dict(data) for data in json.load(tenants_file)]
+
+    names = set()
+    databases = dict()
+    for tenant in tenants:
+        missing = [field for field in REQUIRED_FIELDS if not tenant[field]]
+        if missing:
+            raise ValueError('Tenant {} misses {}'.format(tenant.name, ', '.join(missing)))
+        if tenant.name in names:
+            raise ValueError('Tenant name {} is used more than once'.format(tenant.name))
+        names.add(tenant.name)
+        database = (tenant.redis_host, tenant.redis_port, tenant.redis_db)
+        if database in databases:
+            raise ValueError('Tenants {} and {} share redis database {}:{}/{}'.format(databases[database], tenant.name,
+                                                                                     *database))
+        databases[database] = tenant.name
+    return tenants
+
+
+def configure_tenant(tenant):
+    """
+    Function to point the drivers and redis of this process to the accounts of a tenant.
+
+    :param tenant: Tenant record
+    """
+    configure_redis(tenant.redis_host, tenant.redis_port, tenant.redis_db)
+    loyapi.configure_api(tenant.loyverse_api_base,
+                         create_session(headers={'Authorization': 'Bearer {}'.format(tenant.loyverse_token)},
+                                        pool_size=LOYVERSE_POOL_SIZE))
+    wcapi.configure_request_limits(rate=tenant.rate_limit, burst=tenant.rate_burst,
+                                   max_in_flight=tenant.max_in_flight,
+                                   client=create_wcapi_client(tenant.woocommerce_url, tenant.woocommerce_key,
+                                                              tenant.woocommerce_secret))
+    wcapi.clear_taxonomy_cache()
+    clear_slug_cache()
+
+
+def run_tenant(tenant, incremental=False, resume=False, rebuild_index=False, stock=False, use_reconciler=False,
+               prune=False, log_directory=None, debug=False):
+    """
+    Function to sync one tenant, like app.py does for the shop of auth.py. Runs in the process of the tenant.
+    The metrics of the sync are written to the textfile of the tenant ('sync_<name>' or 'stock_<name>').
+
+    :param tenant: Tenant record
+    :param incremental: Only sync the items changed in Loyverse since the last sync
+    :param resume: Continue a failed extraction from its checkpoint and a failed push from its journal
+    :param rebuild_index: Rebuild the index of WooCommerce ids before pushing
+    :param stock: Only sync stock levels
+    :param use_reconciler: Push with the reconciler instead of insert_to_woocommerce
+    :param prune: With use_reconciler on a full sync, delete what is not in Loyverse anymore
+    :param log_directory: Directory the output of the tenant is written to, as <name>.log. None keeps stdout
+    :param debug: Boolean to print stuff on console for debugging
+    """
+    if log_directory:
+        sys.stdout = sys.stderr = open(os.path.join(log_directory, '{}.log'.format(tenant.name)), 'a', buffering=1)
+    configure_tenant(tenant)
+    try:
+        if stock:
+            sync_stock(workers=tenant.workers, debug=debug)
+            return
+        full = extract_loyverse_data(resume=resume, incremental=incremental, debug=debug)
+        if use_reconciler:
+            reconcile(only_changed=not full, prune=prune, rebuild_index=rebuild_index, workers=tenant.workers,
+                      debug=debug)
+        else:
+            insert_to_woocommerce(workers=tenant.workers, only_changed=not full, rebuild_index=rebuild_index,
+                                  resume=resume, debug=debug)
+    finally:
+        write_textfile('{}_{}'.format('stock' if stock else 'sync', tenant.name))
+
+
+def run_tenants(tenants, processes=None, debug=False, **options):
+    """
+    Function to sync every tenant, each in a process of its own.
+    Processes are spawned rather than forked, so none of them inherits connections or threads of this one. A tenant
+    that fails doesn't stop the others.
+
+    :param tenants: List of Tenant records, e.g. from load_tenants
+    :param processes: Maximum number of tenants synced at the same time. None syncs all of them at once
+    :param debug: Boolean to print stuff on console for debugging
+    :param options: Options of run_tenant (incremental, resume, stock, ...)
+    :return: dict of tenant name -> exit code of its process. 0 when the sync succeeded
+    """
+    context = multiprocessing.get_context('spawn')
+    pending = list(tenants)
+    running = dict()
+    exit_codes = dict()
+    while pending or running:
+        while pending and len(running) < (processes or len(tenants)):
+            tenant = pending.pop(0)
+            process = context.Process(target=run_tenant, args=(tenant,), kwargs=dict(options, debug=debug),
+                                      name='tenant-{}'.format(tenant.name))
+            process.start()
+            running[process.sentinel] = (tenant, process)
+            if debug:
+                print('Started tenant {} (pid {})'.format(tenant.name, process.pid))
+
+        for sentinel in wait(list(running)):
+            tenant, process = running.pop(sentinel)
+            process.join()
+            exit_codes[tenant.name] = process.exitcode
+            if debug:
+                print('Tenant {} finished with exit code {}'.format(tenant.name, process.exitcode))
+
+    return exit_codes
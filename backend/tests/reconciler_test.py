@@ -0,0 +1,244 @@
+"""
+Tests of the reconciler planner. Redis is faked with fakeredis and the index of WooCommerce ids is seeded by hand, so
+no request is sent to WooCommerce.
+
+Run from the repository root:
+    python -m pytest backend/tests/reconciler_test.py
+"""
+import pytest
+
+from backend.reconciler import Plan, plan_single_products, plan_variable_products, plan_deletes, plan_prune, \
+    get_product_slug
+from backend.utils import PRODUCT_FINGERPRINTS_KEY, VARIANT_FINGERPRINTS_KEY, WOOCOMMERCE_BATCH_SIZE
+from backend.utils import redis as redis_utils
+from backend.utils.fingerprint import fingerprint, save_fingerprints
+from backend.utils.wc_index import index_products
+from backend.wcapi_inserter import determine_product_types, get_variable_product_record
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    monkeypatch.setattr(redis_utils, '_connection_pool', fakeredis.FakeRedis().connection_pool)
+
+
+def variant(handle, sku, option_value=None, price=10):
+    """
+    :return: staged variant dict. Variants with an option value are part of a variable product
+    """
+    return {'handle': handle, 'SKU': sku, 'name': handle.title(), 'category_name': 'Clothes', 'category_color': None,
+            'option_1_name': 'Size' if option_value else None, 'option_1_value': option_value, 'price': price,
+            'image_url': None}
+
+
+def index_product(handle, product_id, sku=None):
+    index_products([{'id': product_id, 'slug': get_product_slug(handle), 'sku': sku}])
+
+
+def index_variations(parent_id, variations):
+    """
+    :param variations: Dict of SKU -> variation id
+    """
+    index_products([{'id': variation_id, 'sku': sku} for sku, variation_id in variations.items()], parent_id=parent_id)
+
+
+def make_plan(variants, only_changed=False):
+    plan = Plan(only_changed)
+    plan.single_products, plan.variable_products = determine_product_types(variants)
+    return plan
+
+
+def summarize(plan, action=None, kind=None):
+    """
+    :return: sorted list of (action, kind, key, wc_id, parent) of the planned operations
+    """
+    return sorted((operation.action, operation.kind, operation.key, operation.wc_id, operation.parent)
+                  for operation in plan.get_operations(action, kind))
+
+
+def test_new_products_are_created():
+    plan = make_plan([variant('mug', 'S1'), variant('tee', 'S2', 'S'), variant('tee', 'S3', 'M')])
+    plan_single_products(plan)
+    plan_variable_products(plan)
+
+    assert summarize(plan) == [('create', 'product', 'mug', None, None), ('create', 'product', 'tee', None, None),
+                               ('create', 'variation', 'S2', None, 'tee'), ('create', 'variation', 'S3', None, 'tee')]
+
+
+def test_unchanged_products_are_kept():
+    plan = make_plan([variant('mug', 'S1'), variant('tee', 'S2', 'S'), variant('tee', 'S3', 'M')])
+    index_product('mug', 10, 'S1')
+    index_product('tee', 20)
+    index_variations(20, {'S2': 21, 'S3': 22})
+    tee = plan.variable_products['tee']
+    save_fingerprints(PRODUCT_FINGERPRINTS_KEY, {
+        'mug': {'hash': fingerprint(plan.single_products['mug']), 'wc_id': 10},
+        'tee': {'hash': fingerprint(get_variable_product_record(tee)), 'wc_id': 20},
+    })
+    save_fingerprints(VARIANT_FINGERPRINTS_KEY, {
+        variant_record['SKU']: {'hash': fingerprint(variant_record), 'wc_id': variation_id, 'parent_id': 20}
+        for variant_record, variation_id in zip(tee['variants'], (21, 22))
+    })
+
+    plan_single_products(plan)
+    plan_variable_products(plan)
+
+    assert plan.is_empty()
+    assert plan.unchanged == {'product': 2, 'variation': 2}
+    assert plan.single_products['mug']['wc_id'] == 10
+    assert [variant_record['wc_id'] for variant_record in tee['variants']] == [21, 22]
+
+
+def test_changed_product_is_updated():
+    plan = make_plan([variant('mug', 'S1', price=12)])
+    index_product('mug', 10, 'S1')
+    save_fingerprints(PRODUCT_FINGERPRINTS_KEY, {'mug': {'hash': fingerprint(variant('mug', 'S1')), 'wc_id': 10}})
+
+    plan_single_products(plan)
+
+    assert summarize(plan) == [('update', 'product', 'mug', 10, None)]
+
+
+def test_single_product_becoming_variable():
+    # 'tee' was a single product holding S1, it now has two variants
+    plan = make_plan([variant('tee', 'S1', 'S'), variant('tee', 'S2', 'M')])
+    index_product('tee', 10, 'S1')
+
+    plan_variable_products(plan)
+
+    # The single product is deleted once, even though both its slug and its SKU point to it, and created as variable
+    assert summarize(plan) == [('create', 'product', 'tee', None, None), ('create', 'variation', 'S1', None, 'tee'),
+                               ('create', 'variation', 'S2', None, 'tee'), ('delete', 'product', 'tee', 10, None)]
+
+
+def test_variable_product_becoming_single():
+    # 'cap' was a variable product with variations S1 and S2, only S1 is left
+    plan = make_plan([variant('cap', 'S1')])
+    index_product('cap', 20)
+    index_variations(20, {'S1': 21, 'S2': 22})
+
+    plan_single_products(plan)
+
+    # The variation holding the SKU is deleted so the product can take it over
+    assert summarize(plan) == [('delete', 'variation', 'S1', 21, 20), ('update', 'product', 'cap', 20, None)]
+
+    # The variation left behind is only deleted when pruning
+    plan_prune(plan)
+    assert summarize(plan, 'delete', 'variation') == [('delete', 'variation', 'S1', 21, 20),
+                                                      ('delete', 'variation', 'S2', 22, 20)]
+
+
+def test_single_product_whose_sku_is_held_by_another_product():
+    plan = make_plan([variant('mug', 'S1')])
+    index_product('mug', 10)
+    index_product('old-mug', 11, 'S1')
+
+    plan_single_products(plan)
+
+    assert summarize(plan) == [('delete', 'product', 'S1', 11, None), ('update', 'product', 'mug', 10, None)]
+
+
+def test_variation_moved_to_another_product():
+    # S2 was a variation of 'shirt' and now belongs to 'tee'
+    plan = make_plan([variant('tee', 'S1', 'S'), variant('tee', 'S2', 'M')])
+    index_product('shirt', 30)
+    index_variations(30, {'S2': 31, 'S3': 32})
+    index_product('tee', 40)
+    index_variations(40, {'S1': 41})
+
+    plan_variable_products(plan)
+
+    assert summarize(plan, 'delete') == [('delete', 'variation', 'S2', 31, 30)]
+    assert summarize(plan, 'create', 'variation') == [('create', 'variation', 'S2', None, 'tee')]
+    assert summarize(plan, 'update', 'variation') == [('update', 'variation', 'S1', 41, 'tee')]
+
+
+def test_variation_held_by_a_single_product():
+    # S2 was a single product of its own and is now a variant of 'tee'
+    plan = make_plan([variant('tee', 'S1', 'S'), variant('tee', 'S2', 'M')])
+    index_product('tee', 40)
+    index_variations(40, {'S1': 41})
+    index_product('old-single', 50, 'S2')
+
+    plan_variable_products(plan)
+
+    assert summarize(plan, 'delete') == [('delete', 'product', 'S2', 50, None)]
+    assert summarize(plan, 'create', 'variation') == [('create', 'variation', 'S2', None, 'tee')]
+
+
+def test_deletes_skip_what_is_staged_again():
+    plan = make_plan([variant('mug', 'S1')], only_changed=True)
+    plan.deleted_skus = ['S1', 'S2', 'S3']
+    plan.deleted_handles = ['mug', 'tee']
+    index_product('mug', 10, 'S1')
+    index_product('cup', 11, 'S2')
+    index_product('tee', 20)
+    index_variations(20, {'S3': 21})
+
+    plan_deletes(plan)
+
+    assert summarize(plan) == [('delete', 'product', 'S2', 11, None), ('delete', 'product', 'tee', 20, None),
+                               ('delete', 'variation', 'S3', 21, 20)]
+
+
+def test_repeated_deletes_are_planned_once():
+    plan = Plan()
+    assert plan.add('delete', 'product', 'tee', wc_id=10) is not None
+    assert plan.add('delete', 'product', 'S1', wc_id=10) is None
+    assert plan.add('delete', 'variation', 'S1', wc_id=10, parent=20) is not None
+    assert len(plan.get_operations('delete')) == 2
+
+
+def test_prune_keeps_staged_and_foreign_products():
+    plan = make_plan([variant('mug', 'S1')])
+    index_product('mug', 10, 'S1')
+    index_product('gone', 11, 'S9')
+    index_products([{'id': 12, 'slug': 'added-in-the-admin', 'sku': 'X1'}])
+
+    plan_single_products(plan)
+    plan_prune(plan)
+
+    assert summarize(plan, 'delete') == [('delete', 'product', 'gone', 11, None)]
+
+
+def test_count_requests_batches_by_size():
+    plan = Plan()
+    for number in range(WOOCOMMERCE_BATCH_SIZE * 2 + 1):
+        plan.add('create', 'product', 'product-{}'.format(number))
+    for number in range(WOOCOMMERCE_BATCH_SIZE + 1):
+        plan.add('create', 'variation', 'a-{}'.format(number), parent='a')
+    plan.add('update', 'variation', 'b-0', wc_id=1, parent='b')
+    plan.add('create', 'category', 'wcapi_cat_clothes', record='Clothes')
+    plan.add('create', 'attribute_term', ('Size', 'wcapi_term_s'), record='S')
+    plan.add('create', 'attribute_term', ('Color', 'wcapi_term_red'), record='Red')
+
+    requests = plan.count_requests()
+
+    assert requests['products'] == 3
+    # One batch endpoint per parent product
+    assert requests['variations'] == 3
+    # Categories, and the terms of every attribute, are separate endpoints
+    assert requests['taxonomy'] == 3
+    assert requests['delete'] == 0
+
+
+def test_count_requests_of_deletes():
+    plan = Plan()
+    for number in range(WOOCOMMERCE_BATCH_SIZE + 1):
+        plan.add('delete', 'product', 'product-{}'.format(number), wc_id=number + 1)
+    # Deleted with their product, no request of their own
+    plan.add('delete', 'variation', 'S1', wc_id=1001, parent=1)
+    plan.add('delete', 'variation', 'S2', wc_id=1002, parent=5000)
+    plan.add('delete', 'variation', 'S3', wc_id=1003, parent=6000)
+
+    requests = plan.count_requests()
+
+    assert requests['delete'] == 2 + 2
+    assert sum(requests.values()) == 4
+    assert 'Requests: delete 4' in plan.describe()
+
+
+def test_count_requests_of_an_empty_plan():
+    plan = Plan()
+    assert sum(plan.count_requests().values()) == 0
+    assert plan.describe() == 'Plan: 0 operations in 0 requests\nRequests: none'
@@ -8,3 +8,15 @@ def get_milli_time():
     :return: time in milliseconds
     """
     return time.time() * 1000
+
+
+def chunk_list(items, size):
+    """
+    Function to split a list into consecutive chunks
+
+    :param items: list to split
+    :param size: maximum length of each chunk
+    :return: generator of lists with at most `size` elements
+    """
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
@@ -0,0 +1,166 @@
+"""
+Helpers to run API calls concurrently without overloading the remote host
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Tokens are refilled at `rate` per second up to `capacity`, and every request takes one.
+    Safe to share between threads.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Tokens added per second. None or 0 disables the limiter
+        :param capacity: Maximum number of tokens, i.e. how many requests can burst at once
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Function to take a token, blocking until one is available.
+        """
+        if not self.rate:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    """
+    Wrapper around a WooCommerce API client that makes every request wait for the rate limiter of its host and caps
+    the number of requests in flight at the same time.
+    """
+
+    def __init__(self, client, limiter, max_in_flight):
+        """
+        :param client: Client with get/post/put/delete/options methods (woocommerce.API)
+        :param limiter: TokenBucket shared by every client of the same host
+        :param max_in_flight: Maximum number of concurrent requests through this client
+        """
+        self.client = client
+        self.limiter = limiter
+        self.slots = threading.BoundedSemaphore(max(max_in_flight, 1))
+
+    def _request(self, method, *args, **kwargs):
+        with self.slots:
+            self.limiter.acquire()
+            return getattr(self.client, method)(*args, **kwargs)
+
+    def get(self, endpoint, **kwargs):
+        return self._request('get', endpoint, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        return self._request('post', endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        return self._request('put', endpoint, data, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self._request('delete', endpoint, **kwargs)
+
+    def options(self, endpoint, **kwargs):
+        return self._request('options', endpoint, **kwargs)
+
+
+# One limiter per host, so all clients talking to the same shop share the budget
+_host_limiters = dict()
+_host_limiters_lock = threading.Lock()
+
+
+def get_host_limiter(url, rate, capacity):
+    """
+    Function to get the token bucket of a host, creating it the first time the host is seen.
+
+    :param url: Any url of the host
+    :param rate: Requests per second allowed for the host
+    :param capacity: Burst size for the host
+    :return: TokenBucket object
+    """
+    host = urlparse(url).netloc or url
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None or limiter.rate != rate or limiter.capacity != max(capacity, 1):
+            limiter = TokenBucket(rate, capacity)
+            _host_limiters[host] = limiter
+    return limiter
+
+
+def run_in_pool(function, items, workers=1):
+    """
+    Function to call `function` on every item using a pool of worker threads.
+    With a single worker the items are processed in order on the current thread.
+
+    :param function: Function that takes one item
+    :param items: Iterable of items
+    :param workers: Number of worker threads
+    :return: list of results in the same order as the items
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def prefetch(iterable, size=1):
+    """
+    Function to consume an iterable on a background thread, keeping up to `size` items ready ahead of the caller.
+    Used to download the next pages of an API while the current page is being processed.
+    Exceptions raised by the iterable are re-raised in the caller.
+
+    :param iterable: Iterable to consume (usually a generator of pages)
+    :param size: Number of items to buffer ahead
+    :return: generator yielding the items of the iterable in order
+    """
+    buffer = queue.Queue(maxsize=max(size, 1))
+    finished = object()
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for item in iterable:
+                # Keep checking whether the consumer went away so the thread doesn't block forever
+                while not stop.is_set():
+                    try:
+                        buffer.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put((finished, None))
+        except BaseException as error:
+            buffer.put((finished, error))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,161 @@
+"""
+Bookkeeping for incremental (delta) syncs: the last-sync watermark and the SKUs changed or deleted since the last push
+"""
+import json
+from datetime import datetime, timezone
+
+from backend.utils import (PROCESSED_DATA_PREFIX, SYNC_WATERMARK_KEY, CHANGED_SKUS_KEY, DELETED_SKUS_KEY,
+                           DELETED_HANDLES_KEY, HANDLE_SKUS_KEY)
+from backend.utils.redis import get_redis_connection, get_items, get_items_field
+
+
+def get_timestamp():
+    """
+    Function to get the current time in the ISO 8601 format used by Loyverse (e.g. 2020-03-30T08:05:10.020Z)
+
+    :return: timestamp string
+    """
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def get_watermark():
+    """
+    Function to get the time the last successful extraction started.
+
+    :return: timestamp string or None if there was no sync yet
+    """
+    value = get_redis_connection().get(SYNC_WATERMARK_KEY)
+    if value is None:
+        return None
+    return value.decode()
+
+
+def set_watermark(timestamp):
+    """
+    Function to save the time the current extraction started, once it completed.
+
+    :param timestamp: timestamp string from get_timestamp
+    """
+    get_redis_connection().set(SYNC_WATERMARK_KEY, timestamp)
+
+
+def record_handle_skus(variants, full=False):
+    """
+    Function to save which SKUs belong to every handle and mark them as changed.
+    SKUs that belonged to a handle before but are not part of it anymore are removed from staging and marked as
+    deleted. SKUs and handles marked as deleted before are not anymore.
+
+    :param variants: List of de-normalized variants of the items that changed (all variants of each item)
+    :param full: Whether this is a full extraction. Full extractions don't mark SKUs as changed since everything is
+                pushed anyway
+    :return: list of SKUs that were removed
+    """
+    handle_skus = dict()
+    for variant in variants:
+        handle_skus.setdefault(variant['handle'], list()).append(variant['SKU'])
+    if not handle_skus:
+        return list()
+
+    recon = get_redis_connection()
+    handles = list(handle_skus)
+    previous_skus = recon.hmget(HANDLE_SKUS_KEY, handles)
+
+    removed_skus = list()
+    for handle, previous in zip(handles, previous_skus):
+        if previous:
+            current = set(handle_skus[handle])
+            removed_skus.extend(sku for sku in json.loads(previous) if sku not in current)
+
+    pipeline = recon.pipeline(transaction=False)
+    pipeline.hset(HANDLE_SKUS_KEY, mapping={handle: json.dumps(handle_skus[handle]) for handle in handles})
+    if not full:
+        pipeline.sadd(CHANGED_SKUS_KEY, *[sku for handle in handles for sku in handle_skus[handle]])
+    if removed_skus:
+        pipeline.delete(*['{}{}'.format(PROCESSED_DATA_PREFIX, sku) for sku in removed_skus])
+        pipeline.sadd(DELETED_SKUS_KEY, *removed_skus)
+        pipeline.srem(CHANGED_SKUS_KEY, *removed_skus)
+    # Deletions survive full extractions, so SKUs and handles staged again (restored items, SKUs moved to another
+    # item) must not be deleted by the next push of changes
+    pipeline.srem(DELETED_SKUS_KEY, *[sku for handle in handles for sku in handle_skus[handle]])
+    pipeline.srem(DELETED_HANDLES_KEY, *handles)
+    pipeline.execute()
+
+    return removed_skus
+
+
+def record_deleted_handles(handles):
+    """
+    Function to remove every SKU of deleted items from staging and mark them (and their handles) as deleted.
+
+    :param handles: List of handles of the items deleted in Loyverse
+    :return: list of SKUs that were removed
+    """
+    if not handles:
+        return list()
+
+    recon = get_redis_connection()
+    previous_skus = recon.hmget(HANDLE_SKUS_KEY, handles)
+    removed_skus = [sku for previous in previous_skus if previous for sku in json.loads(previous)]
+
+    pipeline = recon.pipeline(transaction=False)
+    pipeline.hdel(HANDLE_SKUS_KEY, *handles)
+    pipeline.sadd(DELETED_HANDLES_KEY, *handles)
+    if removed_skus:
+        pipeline.delete(*['{}{}'.format(PROCESSED_DATA_PREFIX, sku) for sku in removed_skus])
+        pipeline.sadd(DELETED_SKUS_KEY, *removed_skus)
+        pipeline.srem(CHANGED_SKUS_KEY, *removed_skus)
+    pipeline.execute()
+
+    return removed_skus
+
+
+def get_changed_products():
+    """
+    Function to get the staged products affected by the changes since the last push.
+    Every variant of a changed handle is returned, since a variable product needs all of its variants.
+
+    :return: tuple with the list of changed SKUs and the list of staged product dicts to push
+    """
+    recon = get_redis_connection()
+    changed_skus = sorted(member.decode() for member in recon.smembers(CHANGED_SKUS_KEY))
+    if not changed_skus:
+        return changed_skus, list()
+
+    handles = sorted(set(get_items_field(changed_skus, '$.handle', prefix=PROCESSED_DATA_PREFIX).values()))
+    if not handles:
+        return changed_skus, list()
+
+    skus = [sku for handle_skus in recon.hmget(HANDLE_SKUS_KEY, handles) if handle_skus
+            for sku in json.loads(handle_skus)]
+    return changed_skus, get_items(skus, prefix=PROCESSED_DATA_PREFIX)
+
+
+def get_deleted():
+    """
+    Function to get the SKUs and handles deleted since the last push.
+
+    :return: tuple with the list of deleted SKUs and the list of deleted handles
+    """
+    recon = get_redis_connection()
+    deleted_skus = sorted(member.decode() for member in recon.smembers(DELETED_SKUS_KEY))
+    deleted_handles = sorted(member.decode() for member in recon.smembers(DELETED_HANDLES_KEY))
+    return deleted_skus, deleted_handles
+
+
+def clear_changes(changed_skus=None, deleted_skus=None, deleted_handles=None):
+    """
+    Function to remove pushed changes from the pending sets.
+    Only the given members are removed, so changes recorded while the push was running are kept for the next one.
+
+    :param changed_skus: SKUs that were pushed
+    :param deleted_skus: SKUs that were deleted in WooCommerce
+    :param deleted_handles: Handles whose products were deleted in WooCommerce
+    """
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    if changed_skus:
+        pipeline.srem(CHANGED_SKUS_KEY, *changed_skus)
+    if deleted_skus:
+        pipeline.srem(DELETED_SKUS_KEY, *deleted_skus)
+    if deleted_handles:
+        pipeline.srem(DELETED_HANDLES_KEY, *deleted_handles)
+    pipeline.execute()
@@ -0,0 +1,91 @@
+"""
+Content-hash store used to skip products that didn't change since they were last pushed to WooCommerce
+"""
+import hashlib
+import json
+
+from backend.utils import REDIS_SCAN_COUNT
+from backend.utils.redis import get_redis_connection
+
+# Keys added to records by the inserter. They are not part of the content
+IGNORED_FIELDS = ('wc_id',)
+
+
+def fingerprint(record):
+    """
+    Function to compute a stable hash of a record. Key order doesn't matter.
+
+    :param record: dict to hash
+    :return: hex digest string
+    """
+    content = {key: record[key] for key in record if key not in IGNORED_FIELDS}
+    serialized = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(serialized.encode()).hexdigest()
+
+
+def get_fingerprints(store_key, records):
+    """
+    Function to compute the fingerprint of every record and get what was saved for it after the last push.
+
+    :param store_key: Redis hash holding the fingerprints, e.g. PRODUCT_FINGERPRINTS_KEY
+    :param records: Dict of key (handle, SKU) -> record
+    :return: dict of key -> tuple with the new hash and the saved dict ('hash', 'wc_id', ...) or None if the record was
+                never pushed
+    """
+    keys = list(records)
+    if not keys:
+        return dict()
+
+    saved_values = get_redis_connection().hmget(store_key, keys)
+    fingerprints = dict()
+    for key, saved in zip(keys, saved_values):
+        fingerprints[key] = (fingerprint(records[key]), json.loads(saved) if saved else None)
+    return fingerprints
+
+
+def is_unchanged(new_hash, saved):
+    """
+    :param new_hash: Hash of the current record
+    :param saved: Saved dict from get_fingerprints
+    :return: True if the record was pushed before and didn't change since
+    """
+    return saved is not None and saved.get('wc_id') and saved['hash'] == new_hash
+
+
+def save_fingerprints(store_key, entries):
+    """
+    Function to save fingerprints of records that were pushed successfully.
+
+    :param store_key: Redis hash holding the fingerprints
+    :param entries: Dict of key -> dict with at least 'hash' and 'wc_id'
+    """
+    if entries:
+        get_redis_connection().hset(store_key, mapping={key: json.dumps(entries[key]) for key in entries})
+
+
+def delete_fingerprints(store_key, keys):
+    """
+    Function to forget the fingerprints of records deleted from WooCommerce.
+
+    :param store_key: Redis hash holding the fingerprints
+    :param keys: List of keys to delete
+    """
+    if keys:
+        get_redis_connection().hdel(store_key, *keys)
+
+
+def forget_missing(store_key, wc_ids):
+    """
+    Function to forget the fingerprints of records whose WooCommerce object doesn't exist anymore, e.g. deleted in the
+    WooCommerce admin, so they are pushed again instead of being skipped as unchanged.
+
+    :param store_key: Redis hash holding the fingerprints
+    :param wc_ids: Set of the ids of every product and variation in WooCommerce
+    :return: number of fingerprints forgotten
+    """
+    connection = get_redis_connection()
+    missing = [key for key, value in connection.hscan_iter(store_key, count=REDIS_SCAN_COUNT)
+               if json.loads(value).get('wc_id') not in wc_ids]
+    if missing:
+        connection.hdel(store_key, *missing)
+    return len(missing)
@@ -0,0 +1,196 @@
+"""
+Factory of the HTTP clients used by the drivers: pooled keep-alive connections, gzip and separate connect and read
+timeouts.
+
+A requests.Session is not meant to be shared between threads, so PooledAPI gives every thread its own session. All of
+them are mounted on the same HTTPAdapter, whose urllib3 pool is thread-safe, so connections are still reused across
+threads and capped at the pool size.
+"""
+import threading
+import time
+from json import dumps as jsonencode
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from woocommerce import API
+from woocommerce.oauth import OAuth
+
+from backend.utils import (WOOCOMMERCE_POOL_SIZE, WOOCOMMERCE_CONNECT_TIMEOUT, WOOCOMMERCE_READ_TIMEOUT, HTTP_GZIP,
+                           LOYVERSE_POOL_SIZE, LOYVERSE_CONNECT_TIMEOUT, LOYVERSE_READ_TIMEOUT)
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session mounted on a shared HTTPAdapter, with default timeouts for every request.
+    """
+
+    def __init__(self, adapter, timeout=None, gzip=HTTP_GZIP):
+        """
+        :param adapter: HTTPAdapter holding the connection pool
+        :param timeout: Default (connect, read) timeout tuple in seconds, used when a request doesn't set one
+        :param gzip: Ask for gzip compressed responses
+        """
+        super().__init__()
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_adapter(pool_size):
+    """
+    :param pool_size: Maximum number of keep-alive connections kept open per host
+    :return: HTTPAdapter to mount on sessions
+    """
+    return HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+
+def create_session(headers=None, pool_size=LOYVERSE_POOL_SIZE, connect_timeout=LOYVERSE_CONNECT_TIMEOUT,
+                   read_timeout=LOYVERSE_READ_TIMEOUT, gzip=HTTP_GZIP):
+    """
+    Function to create a pooled session, e.g. for the Loyverse API.
+
+    :param headers: Dict of headers sent with every request
+    :param pool_size: Maximum number of keep-alive connections kept open per host
+    :param connect_timeout: Seconds to wait for a connection
+    :param read_timeout: Seconds to wait for the server to answer
+    :param gzip: Ask for gzip compressed responses
+    :return: PooledSession object
+    """
+    session = PooledSession(create_adapter(pool_size), (connect_timeout, read_timeout), gzip)
+    session.headers.update(headers or {})
+    return session
+
+
+class PooledAPI(API):
+    """
+    woocommerce.API client sending its requests through pooled keep-alive connections instead of a new connection for
+    every call. Safe to share between threads.
+    Requests are built from the public attributes of woocommerce.API (url, version, wp_api, keys, ...) and its OAuth
+    class, not from its private methods, so the client keeps working if those are renamed.
+    """
+
+    def __init__(self, url, consumer_key, consumer_secret, pool_size=WOOCOMMERCE_POOL_SIZE,
+                 connect_timeout=WOOCOMMERCE_CONNECT_TIMEOUT, read_timeout=WOOCOMMERCE_READ_TIMEOUT, gzip=HTTP_GZIP,
+                 **kwargs):
+        """
+        :param url: Url of the shop
+        :param consumer_key: WooCommerce REST API consumer key
+        :param consumer_secret: WooCommerce REST API consumer secret
+        :param pool_size: Maximum number of keep-alive connections kept open to the shop
+        :param connect_timeout: Seconds to wait for a connection
+        :param read_timeout: Seconds to wait for the shop to answer
+        :param gzip: Ask for gzip compressed responses
+        :param kwargs: Any other option of woocommerce.API (version, wp_api, verify_ssl, query_string_auth, ...)
+        """
+        kwargs['timeout'] = (connect_timeout, read_timeout)
+        super().__init__(url, consumer_key, consumer_secret, **kwargs)
+        self.pool_size = pool_size
+        self.gzip = gzip
+        self.adapter = create_adapter(pool_size)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """
+        :return: PooledSession of the current thread
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = PooledSession(self.adapter, self.timeout, self.gzip)
+            self._local.session = session
+        return session
+
+    def get_url(self, endpoint):
+        """
+        :param endpoint: Endpoint of the REST API, e.g. 'products'
+        :return: url of the endpoint
+        """
+        return '{}/{}/{}/{}'.format(self.url.rstrip('/'), 'wp-json' if self.wp_api else 'wc-api', self.version,
+                                    endpoint)
+
+    def _request(self, method, endpoint, data, params=None, **kwargs):
+        # Same request as woocommerce.API, sent through the session of the thread
+        if params is None:
+            params = {}
+        url = self.get_url(endpoint)
+        auth = None
+        headers = {
+            'user-agent': self.user_agent,
+            'accept': 'application/json'
+        }
+
+        is_ssl = self.url.startswith('https')
+        if is_ssl and self.query_string_auth is False:
+            auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+        elif is_ssl and self.query_string_auth is True:
+            params.update({
+                'consumer_key': self.consumer_key,
+                'consumer_secret': self.consumer_secret
+            })
+        else:
+            url = '{}?{}'.format(url, urlencode(params))
+            url = OAuth(url=url, consumer_key=self.consumer_key, consumer_secret=self.consumer_secret,
+                        version=self.version, method=method,
+                        oauth_timestamp=kwargs.get('oauth_timestamp', int(time.time()))).get_oauth_url()
+            # The query string is already in the signed url
+            params = {}
+        kwargs.pop('oauth_timestamp', None)
+
+        if data is not None:
+            data = jsonencode(data, ensure_ascii=False).encode('utf-8')
+            headers['content-type'] = 'application/json;charset=utf-8'
+
+        return self.session.request(method=method, url=url, verify=self.verify_ssl, auth=auth, params=params,
+                                    data=data, timeout=self.timeout, headers=headers, **kwargs)
+
+    def get(self, endpoint, **kwargs):
+        return self._request('GET', endpoint, None, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        return self._request('POST', endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        return self._request('PUT', endpoint, data, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self._request('DELETE', endpoint, None, **kwargs)
+
+    def options(self, endpoint, **kwargs):
+        return self._request('OPTIONS', endpoint, None, **kwargs)
+
+
+def create_wcapi_client(url, consumer_key, consumer_secret, **options):
+    """
+    Function to create a pooled WooCommerce API client.
+
+    :param url: Url of the shop
+    :param consumer_key: WooCommerce REST API consumer key
+    :param consumer_secret: WooCommerce REST API consumer secret
+    :param options: Options of PooledAPI (pool_size, connect_timeout, read_timeout, gzip) and of woocommerce.API
+    :return: PooledAPI object
+    """
+    return PooledAPI(url, consumer_key, consumer_secret, **options)
+
+
+def create_wcapi_client_from(api, **options):
+    """
+    Function to create a pooled client with the credentials and settings of a woocommerce.API object, like the ones
+    in auth.py. Its timeout is replaced by the connect and read timeouts.
+
+    :param api: woocommerce.API object
+    :param options: Options of PooledAPI overriding the defaults
+    :return: PooledAPI object
+    """
+    if isinstance(api, PooledAPI) and not options:
+        return api
+    settings = dict(version=api.version, wp_api=api.wp_api, verify_ssl=api.verify_ssl,
+                    query_string_auth=api.query_string_auth, user_agent=api.user_agent)
+    settings.update(options)
+    return create_wcapi_client(api.url, api.consumer_key, api.consumer_secret, **settings)
@@ -0,0 +1,116 @@
+"""
+Registry of the images already in the WooCommerce media library, so they are downloaded and processed only once.
+
+WooCommerce downloads every image `src` it receives into a new media item, which is the slowest part of creating a
+product. The registry maps each Loyverse image url to the id of its media item (IMAGE_REGISTRY_KEY), and products
+reference {'id': media_id} instead. The same url used by a product and its variations is downloaded once.
+
+Loyverse serves new content behind a new url, so the url is enough to detect changes. With IMAGE_CHECK_CONTENT the
+ETag of the url is also saved, and an image whose ETag changed is sent again by `src`.
+"""
+import functools
+import json
+
+import requests
+
+from backend.utils import IMAGE_REGISTRY_KEY, IMAGE_SRC_SUFFIX, IMAGE_CHECK_CONTENT, IMAGE_CHECK_TIMEOUT
+from backend.utils.redis import get_redis_connection
+
+
+def get_image_src(image_url):
+    """
+    :param image_url: Loyverse image url
+    :return: url WooCommerce downloads the image from
+    """
+    # WE NEED TO FORCE A FILETYPE IN THE IMAGE URL OR WOOCOMMERCE WON'T ACCEPT IT
+    return '{}{}'.format(image_url, IMAGE_SRC_SUFFIX)
+
+
+def get_image_url(image_src):
+    """
+    :param image_src: url sent to WooCommerce, from get_image_src
+    :return: Loyverse image url
+    """
+    if image_src.endswith(IMAGE_SRC_SUFFIX):
+        return image_src[:-len(IMAGE_SRC_SUFFIX)]
+    return image_src
+
+
+@functools.lru_cache(maxsize=None)
+def get_content_hash(image_url):
+    """
+    Function to get the ETag of an image with a HEAD request. Memoized, so each url is checked once per process.
+
+    :param image_url: Loyverse image url
+    :return: ETag of the image, None if IMAGE_CHECK_CONTENT is off or the server didn't send one
+    """
+    if not IMAGE_CHECK_CONTENT:
+        return None
+    try:
+        response = requests.head(image_url, allow_redirects=True, timeout=IMAGE_CHECK_TIMEOUT)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return response.headers.get('ETag')
+
+
+def lookup_image(image_url):
+    """
+    :param image_url: Loyverse image url
+    :return: WooCommerce media id of the image or None if it isn't registered or its content changed
+    """
+    value = get_redis_connection().hget(IMAGE_REGISTRY_KEY, image_url)
+    if value is None:
+        return None
+    entry = json.loads(value)
+    if entry.get('hash') != get_content_hash(image_url):
+        return None
+    return entry['id']
+
+
+def image_changed(image_url):
+    """
+    :param image_url: Loyverse image url that was already pushed
+    :return: True if the content behind the url changed since it was registered. Always False without
+                IMAGE_CHECK_CONTENT
+    """
+    if not IMAGE_CHECK_CONTENT:
+        return False
+    value = get_redis_connection().hget(IMAGE_REGISTRY_KEY, image_url)
+    return value is not None and json.loads(value).get('hash') != get_content_hash(image_url)
+
+
+def register_images(request_images, response_images):
+    """
+    Function to register the media ids WooCommerce gave to the images sent by `src`.
+    Images are matched by position, as WooCommerce returns them in the order they were sent.
+
+    :param request_images: List of image dicts sent to WooCommerce
+    :param response_images: List of image dicts in the WooCommerce response
+    """
+    entries = dict()
+    for sent, received in zip(request_images or [], response_images or []):
+        if sent.get('src') and received.get('id'):
+            image_url = get_image_url(sent['src'])
+            entries[image_url] = json.dumps({'id': received['id'], 'hash': get_content_hash(image_url)})
+    if entries:
+        get_redis_connection().hset(IMAGE_REGISTRY_KEY, mapping=entries)
+
+
+def forget_images(image_ids):
+    """
+    Function to remove media items that don't exist anymore (deleted from the media library), so their images are
+    sent by `src` again.
+
+    :param image_ids: List of WooCommerce media ids
+    """
+    image_ids = set(image_ids)
+    if not image_ids:
+        return
+
+    recon = get_redis_connection()
+    image_urls = [image_url for image_url, value in recon.hscan_iter(IMAGE_REGISTRY_KEY)
+                  if json.loads(value)['id'] in image_ids]
+    if image_urls:
+        recon.hdel(IMAGE_REGISTRY_KEY, *image_urls)
@@ -0,0 +1,155 @@
+"""
+Durable job queue on a redis stream with a consumer group.
+
+Jobs are acked once their handler succeeds. A job that fails (or whose worker dies) stays pending and is claimed again
+by any worker after JOB_RETRY_IDLE_MS. After JOB_MAX_ATTEMPTS deliveries it is moved to the dead-letter stream.
+"""
+import json
+import os
+import socket
+
+import redis
+
+from backend.utils import JOBS_STREAM_KEY, JOBS_DEAD_LETTER_KEY, JOBS_ERRORS_KEY, JOBS_GROUP, JOB_MAX_ATTEMPTS, \
+    JOB_RETRY_IDLE_MS, JOB_BLOCK_MS, REDIS_CHUNK_SIZE
+from backend.utils.delta import get_timestamp
+from backend.utils.redis import get_redis_connection
+
+
+class JobError(Exception):
+    """
+    Raised by job handlers when part of a job failed and the job should be retried.
+    """
+
+
+def get_consumer_name():
+    """
+    :return: name identifying this worker process in the consumer group
+    """
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def ensure_group():
+    """
+    Function to create the stream and its consumer group if they don't exist yet.
+    """
+    try:
+        get_redis_connection().xgroup_create(JOBS_STREAM_KEY, JOBS_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as error:
+        if 'BUSYGROUP' not in str(error):
+            raise
+
+
+def enqueue_jobs(jobs, chunk_size=REDIS_CHUNK_SIZE):
+    """
+    Function to add jobs to the queue.
+
+    :param jobs: List (or any iterable) of tuples with the job type and its json-serializable payload
+    :param chunk_size: Number of jobs to send per pipeline
+    :return: number of jobs added
+    """
+    ensure_group()
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    added = 0
+    for job_type, payload in jobs:
+        pipeline.xadd(JOBS_STREAM_KEY, {'type': job_type, 'payload': json.dumps(payload)})
+        added += 1
+        if added % chunk_size == 0:
+            pipeline.execute()
+    pipeline.execute()
+    return added
+
+
+def _decode_job(job_id, fields, attempts):
+    return {
+        'id': job_id.decode() if isinstance(job_id, bytes) else job_id,
+        'type': fields[b'type'].decode(),
+        'payload': json.loads(fields[b'payload']),
+        'attempts': attempts,
+    }
+
+
+def read_job(consumer, block_ms=JOB_BLOCK_MS):
+    """
+    Function to get the next job for a worker. Jobs left pending by failed or dead workers come first.
+    Jobs delivered JOB_MAX_ATTEMPTS times already are moved to the dead-letter stream instead of being returned.
+
+    :param consumer: Name of the worker in the consumer group
+    :param block_ms: Time to block waiting for a new job
+    :return: dict with the job 'id', 'type', 'payload' and 'attempts' (deliveries so far) or None if there is no job
+    """
+    recon = get_redis_connection()
+    while True:
+        claimed = recon.xautoclaim(JOBS_STREAM_KEY, JOBS_GROUP, consumer, JOB_RETRY_IDLE_MS, start_id='0-0', count=1)
+        messages = [message for message in claimed[1] if message[1]]
+        if not messages:
+            break
+
+        job_id, fields = messages[0]
+        pending = recon.xpending_range(JOBS_STREAM_KEY, JOBS_GROUP, min=job_id, max=job_id, count=1)
+        attempts = pending[0]['times_delivered'] if pending else 1
+        if attempts <= JOB_MAX_ATTEMPTS:
+            return _decode_job(job_id, fields, attempts)
+        dead_letter(_decode_job(job_id, fields, attempts))
+
+    messages = recon.xreadgroup(JOBS_GROUP, consumer, {JOBS_STREAM_KEY: '>'}, count=1, block=block_ms)
+    if not messages or not messages[0][1]:
+        return None
+    job_id, fields = messages[0][1][0]
+    return _decode_job(job_id, fields, 1)
+
+
+def ack_job(job):
+    """
+    Function to remove a job that completed from the queue.
+
+    :param job: Job dict from read_job
+    """
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    pipeline.xack(JOBS_STREAM_KEY, JOBS_GROUP, job['id'])
+    pipeline.xdel(JOBS_STREAM_KEY, job['id'])
+    pipeline.hdel(JOBS_ERRORS_KEY, job['id'])
+    pipeline.execute()
+
+
+def fail_job(job, error):
+    """
+    Function to record why a job failed. The job stays pending, so it is retried after JOB_RETRY_IDLE_MS.
+
+    :param job: Job dict from read_job
+    :param error: Exception raised by the handler
+    """
+    get_redis_connection().hset(JOBS_ERRORS_KEY, job['id'], '{}: {}'.format(type(error).__name__, error))
+
+
+def dead_letter(job):
+    """
+    Function to move a job that keeps failing to the dead-letter stream, with its last error.
+
+    :param job: Job dict from read_job
+    """
+    recon = get_redis_connection()
+    error = recon.hget(JOBS_ERRORS_KEY, job['id'])
+    recon.xadd(JOBS_DEAD_LETTER_KEY, {
+        'type': job['type'],
+        'payload': json.dumps(job['payload']),
+        'job_id': job['id'],
+        'attempts': job['attempts'],
+        'error': error or b'',
+        'failed_at': get_timestamp(),
+    })
+    ack_job(job)
+
+
+def get_queue_stats():
+    """
+    :return: dict with the number of 'queued' jobs (not acked yet), 'pending' jobs (delivered, not acked yet) and
+                'dead' jobs
+    """
+    ensure_group()
+    recon = get_redis_connection()
+    return {
+        'queued': recon.xlen(JOBS_STREAM_KEY),
+        'pending': recon.xpending(JOBS_STREAM_KEY, JOBS_GROUP)['pending'],
+        'dead': recon.xlen(JOBS_DEAD_LETTER_KEY),
+    }
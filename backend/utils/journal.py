@@ -0,0 +1,139 @@
+"""
+Write-ahead journal of a push to WooCommerce, keyed by run id. Every category, attribute, product and variation is
+recorded with its WooCommerce id as soon as it was created, so a push that died halfway can be resumed without
+sending the work it already did again.
+Each type of run (full push, push of the changes) keeps its own unfinished run, so frequent pushes of changes, e.g. by
+the webhook worker, never discard the journal of a full push that is waiting to be resumed
+"""
+import json
+import threading
+import uuid
+
+from backend.utils import JOURNAL_PREFIX, JOURNAL_RUN_KEY, JOURNAL_TTL, REDIS_SCAN_COUNT
+from backend.utils.redis import get_redis_connection, escape_pattern
+
+
+class RunJournal:
+    """
+    Journal of one push. Each kind of entity ('categories', 'products', ...) is a redis hash of key (name, handle,
+    SKU) -> json dict of what was recorded for it, at least its 'wc_id'.
+    Entries of a kind are read from redis once and cached, so lookups are local.
+    """
+
+    def __init__(self, run_id, run_type=None):
+        self.run_id = run_id
+        self.run_type = run_type
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get_key(self, kind):
+        """
+        :param kind: Kind of entity, e.g. 'products'
+        :return: redis key of the hash holding the entries of that kind
+        """
+        return '{}{}_{}'.format(JOURNAL_PREFIX, self.run_id, kind)
+
+    def get_entries(self, kind):
+        """
+        :param kind: Kind of entity
+        :return: dict of key -> recorded dict of every entity of that kind in the journal
+        """
+        with self._lock:
+            if kind not in self._entries:
+                values = get_redis_connection().hgetall(self.get_key(kind))
+                self._entries[kind] = {key.decode(): json.loads(value) for key, value in values.items()}
+            return self._entries[kind]
+
+    def get(self, kind, key, content_hash=None):
+        """
+        :param kind: Kind of entity
+        :param key: Key of the entity
+        :param content_hash: Hash of the entity now. An entry recorded for other content is ignored
+        :return: recorded dict of the entity or None if it isn't in the journal
+        """
+        entry = self.get_entries(kind).get(key)
+        if entry is None or (content_hash is not None and entry.get('hash') != content_hash):
+            return None
+        return entry
+
+    def record(self, kind, entries):
+        """
+        Function to record entities that were pushed successfully. They are written to redis before this returns.
+
+        :param kind: Kind of entity
+        :param entries: Dict of key -> dict with at least the 'wc_id' of the entity
+        """
+        if not entries:
+            return
+
+        key = self.get_key(kind)
+        pipeline = get_redis_connection().pipeline(transaction=False)
+        pipeline.hset(key, mapping={entry_key: json.dumps(entries[entry_key]) for entry_key in entries})
+        pipeline.expire(key, JOURNAL_TTL)
+        pipeline.execute()
+        with self._lock:
+            if kind in self._entries:
+                self._entries[kind].update(entries)
+
+    def count(self):
+        """
+        :return: dict of kind -> number of entities recorded in redis
+        """
+        connection = get_redis_connection()
+        prefix = self.get_key('')
+        counts = dict()
+        for key in connection.scan_iter(match='{}*'.format(escape_pattern(prefix)), count=REDIS_SCAN_COUNT):
+            counts[key.decode()[len(prefix):]] = connection.hlen(key)
+        return counts
+
+    def finish(self):
+        """
+        Function to remove the journal once the push completed.
+        """
+        connection = get_redis_connection()
+        keys = list(connection.scan_iter(match='{}*'.format(escape_pattern(self.get_key(''))),
+                                         count=REDIS_SCAN_COUNT))
+        if keys:
+            connection.unlink(*keys)
+        if self.run_type is not None and get_unfinished_run(self.run_type) == self.run_id:
+            connection.delete(get_run_key(self.run_type))
+        with self._lock:
+            self._entries = dict()
+
+
+def get_run_key(run_type):
+    """
+    :param run_type: Type of run, e.g. 'full' or 'changed'
+    :return: redis key holding the id of the unfinished run of that type
+    """
+    return '{}_{}'.format(JOURNAL_RUN_KEY, run_type)
+
+
+def get_unfinished_run(run_type):
+    """
+    :param run_type: Type of run, e.g. 'full' or 'changed'
+    :return: run id of the push of that type that started but didn't finish, or None
+    """
+    run_id = get_redis_connection().get(get_run_key(run_type))
+    return run_id.decode() if run_id is not None else None
+
+
+def start_run(run_type, resume=False):
+    """
+    Function to start the journal of a push. Unfinished runs of other types are left alone.
+
+    :param run_type: Type of run, e.g. 'full' or 'changed'
+    :param resume: Continue the journal of the push of this type that didn't finish, if there is one. Otherwise its
+                journal is discarded and a new run starts
+    :return: RunJournal of the run
+    """
+    run_id = get_unfinished_run(run_type)
+    if run_id is not None and resume:
+        get_redis_connection().expire(get_run_key(run_type), JOURNAL_TTL)
+        return RunJournal(run_id, run_type)
+
+    if run_id is not None:
+        RunJournal(run_id, run_type).finish()
+    journal = RunJournal(uuid.uuid4().hex, run_type)
+    get_redis_connection().set(get_run_key(run_type), journal.run_id, ex=JOURNAL_TTL)
+    return journal
@@ -1,15 +1,21 @@
+from backend.utils.records import Variant
+
+
 def extract_catids(all_items):
     """
     Function to extract category ids from a list of items
+    Ids already seen are tracked in a set, so this is linear in the number of items.
 
-    :param all_items: list of dicts containing item information
-    :return: list of categories
+    :param all_items: list (or any iterable) of dicts containing item information
+    :return: list of categories, in the order they first appear
     """
     category_ids = list()
+    seen = set()
     for item in all_items:
-        if 'category_id' in item:
-            if item['category_id'] not in category_ids and item['category_id']:
-                category_ids.append(item['category_id'])
+        category_id = item.get('category_id')
+        if category_id and category_id not in seen:
+            seen.add(category_id)
+            category_ids.append(category_id)
 
     return category_ids
 
@@ -29,6 +35,20 @@ def determine_cursor(response):
     return cursor
 
 
+def iter_merge_items_categories(items, categories):
+    """
+    Generator stage merging categories into dicts of items, one item at a time.
+
+    :param items: iterable of dicts containing item information
+    :param categories: dict of dicts or Category records containing category information, with their id as key
+    :return: generator yielding dicts containing item information including their categories
+    """
+    for item in items:
+        if item['category_id']:
+            item['category'] = categories[item['category_id']]
+        yield item
+
+
 def merge_items_categories(items, categories, debug=False):
     """
     Function to merge categories into dicts of items to finalize the date in a single variable.
@@ -38,10 +58,41 @@ def merge_items_categories(items, categories, debug=False):
     :param debug: Boolean to print stuff on console for debugging
     :return: List of dicts containing item information including their categories
     """
-    for item in items:
-        if item['category_id']:
-            item['category'] = categories[item['category_id']]
-    return items
+    return list(iter_merge_items_categories(items, categories))
+
+
+def build_variant(product, variant):
+    """
+    Function to de-normalize a single variant of a product as defined in the readme.md
+
+    :param product: Dict containing product information along with its category
+    :param variant: One of the dicts in the variants of the product
+    :return: Variant record containing de-normalized variant information
+    """
+    category = product.get('category')
+    return Variant(
+        handle=product['handle'],
+        SKU=variant['sku'],
+        name=product['item_name'],
+        category_name=category['name'] if category else None,
+        category_color=category['color'] if category else None,
+        option_1_name=product['option1_name'],
+        option_1_value=variant['option1_value'],
+        price=variant['cost'],
+        image_url=product['image_url']
+    )
+
+
+def iter_variant_information(products):
+    """
+    Generator stage de-normalizing the variants of each product, one variant at a time.
+
+    :param products: iterable of dicts containing products information along with variants and categories
+    :return: generator yielding Variant records containing de-normalized variant information including their categories
+    """
+    for product in products:
+        for variant in product['variants']:
+            yield build_variant(product, variant)
 
 
 def extract_variant_information(products, debug=False):
@@ -50,35 +101,19 @@ def extract_variant_information(products, debug=False):
 
     :param products: List of dicts containing products information along with variants and categories
     :param debug: Boolean to print stuff on console for debugging
-    :return: List of dicts containing de-normalized variant information including their categories
+    :return: List of Variant records containing de-normalized variant information including their categories
     """
-    all_variants = list()
-    for product in products:
-        for variant in product['variants']:
-            p_handle = product['handle']
-            p_SKU = variant['sku']
-            p_name = product['item_name']
-            if 'category' in product:
-                p_category_name = product['category']['name']
-                p_category_color = product['category']['color']
-            else:
-                p_category_name = None
-                p_category_color = None
-            p_option_1_name = product['option1_name']
-            p_option_1_value = variant['option1_value']
-            p_price = variant['cost']
-            p_main_image_url = product['image_url']
-            all_variants.append(
-                {
-                    'handle': p_handle,
-                    'SKU': p_SKU,
-                    'name': p_name,
-                    'category_name': p_category_name,
-                    'category_color': p_category_color,
-                    'option_1_name': p_option_1_name,
-                    'option_1_value': p_option_1_value,
-                    'price': p_price,
-                    'image_url': p_main_image_url
-                }
-            )
-    return all_variants
+    return list(iter_variant_information(products))
+
+
+def transform_items(items, categories):
+    """
+    Pipeline of the transform stages: merge categories -> de-normalize variants.
+    Nothing is materialized, so items can flow from the extractor to staging in bounded memory.
+
+    :param items: iterable of dicts containing item information
+    :param categories: dict of dicts containing category information, with their id as key. Must hold the category of
+                every item
+    :return: generator yielding Variant records containing de-normalized variant information
+    """
+    return iter_variant_information(iter_merge_items_categories(items, categories))
@@ -0,0 +1,395 @@
+"""
+Prometheus-style metrics of the sync: every request of the Loyverse and WooCommerce drivers, and every stage of the
+pipeline.
+
+Requests are recorded per API, method and endpoint (ids in the path are replaced by {id}), so the slowest endpoint
+stands out:
+- loyverse_sync_http_request_duration_seconds: histogram of the latency of every attempt
+- loyverse_sync_http_requests_total: attempts by status code ('error' for connection errors and timeouts)
+- loyverse_sync_http_retries_total: attempts that were retried
+- loyverse_sync_http_request_bytes_total / loyverse_sync_http_response_bytes_total: bytes sent and received
+Stages (extract, transform, stage, categories, attributes, products, variants, ...) are recorded with:
+- loyverse_sync_stage_duration_seconds_total: time spent in the stage
+- loyverse_sync_stage_items_total: items the stage went through
+
+The metrics live in the memory of each process. Processes write them to METRICS_TEXTFILE_DIR with write_textfile, in
+the text format read by node_exporter's textfile collector, and the /metrics view of backend/app.py serves them all.
+"""
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from backend.utils import METRICS_LATENCY_BUCKETS, METRICS_TEXTFILE_DIR
+
+_lock = threading.Lock()
+_metrics = list()
+_id_segment = re.compile(r'/\d+(?=/|$)')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join('{}="{}"'.format(name, value) for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metrics: a family of samples, one per combination of label values.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        :param name: Name of the metric
+        :param documentation: Text of the HELP line
+        :param labelnames: Tuple of label names. Values are given in the same order when recording
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = dict()
+        with _lock:
+            _metrics.append(self)
+
+    def clear(self):
+        with _lock:
+            self.values.clear()
+
+    def render(self, extra_labels=None):
+        """
+        :param extra_labels: Dict of labels added to every sample, e.g. the process
+        :return: list of lines in the Prometheus text format
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        with _lock:
+            values = dict(self.values)
+        for labels in sorted(values):
+            lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, labels, extra_labels),
+                                          _format_value(values[labels])))
+        return lines
+
+
+class Counter(Metric):
+    """
+    Value that only goes up.
+    """
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """
+        :param labels: Label values, in the order of labelnames
+        :param amount: Amount to add
+        """
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value that is set to the latest measure.
+    """
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        """
+        :param labels: Label values, in the order of labelnames
+        :param value: Latest value
+        """
+        with _lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets, with their sum and count.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRICS_LATENCY_BUCKETS):
+        """
+        :param buckets: Upper bounds of the buckets, in increasing order. +Inf is added
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, *labels, value):
+        """
+        :param labels: Label values, in the order of labelnames
+        :param value: Observed value
+        """
+        with _lock:
+            counts, total = self.values.get(labels) or ([0] * len(self.buckets), 0.0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[labels] = (counts, total + value)
+
+    def render(self, extra_labels=None):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        with _lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self.values.items()}
+        for labels in sorted(values):
+            counts, total = values[labels]
+            for bound, count in zip(self.buckets, counts):
+                bucket_labels = dict(extra_labels or {}, le=_format_value(float(bound)))
+                lines.append('{}_bucket{} {}'.format(self.name, _format_labels(self.labelnames, labels, bucket_labels),
+                                                     count))
+            label_text = _format_labels(self.labelnames, labels, extra_labels)
+            lines.append('{}_sum{} {}'.format(self.name, label_text, _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, label_text, counts[-1]))
+        return lines
+
+
+HTTP_LABELS = ('api', 'method', 'endpoint')
+HTTP_REQUEST_DURATION = Histogram('loyverse_sync_http_request_duration_seconds',
+                                  'Latency of every request attempt in seconds', HTTP_LABELS)
+HTTP_REQUESTS = Counter('loyverse_sync_http_requests_total', 'Request attempts by status code',
+                        HTTP_LABELS + ('status',))
+HTTP_RETRIES = Counter('loyverse_sync_http_retries_total', 'Request attempts that were retried', HTTP_LABELS)
+HTTP_REQUEST_BYTES = Counter('loyverse_sync_http_request_bytes_total', 'Bytes of the request bodies sent',
+                             HTTP_LABELS)
+HTTP_RESPONSE_BYTES = Counter('loyverse_sync_http_response_bytes_total', 'Bytes of the response bodies received',
+                              HTTP_LABELS)
+STAGE_DURATION = Counter('loyverse_sync_stage_duration_seconds_total', 'Time spent in every stage in seconds',
+                         ('stage',))
+STAGE_ITEMS = Counter('loyverse_sync_stage_items_total', 'Items every stage went through', ('stage',))
+
+
+def get_endpoint_label(endpoint):
+    """
+    :param endpoint: Endpoint or url of a request
+    :return: path of the endpoint without the query string, with numeric ids replaced by {id}
+    """
+    path = urlsplit(endpoint).path if '://' in endpoint else endpoint.split('?')[0]
+    return _id_segment.sub('/{id}', '/' + path.lstrip('/'))
+
+
+def _get_request_size(response):
+    request = getattr(response, 'request', None)
+    body = getattr(request, 'body', None)
+    return len(body) if body else 0
+
+
+def _get_response_size(response):
+    # Bytes on the wire when the server sent them, the decompressed body otherwise
+    headers = getattr(response, 'headers', None) or {}
+    if headers.get('Content-Length', '').isdigit():
+        return int(headers['Content-Length'])
+    return len(getattr(response, 'content', b'') or b'')
+
+
+def timed_request(api, method, endpoint, send):
+    """
+    Function to send a request attempt and record its latency, status code and bytes.
+
+    :param api: Name of the API, e.g. 'woocommerce'
+    :param method: HTTP method
+    :param endpoint: Endpoint or url of the request
+    :param send: Function without arguments that sends the request and returns the response
+    :return: the response
+    """
+    labels = (api, method.upper(), get_endpoint_label(endpoint))
+    started_at = time.perf_counter()
+    try:
+        response = send()
+    except Exception:
+        HTTP_REQUEST_DURATION.observe(*labels, value=time.perf_counter() - started_at)
+        HTTP_REQUESTS.inc(*labels, 'error')
+        raise
+    HTTP_REQUEST_DURATION.observe(*labels, value=time.perf_counter() - started_at)
+    HTTP_REQUESTS.inc(*labels, str(response.status_code))
+    HTTP_REQUEST_BYTES.inc(*labels, amount=_get_request_size(response))
+    HTTP_RESPONSE_BYTES.inc(*labels, amount=_get_response_size(response))
+    return response
+
+
+def record_retry(api, method, endpoint):
+    """
+    Function to count an attempt that is retried.
+
+    :param api: Name of the API, e.g. 'woocommerce'
+    :param method: HTTP method
+    :param endpoint: Endpoint or url of the request
+    """
+    HTTP_RETRIES.inc(api, method.upper(), get_endpoint_label(endpoint))
+
+
+class InstrumentedClient:
+    """
+    Wrapper around a WooCommerce API client that records the metrics of every request.
+    """
+
+    def __init__(self, client, api='woocommerce'):
+        """
+        :param client: Client with get/post/put/delete/options methods (woocommerce.API)
+        :param api: Name of the API in the metrics
+        """
+        self.client = client
+        self.api = api
+        self.url = getattr(client, 'url', None)
+
+    def _request(self, method, endpoint, *args, **kwargs):
+        return timed_request(self.api, method, endpoint,
+                             lambda: getattr(self.client, method)(endpoint, *args, **kwargs))
+
+    def get(self, endpoint, **kwargs):
+        return self._request('get', endpoint, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        return self._request('post', endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        return self._request('put', endpoint, data, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self._request('delete', endpoint, **kwargs)
+
+    def options(self, endpoint, **kwargs):
+        return self._request('options', endpoint, **kwargs)
+
+
+class _Stage:
+    """
+    Stage being timed by time_stage. Set `items` to the number of items it went through.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+
+
+@contextmanager
+def time_stage(name):
+    """
+    Context manager recording the time spent in a stage, and its items if they are set on the yielded object:
+
+        with time_stage('categories') as stage:
+            categories_dict = create_categories(categories_dict)
+            stage.items = len(categories_dict)
+
+    :param name: Name of the stage
+    :return: context manager yielding an object with an `items` attribute
+    """
+    stage = _Stage(name)
+    started_at = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        STAGE_DURATION.inc(name, amount=time.perf_counter() - started_at)
+        if stage.items:
+            STAGE_ITEMS.inc(name, amount=stage.items)
+
+
+def time_iteration(name, iterable, count=None):
+    """
+    Function to record the time spent waiting for every element of an iterable as a stage, e.g. the pages of a
+    Loyverse list while they download.
+
+    :param name: Name of the stage
+    :param iterable: Iterable to go through
+    :param count: Function returning the number of items in an element, e.g. of a page
+    :return: generator yielding the elements of the iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        started_at = time.perf_counter()
+        try:
+            element = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            STAGE_DURATION.inc(name, amount=time.perf_counter() - started_at)
+        if count is not None:
+            STAGE_ITEMS.inc(name, amount=count(element))
+        yield element
+
+
+def render_metrics(process=None):
+    """
+    :param process: Value of a 'process' label added to every sample, so files of several processes can be merged
+    :return: every metric of this process in the Prometheus text format
+    """
+    extra_labels = {'process': process} if process else None
+    with _lock:
+        metrics = list(_metrics)
+    return '\n'.join(line for metric in metrics for line in metric.render(extra_labels)) + '\n'
+
+
+def clear_metrics():
+    """
+    Function to reset every metric of this process.
+    """
+    with _lock:
+        metrics = list(_metrics)
+    for metric in metrics:
+        metric.clear()
+
+
+def write_textfile(process, directory=METRICS_TEXTFILE_DIR):
+    """
+    Function to write the metrics of this process to `<directory>/<process>.prom`. The file is replaced atomically, so
+    readers never see half of it.
+
+    :param process: Name of the process, e.g. 'sync'. Also added as a 'process' label
+    :param directory: Directory of the metric files. None skips writing
+    :return: path of the file or None if nothing was written
+    """
+    if not directory:
+        return None
+    path = os.path.join(directory, '{}.prom'.format(process))
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'w') as textfile:
+        textfile.write(render_metrics(process))
+    os.replace(temporary_path, path)
+    return path
+
+
+def merge_metrics(texts):
+    """
+    Function to merge metrics in the text format, so a family in several of them is exposed under a single HELP and
+    TYPE.
+
+    :param texts: List of texts from render_metrics
+    :return: merged text
+    """
+    headers = defaultdict(list)
+    samples = defaultdict(list)
+    family = None
+    for text in texts:
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split(' ', 3)[2]
+                if line not in headers[family]:
+                    headers[family].append(line)
+            elif not line.startswith('#'):
+                samples[family].append(line)
+    return ''.join('\n'.join(headers[family] + samples[family]) + '\n' for family in headers)
+
+
+def read_textfiles(directory=METRICS_TEXTFILE_DIR):
+    """
+    :param directory: Directory of the metric files
+    :return: list of the texts of every metric file in the directory
+    """
+    if not directory or not os.path.isdir(directory):
+        return list()
+    texts = list()
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.prom'):
+            with open(os.path.join(directory, filename)) as textfile:
+                texts.append(textfile.read())
+    return texts
@@ -0,0 +1,182 @@
+"""
+Compact record types shared by the extractor and the inserter.
+
+Records use __slots__, so they take a fraction of the memory of the equivalent dict and don't hash key strings on every
+access. They still support dict-style access (record['SKU'], record.get('wc_id'), 'image_url' in record, iterating
+over the field names), so code written for the staged dicts works with them unchanged. They are serialized to the same
+json objects the dicts were, so staged data is compatible both ways.
+"""
+import json
+
+
+class Record:
+    """
+    Base class of the records. Subclasses only declare their fields in __slots__ and an __init__.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(field, getattr(self, field))
+                                                               for field in self.__slots__))
+
+    def get(self, key, default=None):
+        """
+        :param key: Name of a field
+        :param default: Value returned when the record has no such field
+        :return: value of the field
+        """
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        """
+        :return: tuple of the field names
+        """
+        return self.__slots__
+
+    def to_dict(self):
+        """
+        :return: dict with every field. Fields that hold records are converted too
+        """
+        return {field: to_serializable(value) if isinstance(value, Record) else value
+                for field, value in ((field, getattr(self, field)) for field in self.__slots__)}
+
+    def to_json(self):
+        """
+        :return: json string of the record
+        """
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: dict with the fields of the record. Keys that are not fields are ignored
+        :return: record
+        """
+        return cls(**{field: data[field] for field in cls.__slots__ if field in data})
+
+    @classmethod
+    def from_json(cls, value):
+        """
+        :param value: json string or bytes, e.g. a value read from redis
+        :return: record
+        """
+        return cls.from_dict(json.loads(value))
+
+
+def to_serializable(value):
+    """
+    Function to pass as `default` to json.dumps, so records can be serialized inside any structure.
+
+    :param value: Object json can't serialize by itself
+    :return: dict of the record
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+class Category(Record):
+    """
+    Loyverse category.
+    """
+    __slots__ = ('id', 'name', 'color')
+
+    def __init__(self, id=None, name=None, color=None):
+        self.id = id
+        self.name = name
+        self.color = color
+
+
+class Variant(Record):
+    """
+    De-normalized Loyverse variant, as staged in redis. A single product is a handle with one variant.
+    wc_id is filled in by the inserter and is not part of the staged content.
+    """
+    __slots__ = ('handle', 'SKU', 'name', 'category_name', 'category_color', 'option_1_name', 'option_1_value', 'price',
+                 'image_url', 'wc_id')
+
+    def __init__(self, handle=None, SKU=None, name=None, category_name=None, category_color=None, option_1_name=None,
+                 option_1_value=None, price=None, image_url=None, wc_id=None):
+        self.handle = handle
+        self.SKU = SKU
+        self.name = name
+        self.category_name = category_name
+        self.category_color = category_color
+        self.option_1_name = option_1_name
+        self.option_1_value = option_1_value
+        self.price = price
+        self.image_url = image_url
+        self.wc_id = wc_id
+
+    def to_dict(self):
+        """
+        :return: dict with every field, without wc_id when it is not set, like the staged dicts
+        """
+        data = super().to_dict()
+        if data['wc_id'] is None:
+            del data['wc_id']
+        return data
+
+
+class Product(Record):
+    """
+    Variable product: a handle with two or more variants.
+    """
+    __slots__ = ('handle', 'variants', 'wc_id')
+
+    def __init__(self, handle=None, variants=None, wc_id=None):
+        self.handle = handle
+        self.variants = variants if variants is not None else list()
+        self.wc_id = wc_id
+
+    def to_dict(self):
+        """
+        :return: dict with every field, variants included
+        """
+        return {'handle': self.handle, 'variants': [variant.to_dict() for variant in self.variants],
+                'wc_id': self.wc_id}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: dict with the fields of the product. Variants can be dicts or Variant records
+        :return: record
+        """
+        variants = [variant if isinstance(variant, Variant) else Variant.from_dict(variant)
+                    for variant in data.get('variants', [])]
+        return cls(handle=data.get('handle'), variants=variants, wc_id=data.get('wc_id'))
+
+
+class Attribute(Record):
+    """
+    Product attribute (option) with its terms. terms maps every term name to its WooCommerce id (None until created).
+    """
+    __slots__ = ('name', 'terms', 'wc_id')
+
+    def __init__(self, name=None, terms=None, wc_id=None):
+        self.name = name
+        self.terms = terms if terms is not None else dict()
+        self.wc_id = wc_id
@@ -1,91 +1,401 @@
 import json
 
-from backend.utils import REDIS_HOST, REDIS_PORT
+from backend.utils import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_CHUNK_SIZE, REDIS_SCAN_COUNT, CHECKPOINT_PREFIX, \
+    STAGING_PREFIXES, STAGING_KEPT_KEYS, REDIS_STORAGE_BACKEND, get_milli_time
+from backend.utils.records import to_serializable
 import redis
 
+_connection_pool = None
+_json_encoder = json.JSONEncoder(default=to_serializable)
+
 
 def get_redis_connection():
     """
     Function to connect to redis and return a connection
+    All connections share a single connection pool, so sockets are reused between calls.
     :return: connection object to redis database
     """
-    re_con = redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT)
+    global _connection_pool
+    if _connection_pool is None:
+        configure_redis()
+    re_con = redis.Redis(connection_pool=_connection_pool)
     return re_con
 
 
-def flush_data():
+def configure_redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB):
+    """
+    Function to point every connection to another redis server or database, e.g. a database of its own for every shop.
+    Connections of the previous pool are closed.
+
+    :param host: Redis host
+    :param port: Redis port
+    :param db: Database index
+    """
+    global _connection_pool
+    if _connection_pool is not None:
+        _connection_pool.disconnect()
+    _connection_pool = redis.ConnectionPool(
+        host=host,
+        port=port,
+        db=db)
+
+
+def use_json_backend():
+    """
+    :return: True if staged items are stored as RedisJSON documents instead of json strings
+    """
+    return REDIS_STORAGE_BACKEND == 'json'
+
+
+def get_json_commands(client):
+    """
+    :param client: Redis connection or pipeline
+    :return: RedisJSON commands of the client, serializing records as well as dicts
+    """
+    return client.json(encoder=_json_encoder)
+
+
+def get_path_field(path):
+    """
+    Function to get the top-level field a JSONPath points to, for reading string values.
+    Only the root ('$') and top-level fields ('$.price') are supported.
+
+    :param path: JSONPath, e.g. '$.wc_id'
+    :return: name of the field or None for the root
+    """
+    if path == '$':
+        return None
+    if not path.startswith('$.') or any(character in path[2:] for character in '.[*'):
+        raise ValueError('Only the root and top-level fields are supported: {}'.format(path))
+    return path[2:]
+
+
+def _unwrap(value):
+    # JSONPath reads return the list of matches
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def read_values(keys, path='$', client=None):
+    """
+    Function to read the values of keys in a single round trip: MGET of json strings or JSON.MGET of documents, which
+    only sends the requested path over the wire.
+
+    :param keys: List of full keys
+    :param path: JSONPath of the value to read, '$' for the whole item
+    :param client: Redis connection to use
+    :return: list of values (dicts for the whole item) with None for missing keys
+    """
+    recon = client or get_redis_connection()
+    if not keys:
+        return list()
+    if use_json_backend():
+        return [_unwrap(value) for value in get_json_commands(recon).mget(keys, path)]
+
+    field = get_path_field(path)
+    values = list()
+    for value in recon.mget(keys):
+        if value is not None:
+            value = json.loads(value)
+            if field is not None:
+                value = value.get(field)
+        values.append(value)
+    return values
+
+
+def write_value(pipeline, key, item):
     """
-    Function to clear all data from redis database
+    Function to queue the write of an item on a pipeline, as a json string or a RedisJSON document.
+
+    :param pipeline: Redis pipeline
+    :param key: Full key
+    :param item: dict or record
+    """
+    if use_json_backend():
+        get_json_commands(pipeline).set(key, '$', item)
+    else:
+        pipeline.set(key, json.dumps(item, default=to_serializable))
+
+
+def flush_data(prefixes=STAGING_PREFIXES, keep=STAGING_KEPT_KEYS):
+    """
+    Function to clear staged data from redis database
+    Only keys starting with the given prefixes are removed, so what is known about WooCommerce (fingerprints, ids)
+    survives a full extraction.
+
+    :param prefixes: Prefixes of the keys to remove. None clears the whole database
+    :param keep: Keys to keep even though they start with one of the prefixes, e.g. the deletions not pushed yet
     """
-    get_redis_connection().flushdb()
+    recon = get_redis_connection()
+    if prefixes is None:
+        recon.flushdb()
+        return
+
+    for prefix in prefixes:
+        keys = list()
+        for key in recon.scan_iter(match='{}*'.format(escape_pattern(prefix)), count=REDIS_SCAN_COUNT):
+            if key.decode() in keep:
+                continue
+            keys.append(key)
+            if len(keys) >= REDIS_CHUNK_SIZE:
+                recon.unlink(*keys)
+                keys = list()
+        if keys:
+            recon.unlink(*keys)
 
 
-def add_to_redis(items, key_name, prefix):
+def add_to_redis(items, key_name, prefix, chunk_size=REDIS_CHUNK_SIZE, debug=False):
     """
     Function to add data to redis. Takes a list of dictionaries and a key name argument to use as keys.
+    Items are written with a non-transactional pipeline, one round trip per `chunk_size` items.
+    Items without a usable key are skipped and listed in the report.
 
-    :param items: List of dicts
+    :param items: List (or any iterable) of dicts or records
     :param key_name: Key inside of dicts that should be used as redis key
     :param prefix: Prefix the key with this text
+    :param chunk_size: Number of items to send per pipeline
+    :param debug: Boolean to print stuff on console for debugging
+    :return: dict report with 'written' count, 'skipped' list of (item, reason) tuples, 'time_ms' and 'items_per_second'
     """
+    start_time = get_milli_time()
+    recon = get_redis_connection()
+    pipeline = recon.pipeline(transaction=False)
+
+    written = 0
+    pending = 0
+    skipped = list()
     for item in items:
         # Extract key
         if key_name not in item:
-            # TODO: Decision, skip this product or crash the whole program?
-            print("Error encountered: Defined key name was not found in item dict.")
-            exit()
+            skipped.append((item, 'Defined key name was not found in item dict.'))
+            continue
         key = item[key_name]
         if not key:
-            # TODO: Decision, skip this product or crash the whole program?
-            print("Error encountered: Key cannot be None. Check the data stream.")
-            exit()
+            skipped.append((item, 'Key cannot be None.'))
+            continue
 
-        recon = get_redis_connection()
-        recon.set('{}{}'.format(prefix, key), json.dumps(item))
+        write_value(pipeline, '{}{}'.format(prefix, key), item)
+        pending += 1
+        if pending >= chunk_size:
+            pipeline.execute()
+            written += pending
+            pending = 0
 
+    if pending:
+        pipeline.execute()
+        written += pending
 
-def get_all_items(prefix=None, to_json=True, decoded_keys=True, as_list=False):
+    time_taken = get_milli_time() - start_time
+    report = {
+        'written': written,
+        'skipped': skipped,
+        'time_ms': time_taken,
+        'items_per_second': written / (time_taken / 1000) if time_taken > 0 else None,
+    }
+    if debug:
+        print("Added {} items with prefix '{}' to redis in {:.0f}ms ({:.0f} items/s). Skipped: {}".format(
+            written, prefix, time_taken, report['items_per_second'] or 0, len(skipped)))
+        for item, reason in skipped:
+            print("\tSkipped item: {}. Reason: {}".format(item, reason))
+
+    return report
+
+
+def escape_pattern(text):
     """
-    Function to get all items inside redis based on prefix.
+    Function to escape glob characters so text can be used literally in a SCAN MATCH pattern.
+
+    :param text: Text to escape
+    :return: escaped text
+    """
+    for character in '\\*?[]':
+        text = text.replace(character, '\\' + character)
+    return text
+
+
+def iter_items(prefix=None, to_json=True, decoded_keys=True, count=REDIS_SCAN_COUNT):
+    """
+    Function to stream all items inside redis based on prefix.
+    Keys are found with SCAN (which doesn't block the server like KEYS does) and values are fetched with one MGET (or
+    JSON.MGET) per batch of keys, so only one batch is held in memory at a time.
 
     :param prefix: Look for a pattern at the start of the keys
     :param to_json: Convert values into Json dictionaries instead of sending them as strings
     :param decoded_keys: Decode the keys to strings instead of sending them as binary objects
-    :param as_list: Return items as a list of dictionaries instead of a single dictionary with many key-value pairs
-    :return: A dict of key-value pairs
+    :param count: COUNT hint for SCAN, also the size of the MGET batches
+    :return: generator yielding (key, value) tuples
     """
     recon = get_redis_connection()
+    match = '{}*'.format(escape_pattern(prefix)) if prefix else None
 
-    # Get the full list of keys
-    if not prefix:
-        encoded_keys = [key for key in recon.keys()]
-    else:
-        encoded_keys = [key for key in recon.keys() if key.decode().startswith(prefix)]
+    cursor = 0
+    while True:
+        cursor, encoded_keys = recon.scan(cursor=cursor, match=match, count=count)
+        if encoded_keys:
+            values = read_values(encoded_keys, client=recon)
+            for key, value in zip(encoded_keys, values):
+                if not value:
+                    continue
 
-    # Compile the dictionary
-    items_dict = dict()
-    for key in encoded_keys:
-        value = recon.get(key)
+                if to_json:
+                    value_to_yield = value
+                else:
+                    value_to_yield = json.dumps(value)
 
-        if not value:
+                if decoded_keys:
+                    key_to_yield = key.decode()
+                else:
+                    key_to_yield = key
+
+                yield key_to_yield, value_to_yield
+
+        if cursor == 0:
+            return
+
+
+def iter_values(prefix=None, to_json=True, count=REDIS_SCAN_COUNT):
+    """
+    Function to stream the values of all items inside redis based on prefix. See iter_items.
+
+    :param prefix: Look for a pattern at the start of the keys
+    :param to_json: Convert values into Json dictionaries instead of sending them as strings
+    :param count: COUNT hint for SCAN, also the size of the MGET batches
+    :return: generator yielding values
+    """
+    for _, value in iter_items(prefix=prefix, to_json=to_json, count=count):
+        yield value
+
+
+def get_items(keys, prefix='', to_json=True, chunk_size=REDIS_CHUNK_SIZE):
+    """
+    Function to get the items stored under the given keys, with one MGET per chunk of keys.
+    Missing keys are left out.
+
+    :param keys: List of keys without the prefix
+    :param prefix: Prefix of the keys, e.g. PROCESSED_DATA_PREFIX
+    :param to_json: Convert values into Json dictionaries instead of sending them as strings
+    :param chunk_size: Number of keys to get per MGET
+    :return: list of values
+    """
+    recon = get_redis_connection()
+    items = list()
+    for index in range(0, len(keys), chunk_size):
+        values = read_values(['{}{}'.format(prefix, key) for key in keys[index:index + chunk_size]], client=recon)
+        items.extend(value if to_json else json.dumps(value) for value in values if value)
+    return items
+
+
+def get_items_field(keys, path, prefix='', chunk_size=REDIS_CHUNK_SIZE):
+    """
+    Function to read a single field of many items, e.g. the '$.handle' of staged variants.
+    With the json backend only that field is sent by the server.
+
+    :param keys: List of keys without the prefix
+    :param path: JSONPath of the field, e.g. '$.wc_id'
+    :param prefix: Prefix of the keys, e.g. PROCESSED_DATA_PREFIX
+    :param chunk_size: Number of keys to get per MGET
+    :return: dict of key -> value of the field, for the keys that exist
+    """
+    recon = get_redis_connection()
+    fields = dict()
+    for index in range(0, len(keys), chunk_size):
+        keys_chunk = keys[index:index + chunk_size]
+        values = read_values(['{}{}'.format(prefix, key) for key in keys_chunk], path=path, client=recon)
+        for key, value in zip(keys_chunk, values):
+            if value is not None:
+                fields[key] = value
+    return fields
+
+
+def set_items_field(values, path, prefix='', chunk_size=REDIS_CHUNK_SIZE):
+    """
+    Function to update a single field of existing items, e.g. the '$.price' of staged variants.
+    With the json backend the field is set in place on the server. With json strings the items have to be read,
+    updated and written again. Keys that don't exist are not created.
+
+    :param values: Dict of key (without the prefix) -> new value of the field
+    :param path: JSONPath of the field, e.g. '$.wc_id'
+    :param prefix: Prefix of the keys, e.g. PROCESSED_DATA_PREFIX
+    :param chunk_size: Number of keys to update per pipeline
+    :return: number of items updated
+    """
+    recon = get_redis_connection()
+    field = get_path_field(path)
+    keys = list(values)
+    updated = 0
+    for index in range(0, len(keys), chunk_size):
+        keys_chunk = keys[index:index + chunk_size]
+        pipeline = recon.pipeline(transaction=False)
+        if use_json_backend():
+            json_commands = get_json_commands(pipeline)
+            for key in keys_chunk:
+                json_commands.set('{}{}'.format(prefix, key), path, values[key], xx=True)
+            # Missing keys make JSON.SET fail on a nested path, so errors are counted as not updated
+            updated += sum(1 for result in pipeline.execute(raise_on_error=False) if result is True)
             continue
 
-        if to_json:
-            value_to_insert = json.loads(value)
-        else:
-            value_to_insert = value
+        items = read_values(['{}{}'.format(prefix, key) for key in keys_chunk], client=recon)
+        for key, item in zip(keys_chunk, items):
+            if item is None:
+                continue
+            if field is None:
+                item = values[key]
+            else:
+                item[field] = values[key]
+            write_value(pipeline, '{}{}'.format(prefix, key), item)
+            updated += 1
+        pipeline.execute()
+    return updated
 
-        if decoded_keys:
-            key_to_insert = key.decode()
-        else:
-            key_to_insert = key
 
-        items_dict[key_to_insert] = value_to_insert
+def get_all_items(prefix=None, to_json=True, decoded_keys=True, as_list=False):
+    """
+    Function to get all items inside redis based on prefix.
+
+    :param prefix: Look for a pattern at the start of the keys
+    :param to_json: Convert values into Json dictionaries instead of sending them as strings
+    :param decoded_keys: Decode the keys to strings instead of sending them as binary objects
+    :param as_list: Return items as a list of dictionaries instead of a single dictionary with many key-value pairs
+    :return: A dict of key-value pairs
+    """
+    # Compile the dictionary
+    items_dict = dict(iter_items(prefix=prefix, to_json=to_json, decoded_keys=decoded_keys))
 
     # Whether to send the dict or just a list of products
     if as_list:
         return list(items_dict.values())
     else:
         return items_dict
+
+
+def save_checkpoint(name, value):
+    """
+    Function to save a checkpoint (e.g. the cursor of the last page processed) so a failed run can resume from it.
+
+    :param name: Name of the checkpoint
+    :param value: String value to save
+    """
+    get_redis_connection().set('{}{}'.format(CHECKPOINT_PREFIX, name), value)
+
+
+def get_checkpoint(name):
+    """
+    Function to get a saved checkpoint.
+
+    :param name: Name of the checkpoint
+    :return: String value of the checkpoint or None if there is none
+    """
+    value = get_redis_connection().get('{}{}'.format(CHECKPOINT_PREFIX, name))
+    if value is None:
+        return None
+    return value.decode()
+
+
+def clear_checkpoint(name):
+    """
+    Function to delete a checkpoint once the run it belongs to completed.
+
+    :param name: Name of the checkpoint
+    """
+    get_redis_connection().delete('{}{}'.format(CHECKPOINT_PREFIX, name))
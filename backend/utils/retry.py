@@ -0,0 +1,256 @@
+"""
+Retry, backoff and circuit breaker policy shared by the Loyverse and WooCommerce drivers
+"""
+import email.utils
+import random
+import threading
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from backend.utils import (RETRY_MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_STATUSES, RETRY_UNSAFE_STATUSES,
+                           CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+from backend.utils.metrics import record_retry
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a request is attempted while the circuit breaker of the API is open.
+    """
+    pass
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter. A Retry-After header sent by the API takes precedence over the computed
+    delay.
+    Requests that are not idempotent (POST) may have run even though they failed, so they are only retried when the
+    API refused them (unsafe_retry_statuses) or they were never sent.
+    """
+
+    def __init__(self, max_retries=RETRY_MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 retry_statuses=RETRY_STATUSES, unsafe_retry_statuses=RETRY_UNSAFE_STATUSES):
+        """
+        :param max_retries: Number of retries after the first attempt
+        :param base_delay: Delay in seconds before the first retry. Doubled on every retry
+        :param max_delay: Maximum delay in seconds between two attempts
+        :param retry_statuses: HTTP status codes that are worth retrying
+        :param unsafe_retry_statuses: HTTP status codes that are worth retrying for requests that are not idempotent
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.unsafe_retry_statuses = unsafe_retry_statuses
+
+    def should_retry(self, response, idempotent=True):
+        """
+        :param response: Response of the attempt
+        :param idempotent: Whether sending the request again can't do the same change twice
+        :return: True if the status code of the response is retryable
+        """
+        if not idempotent:
+            return response.status_code in self.retry_statuses and response.status_code in self.unsafe_retry_statuses
+        return response.status_code in self.retry_statuses
+
+    def should_retry_error(self, error, idempotent=True):
+        """
+        :param error: Connection error or timeout raised by the attempt
+        :param idempotent: Whether sending the request again can't do the same change twice
+        :return: True if the attempt is retryable
+        """
+        return idempotent or not was_sent(error)
+
+    def get_delay(self, attempt, response=None):
+        """
+        Function to compute how long to wait before the next attempt.
+
+        :param attempt: Number of the attempt that just failed, starting at 0
+        :param response: Response of the failed attempt, if any
+        :return: delay in seconds
+        """
+        retry_after = parse_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker that stops calling an API after too many consecutive failures.
+    After `reset_timeout` seconds a single trial request is let through while the others are still refused; its
+    success closes the circuit again and its failure keeps it open for another `reset_timeout`.
+    Safe to share between threads.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        """
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds to wait before letting a trial request through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Function to call before every attempt.
+        Raises CircuitOpenError if the circuit is open.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            # A trial request that never reported back (e.g. it raised something else) doesn't block the circuit forever
+            probing = self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout
+            if now - self.opened_at < self.reset_timeout or probing:
+                raise CircuitOpenError('Circuit open after {} consecutive failures'.format(self.failures))
+            # Half-open: let only this request through until it succeeds or fails
+            self.probe_started_at = now
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.probe_started_at is not None:
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+
+
+def parse_retry_after(response):
+    """
+    Function to read the Retry-After header of a response. The header can either be seconds or an HTTP date.
+
+    :param response: requests.Response object
+    :return: delay in seconds or None if the header is missing or invalid
+    """
+    value = response.headers.get('Retry-After') if response.headers else None
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+def was_sent(error):
+    """
+    :param error: Connection error or timeout raised by requests
+    :return: False if the error happened before the request was sent (connecting, TLS handshake, proxy), True if the
+                API may have received it
+    """
+    if isinstance(error, (requests.ConnectTimeout, requests.exceptions.SSLError, requests.exceptions.ProxyError)):
+        return False
+    # Refused connections and failed DNS lookups are wrapped in the MaxRetryError of urllib3
+    reason = error.args[0] if error.args else None
+    return not isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+
+def request_with_retry(send, policy, breaker=None, description='request', metric_labels=None, idempotent=True,
+                       debug=False):
+    """
+    Function to run a request with retries and backoff.
+    Connection errors and retryable status codes are retried; any other response is returned as is. When retries run
+    out, the last response is returned (or the last connection error raised) so the caller decides what to do with it.
+    Requests that are not idempotent are only retried if they were refused or never sent (see RetryPolicy).
+
+    :param send: Function without arguments that sends the request and returns the response
+    :param policy: RetryPolicy object
+    :param breaker: CircuitBreaker object of the API or None
+    :param description: Text used in debug messages
+    :param metric_labels: Tuple of the api, method and endpoint of the request, to count its retries in the metrics
+    :param idempotent: False for requests that must not run twice, e.g. POST
+    :param debug: Boolean to print stuff on console for debugging
+    :return: requests.Response object
+    """
+    attempt = 0
+    while True:
+        if breaker:
+            breaker.before_request()
+
+        try:
+            response = send()
+        except (requests.ConnectionError, requests.Timeout) as error:
+            if breaker:
+                breaker.record_failure()
+            if attempt >= policy.max_retries or not policy.should_retry_error(error, idempotent):
+                raise
+            delay = policy.get_delay(attempt)
+            if debug:
+                print("Error on {}: {}. Retrying in {:.1f}s.".format(description, error, delay))
+        else:
+            if not policy.should_retry(response):
+                if breaker:
+                    breaker.record_success()
+                return response
+
+            if breaker:
+                breaker.record_failure()
+            if attempt >= policy.max_retries or not policy.should_retry(response, idempotent):
+                return response
+            delay = policy.get_delay(attempt, response)
+            if debug:
+                print("Status {} on {}. Retrying in {:.1f}s.".format(response.status_code, description, delay))
+
+        if metric_labels:
+            record_retry(*metric_labels)
+        time.sleep(delay)
+        attempt += 1
+
+
+class RetryingClient:
+    """
+    Wrapper around a WooCommerce API client that retries every request with the given policy and circuit breaker.
+    POSTs (creates and batches) are not idempotent and only retried when it is safe, see RetryPolicy.
+    """
+
+    def __init__(self, client, policy, breaker=None, api='woocommerce'):
+        """
+        :param client: Client with get/post/put/delete/options methods
+        :param policy: RetryPolicy object
+        :param breaker: CircuitBreaker object or None
+        :param api: Name of the API in the metrics
+        """
+        self.client = client
+        self.policy = policy
+        self.breaker = breaker
+        self.api = api
+
+    def _request(self, method, endpoint, *args, **kwargs):
+        return request_with_retry(lambda: getattr(self.client, method)(endpoint, *args, **kwargs), self.policy,
+                                  self.breaker, description='{} {}'.format(method.upper(), endpoint),
+                                  metric_labels=(self.api, method, endpoint), idempotent=method != 'post')
+
+    def get(self, endpoint, **kwargs):
+        return self._request('get', endpoint, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        return self._request('post', endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        return self._request('put', endpoint, data, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self._request('delete', endpoint, **kwargs)
+
+    def options(self, endpoint, **kwargs):
+        return self._request('options', endpoint, **kwargs)
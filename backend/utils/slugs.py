@@ -0,0 +1,110 @@
+"""
+Registry of the slugs of category, attribute and attribute term names, persisted in redis.
+A name keeps the slug it was registered with, so slugs stay the same across runs even if the normalization rules
+change, and names are registered across the whole catalog before anything is created, so two names never share a slug
+"""
+import threading
+
+from backend.utils import SLUG_REGISTRY_PREFIX
+from backend.utils.redis import get_redis_connection
+from backend.utils.woocommerce import generate_slug
+
+# Registry key -> dict of name -> slug, as far as this process knows
+_registry = dict()
+_registry_lock = threading.Lock()
+
+
+def get_registry_key(entity_type, scope=None):
+    """
+    :param entity_type: 'category', 'attribute' or 'attribute_term'
+    :param scope: Name the slugs are unique within, e.g. the attribute of attribute terms. None for a single scope
+    :return: redis key of the hash holding the slugs
+    """
+    key = '{}{}'.format(SLUG_REGISTRY_PREFIX, entity_type)
+    return key if scope is None else '{}_{}'.format(key, scope)
+
+
+def get_free_slug(slug, owners):
+    """
+    :param slug: Slug that already belongs to another name
+    :param owners: Dict of slug -> name of every registered slug
+    :return: the slug with the lowest numeric suffix (-2, -3, ...) that doesn't belong to any name
+    """
+    suffix = 2
+    while '{}-{}'.format(slug, suffix) in owners:
+        suffix += 1
+    return '{}-{}'.format(slug, suffix)
+
+
+def register_slugs(entity_type, names, scope=None, existing=None):
+    """
+    Function to give a slug to every name that doesn't have one yet.
+    New names are registered in sorted order, so the same names always get the same slugs. A name whose slug belongs
+    to another name gets the slug with the next free numeric suffix instead, and is reported as a collision.
+
+    :param entity_type: 'category', 'attribute' or 'attribute_term'
+    :param names: Iterable of names
+    :param scope: Name the slugs are unique within, e.g. the attribute of attribute terms
+    :param existing: Dict of name -> slug of the objects in WooCommerce. A new name takes the slug of the object with
+                the same name, so objects created before the registry (with the rules generate_slug had then, or
+                a suffix WordPress added) are found again
+    :return: list of tuples (name, name that already had its slug, slug given instead) of every collision
+    """
+    key = get_registry_key(entity_type, scope)
+    connection = get_redis_connection()
+    registered = {name.decode(): slug.decode() for name, slug in connection.hgetall(key).items()}
+    owners = {slug: name for name, slug in registered.items()}
+
+    new = dict()
+    collisions = list()
+    for name in sorted(set(names) - set(registered)):
+        slug = existing.get(name) if existing else None
+        if slug is None or slug in owners:
+            slug = generate_slug(name, entity_type)
+        if slug in owners:
+            free_slug = get_free_slug(slug, owners)
+            collisions.append((name, owners[slug], free_slug))
+            slug = free_slug
+        owners[slug] = name
+        new[name] = slug
+
+    if new:
+        pipeline = connection.pipeline(transaction=False)
+        for name in new:
+            pipeline.hsetnx(key, name, new[name])
+        # Names another process registered at the same time keep the slug it gave them
+        raced = [name for name, added in zip(new, pipeline.execute()) if not added]
+        registered.update(new)
+        if raced:
+            registered.update({name: slug.decode() for name, slug in zip(raced, connection.hmget(key, raced))})
+
+    with _registry_lock:
+        _registry[key] = registered
+    return collisions
+
+
+def get_slug(entity_type, name, scope=None):
+    """
+    Function to get the slug of a name, registering it first if it has none.
+
+    :param entity_type: 'category', 'attribute' or 'attribute_term'
+    :param name: Category, attribute or attribute term name
+    :param scope: Name the slugs are unique within, e.g. the attribute of attribute terms
+    :return: slug string
+    """
+    key = get_registry_key(entity_type, scope)
+    with _registry_lock:
+        slug = _registry.get(key, {}).get(name)
+    if slug is None:
+        register_slugs(entity_type, [name], scope=scope)
+        with _registry_lock:
+            slug = _registry[key][name]
+    return slug
+
+
+def clear_slug_cache():
+    """
+    Function to forget the slugs read from redis, e.g. after the database was flushed.
+    """
+    with _registry_lock:
+        _registry.clear()
@@ -0,0 +1,124 @@
+"""
+Secondary indexes of the staged products: handle -> SKUs (HANDLE_SKUS_KEY, see delta.py), category -> handles and
+attribute -> terms. The inserter gets each grouping with a single command instead of scanning every staged product.
+
+Terms are only added, never removed, until the next full extraction rebuilds the indexes. A term that isn't used
+anymore is at worst created in WooCommerce without any variation.
+"""
+import json
+
+from backend.utils import PROCESSED_DATA_PREFIX, REDIS_SCAN_COUNT, HANDLE_SKUS_KEY, HANDLE_CATEGORY_KEY, \
+    CATEGORIES_KEY, CATEGORY_HANDLES_PREFIX, ATTRIBUTES_KEY, ATTRIBUTE_TERMS_PREFIX
+from backend.utils.redis import get_redis_connection, get_items
+
+
+def index_variants(variants):
+    """
+    Function to add the handles of staged variants to the category and attribute indexes.
+    Handles moved to another category are removed from the old one.
+
+    :param variants: List of de-normalized variants of the items that changed (all variants of each item)
+    """
+    handle_variants = dict()
+    for variant in variants:
+        handle_variants.setdefault(variant['handle'], list()).append(variant)
+    if not handle_variants:
+        return
+
+    recon = get_redis_connection()
+    handles = list(handle_variants)
+    previous_categories = recon.hmget(HANDLE_CATEGORY_KEY, handles)
+
+    pipeline = recon.pipeline(transaction=False)
+    for handle, previous_category in zip(handles, previous_categories):
+        handle_variants_list = handle_variants[handle]
+        category = handle_variants_list[0]['category_name']
+        if previous_category and previous_category.decode() != category:
+            pipeline.srem('{}{}'.format(CATEGORY_HANDLES_PREFIX, previous_category.decode()), handle)
+        if category:
+            pipeline.hset(HANDLE_CATEGORY_KEY, handle, category)
+            pipeline.sadd(CATEGORIES_KEY, category)
+            pipeline.sadd('{}{}'.format(CATEGORY_HANDLES_PREFIX, category), handle)
+        else:
+            pipeline.hdel(HANDLE_CATEGORY_KEY, handle)
+
+        # Only variable products have attributes
+        if len(handle_variants_list) > 1:
+            for variant in handle_variants_list:
+                attribute, term = variant['option_1_name'], variant['option_1_value']
+                if attribute and term:
+                    pipeline.sadd(ATTRIBUTES_KEY, attribute)
+                    pipeline.sadd('{}{}'.format(ATTRIBUTE_TERMS_PREFIX, attribute), term)
+    pipeline.execute()
+
+
+def unindex_handles(handles):
+    """
+    Function to remove deleted handles from the category index.
+
+    :param handles: List of handles of the items deleted in Loyverse
+    """
+    if not handles:
+        return
+
+    recon = get_redis_connection()
+    categories = recon.hmget(HANDLE_CATEGORY_KEY, handles)
+    pipeline = recon.pipeline(transaction=False)
+    pipeline.hdel(HANDLE_CATEGORY_KEY, *handles)
+    for handle, category in zip(handles, categories):
+        if category:
+            pipeline.srem('{}{}'.format(CATEGORY_HANDLES_PREFIX, category.decode()), handle)
+    pipeline.execute()
+
+
+def get_indexed_categories():
+    """
+    :return: list of the names of the categories that have at least one staged product
+    """
+    recon = get_redis_connection()
+    categories = sorted(member.decode() for member in recon.smembers(CATEGORIES_KEY))
+    pipeline = recon.pipeline(transaction=False)
+    for category in categories:
+        pipeline.scard('{}{}'.format(CATEGORY_HANDLES_PREFIX, category))
+    return [category for category, count in zip(categories, pipeline.execute()) if count]
+
+
+def get_category_handles(category):
+    """
+    :param category: Name of a category
+    :return: sorted list of the handles in the category
+    """
+    members = get_redis_connection().smembers('{}{}'.format(CATEGORY_HANDLES_PREFIX, category))
+    return sorted(member.decode() for member in members)
+
+
+def get_indexed_attributes():
+    """
+    :return: dict of attribute name -> sorted list of its terms, for the attributes of staged variable products
+    """
+    recon = get_redis_connection()
+    attributes = sorted(member.decode() for member in recon.smembers(ATTRIBUTES_KEY))
+    pipeline = recon.pipeline(transaction=False)
+    for attribute in attributes:
+        pipeline.smembers('{}{}'.format(ATTRIBUTE_TERMS_PREFIX, attribute))
+    return {attribute: sorted(term.decode() for term in terms)
+            for attribute, terms in zip(attributes, pipeline.execute())}
+
+
+def iter_indexed_products(count=REDIS_SCAN_COUNT):
+    """
+    Function to stream every staged product grouped by handle, through the handle -> SKUs index.
+    Variants of a handle come together and in their Loyverse order.
+
+    :param count: COUNT hint for HSCAN, also the number of handles fetched per batch
+    :return: generator yielding staged product dicts
+    """
+    recon = get_redis_connection()
+    cursor = 0
+    while True:
+        cursor, handle_skus = recon.hscan(HANDLE_SKUS_KEY, cursor=cursor, count=count)
+        skus = [sku for value in handle_skus.values() for sku in json.loads(value)]
+        for product in get_items(skus, prefix=PROCESSED_DATA_PREFIX):
+            yield product
+        if cursor == 0:
+            return
@@ -0,0 +1,106 @@
+"""
+Redis bookkeeping for the stock sync: Loyverse variant ids of every SKU and the quantities last pushed to WooCommerce
+"""
+from backend.utils import VARIANT_SKUS_KEY, PUSHED_STOCK_KEY, STOCK_WATERMARK_KEY, PENDING_STOCK_KEY
+from backend.utils.redis import get_redis_connection
+
+
+def record_variant_skus(items):
+    """
+    Function to save the SKU of every Loyverse variant, since inventory levels only refer to variant ids.
+
+    :param items: list of dicts containing item information from Loyverse
+    """
+    variant_skus = dict()
+    for item in items:
+        for variant in item['variants']:
+            if variant.get('variant_id') and variant.get('sku'):
+                variant_skus[variant['variant_id']] = variant['sku']
+
+    if variant_skus:
+        get_redis_connection().hset(VARIANT_SKUS_KEY, mapping=variant_skus)
+
+
+def get_variant_skus(variant_ids):
+    """
+    :param variant_ids: List of Loyverse variant ids
+    :return: dict of variant id -> SKU for the variants that are known
+    """
+    if not variant_ids:
+        return dict()
+
+    skus = get_redis_connection().hmget(VARIANT_SKUS_KEY, variant_ids)
+    return {variant_id: sku.decode() for variant_id, sku in zip(variant_ids, skus) if sku}
+
+
+def get_pushed_stock(skus):
+    """
+    :param skus: List of SKUs
+    :return: dict of SKU -> stock quantity last pushed to WooCommerce, for the SKUs that were pushed before
+    """
+    if not skus:
+        return dict()
+
+    quantities = get_redis_connection().hmget(PUSHED_STOCK_KEY, skus)
+    return {sku: int(quantity) for sku, quantity in zip(skus, quantities) if quantity is not None}
+
+
+def save_pushed_stock(quantities):
+    """
+    :param quantities: Dict of SKU -> stock quantity pushed to WooCommerce
+    """
+    if quantities:
+        get_redis_connection().hset(PUSHED_STOCK_KEY, mapping=quantities)
+
+
+def forget_pushed_stock(skus):
+    """
+    Function to forget the quantities pushed to products and variations that don't exist in WooCommerce anymore, so
+    the stock of the ones created again is pushed.
+
+    :param skus: Set of the SKUs of every product and variation in WooCommerce
+    :return: number of SKUs forgotten
+    """
+    connection = get_redis_connection()
+    missing = [sku for sku, _ in connection.hscan_iter(PUSHED_STOCK_KEY) if sku.decode() not in skus]
+    if missing:
+        connection.hdel(PUSHED_STOCK_KEY, *missing)
+    return len(missing)
+
+
+def get_pending_stock():
+    """
+    :return: dict of SKU -> stock quantity of the SKUs a previous stock sync could not push
+    """
+    quantities = get_redis_connection().hgetall(PENDING_STOCK_KEY)
+    return {sku.decode(): int(quantity) for sku, quantity in quantities.items()}
+
+
+def save_pending_stock(pending, done=None):
+    """
+    :param pending: Dict of SKU -> stock quantity that could not be pushed, to retry on the next stock sync
+    :param done: List of SKUs that don't have to be retried anymore
+    """
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    if done:
+        pipeline.hdel(PENDING_STOCK_KEY, *done)
+    if pending:
+        pipeline.hset(PENDING_STOCK_KEY, mapping=pending)
+    pipeline.execute()
+
+
+def get_stock_watermark():
+    """
+    :return: start time of the last successful stock sync or None
+    """
+    value = get_redis_connection().get(STOCK_WATERMARK_KEY)
+    if value is None:
+        return None
+    return value.decode()
+
+
+def set_stock_watermark(timestamp):
+    """
+    :param timestamp: start time of the stock sync that just completed
+    """
+    get_redis_connection().set(STOCK_WATERMARK_KEY, timestamp)
@@ -1,4 +1,4 @@
-from backend.auth.auth import, wcapi_prod, Loytoken_dev, Loytoken_prod
+from backend.auth.auth import wcapi_prod, Loytoken_prod
 
 # Default Authorizations
 wcapi = wcapi_prod
@@ -8,6 +8,18 @@ Loytoken = Loytoken_prod
 LOYVERSE_API_BASE = 'https://api.loyverse.com/v1.0'
 LOYVERSE_ALL_ITEMS_ENDPOINT = '/items'
 LOYVERSE_ALL_CATEGORIES_ENDPOINT = '/categories'
+LOYVERSE_INVENTORY_ENDPOINT = '/inventory'
+
+# Loyverse client
+LOYVERSE_PAGE_LIMIT = 250  # Maximum page size allowed by Loyverse
+LOYVERSE_POOL_SIZE = 4  # Keep-alive connections kept open to Loyverse
+LOYVERSE_CONNECT_TIMEOUT = 10  # Seconds to wait for a connection to Loyverse
+LOYVERSE_READ_TIMEOUT = 60  # Seconds to wait for Loyverse to answer
+LOYVERSE_PREFETCH_PAGES = 2  # Pages downloaded ahead while the extractor processes the current page
+LOYVERSE_STOCK_STORE_IDS = None  # Stores whose stock is summed up for WooCommerce. None uses every store
+LOYVERSE_VARIANT_IDS_PER_REQUEST = 100  # Variant ids sent in a single inventory request
+LOYVERSE_ITEM_IDS_PER_REQUEST = 100  # Item ids sent in a single items request
+LOYVERSE_WEBHOOK_SECRET = None  # Secret to verify the X-Loyverse-Signature of webhooks. Required by backend/app.py
 
 # WooCommerce API endpoints
 WOOCOMMERCE_ATTRIBUTES_ENDPOINT = 'products/attributes'
@@ -15,14 +27,120 @@ WOOCOMMERCE_ATTRIBUTE_TERMS_ENDPOINT_F = 'products/attributes/{}/terms'
 WOOCOMMERCE_CATEGORIES_ENDPOINT = 'products/categories'
 WOOCOMMERCE_PRODUCTS_ENDPOINT = 'products'
 WOOCOMMERCE_PRODUCT_VARIATIONS_ENDPOINT_F = 'products/{}/variations'
+WOOCOMMERCE_PRODUCTS_BATCH_ENDPOINT = 'products/batch'
+WOOCOMMERCE_PRODUCT_VARIATIONS_BATCH_ENDPOINT_F = 'products/{}/variations/batch'
+WOOCOMMERCE_CATEGORIES_BATCH_ENDPOINT = 'products/categories/batch'
+WOOCOMMERCE_ATTRIBUTES_BATCH_ENDPOINT = 'products/attributes/batch'
+WOOCOMMERCE_ATTRIBUTE_TERMS_BATCH_ENDPOINT_F = 'products/attributes/{}/terms/batch'
+
+# WooCommerce accepts at most 100 objects (create + update + delete) per batch call
+WOOCOMMERCE_BATCH_SIZE = 100
+WOOCOMMERCE_PAGE_SIZE = 100  # Maximum per_page allowed by WooCommerce list endpoints
+
+# WooCommerce concurrency. Keep the rate and requests in flight low enough for the shop's PHP workers
+WOOCOMMERCE_WORKERS = 1  # Worker threads used by insert_to_woocommerce. 1 runs everything sequentially
+WOOCOMMERCE_RATE_LIMIT = 10  # Requests per second per host
+WOOCOMMERCE_RATE_BURST = 10  # Requests that can be sent at once before the rate limit kicks in
+WOOCOMMERCE_MAX_IN_FLIGHT = 4  # Maximum concurrent requests per host
+
+# WooCommerce HTTP client (see utils/http.py). The credentials come from auth.py
+WOOCOMMERCE_POOL_SIZE = 8  # Keep-alive connections kept open to WooCommerce. At least WOOCOMMERCE_MAX_IN_FLIGHT
+WOOCOMMERCE_CONNECT_TIMEOUT = 10  # Seconds to wait for a connection to WooCommerce
+WOOCOMMERCE_READ_TIMEOUT = 120  # Seconds to wait for WooCommerce to answer. Full batches can take a while
+HTTP_GZIP = True  # Ask the APIs for gzip compressed responses
+
+# Retries and circuit breaker, shared by the Loyverse and WooCommerce drivers
+RETRY_MAX_RETRIES = 5  # Retries after the first attempt
+RETRY_BASE_DELAY = 1  # Seconds before the first retry, doubled on every retry (with jitter)
+RETRY_MAX_DELAY = 60  # Maximum seconds between two attempts, also caps Retry-After
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_UNSAFE_STATUSES = (429, 503)  # Statuses POSTs are retried on: the request was refused before it ran
+CIRCUIT_FAILURE_THRESHOLD = 10  # Consecutive failed attempts that stop all calls to the API
+CIRCUIT_RESET_TIMEOUT = 60  # Seconds before a trial call is let through an open circuit
+
+# Metrics (see utils/metrics.py)
+METRICS_TEXTFILE_DIR = None  # Directory every process writes its <process>.prom file to, e.g. node_exporter's textfile
+# collector directory. Also read by the /metrics view of backend/app.py. None disables the files
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # Request latency buckets in seconds
 
 # Redis host config
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
+REDIS_DB = 0
+REDIS_CHUNK_SIZE = 500  # Commands sent per pipeline round trip
+REDIS_SCAN_COUNT = 500  # COUNT hint for SCAN, also the size of MGET batches when reading
+# How staged items are stored: 'string' for json strings, 'json' for RedisJSON documents (needs the RedisJSON module,
+# e.g. the redislabs/rejson image in server/docker-compose.yml). Flush staging when switching
+REDIS_STORAGE_BACKEND = 'string'
 
 # Redis key prefixes
 PROCESSED_DATA_PREFIX = 'final_'
 RAW_DATA_PREFIX = 'raw_'
+CHECKPOINT_PREFIX = 'checkpoint_'
+
+# Redis keys for incremental syncs
+SYNC_WATERMARK_KEY = 'sync_watermark'  # Start time of the last successful extraction
+HANDLE_SKUS_KEY = 'sync_handle_skus'  # Hash of handle -> json list of SKUs
+CHANGED_SKUS_KEY = 'sync_changed_skus'  # Set of SKUs changed since the last push
+DELETED_SKUS_KEY = 'sync_deleted_skus'  # Set of SKUs deleted since the last push
+DELETED_HANDLES_KEY = 'sync_deleted_handles'  # Set of handles of items deleted since the last push
+
+# Redis secondary indexes of the staged products, kept up to date by the extraction
+HANDLE_CATEGORY_KEY = 'sync_handle_categories'  # Hash of handle -> category name
+CATEGORIES_KEY = 'sync_categories'  # Set of category names
+CATEGORY_HANDLES_PREFIX = 'sync_category_handles_'  # Set of the handles in a category, per category name
+ATTRIBUTES_KEY = 'sync_attributes'  # Set of attribute names of variable products
+ATTRIBUTE_TERMS_PREFIX = 'sync_attribute_terms_'  # Set of the terms of an attribute, per attribute name
+
+# Redis keys kept across full syncs, holding what was pushed to WooCommerce
+PRODUCT_FINGERPRINTS_KEY = 'wc_fingerprints_products'  # Hash of handle -> json with content hash and WooCommerce id
+VARIANT_FINGERPRINTS_KEY = 'wc_fingerprints_variants'  # Hash of SKU -> json with content hash and WooCommerce id
+WC_SLUG_INDEX_KEY = 'wc_index_slugs'  # Hash of product slug -> WooCommerce id
+WC_SKU_INDEX_KEY = 'wc_index_skus'  # Hash of SKU -> json with WooCommerce id and parent id
+WC_INDEX_WARMED_KEY = 'wc_index_warmed'  # Set once the index was built from every product in WooCommerce
+PUSHED_STOCK_KEY = 'wc_pushed_stock'  # Hash of SKU -> stock quantity last pushed to WooCommerce
+IMAGE_REGISTRY_KEY = 'wc_images'  # Hash of Loyverse image url -> json with WooCommerce media id and content hash
+SLUG_REGISTRY_PREFIX = 'wc_slugs_'  # Hash of name -> slug, per entity type (and attribute, for attribute terms)
+
+# Redis keys of the push journal, see utils/journal.py
+JOURNAL_PREFIX = 'journal_'  # Hash of key -> json of the recorded entity, per run id and kind of entity
+JOURNAL_RUN_KEY = 'journal_run'  # Run id of the push that didn't finish yet, per type of run ('full', 'changed')
+JOURNAL_TTL = 7 * 24 * 3600  # Seconds an unfinished journal is kept before redis expires it
+
+# Images
+IMAGE_SRC_SUFFIX = '.png'  # WooCommerce only downloads image urls ending with a file type
+IMAGE_CHECK_CONTENT = False  # Send a HEAD request per image url to detect new content behind the same url (ETag)
+IMAGE_CHECK_TIMEOUT = 10  # Seconds to wait for the HEAD request of an image
+
+# Redis keys for the stock sync
+VARIANT_SKUS_KEY = 'stock_variant_skus'  # Hash of Loyverse variant id -> SKU, written by the extraction
+STOCK_WATERMARK_KEY = 'stock_watermark'  # Start time of the last successful stock sync
+PENDING_STOCK_KEY = 'stock_pending'  # Hash of SKU -> stock quantity that could not be pushed yet
+
+# Redis keys of the webhook queue. Ids are kept in sets so repeated events for the same item are coalesced
+WEBHOOK_ITEM_IDS_KEY = 'webhook_item_ids'  # Set of Loyverse item ids changed since the worker last ran
+WEBHOOK_VARIANT_IDS_KEY = 'webhook_variant_ids'  # Set of Loyverse variant ids whose stock changed
+WEBHOOK_NOTIFY_KEY = 'webhook_notify'  # List the worker blocks on until an event is queued
+
+# Redis keys of the WooCommerce push job queue (a stream read by a consumer group)
+JOBS_STREAM_KEY = 'jobs_wc_push'  # Stream of pending push jobs
+JOBS_DEAD_LETTER_KEY = 'jobs_wc_push_dead'  # Stream of jobs that failed JOB_MAX_ATTEMPTS times
+JOBS_ERRORS_KEY = 'jobs_wc_push_errors'  # Hash of job id -> last error, kept until the job is acked
+JOBS_GROUP = 'wc_push_workers'  # Consumer group shared by every job worker
+
+# Job workers
+JOB_MAX_ATTEMPTS = 5  # Deliveries of a job before it is moved to the dead-letter stream
+JOB_RETRY_IDLE_MS = 60000  # Unacked jobs idle this long are retried by any worker. Must exceed the longest job
+JOB_BLOCK_MS = 5000  # Time a worker blocks waiting for new jobs
+
+# Webhook worker
+WEBHOOK_COALESCE_SECONDS = 2  # Time the worker waits after an event so a burst of edits is pushed at once
+WEBHOOK_POLL_TIMEOUT = 30  # Seconds the worker blocks waiting for events before checking the queue again
+
+# Prefixes of the keys removed by flush_data before a full extraction
+STAGING_PREFIXES = (PROCESSED_DATA_PREFIX, RAW_DATA_PREFIX, 'sync_')
+# Keys kept by flush_data: deletions are only pushed by a push of changes, so they must outlive a full extraction
+STAGING_KEPT_KEYS = (DELETED_SKUS_KEY, DELETED_HANDLES_KEY)
 
 # General
 SLUG_PREFIXES = {
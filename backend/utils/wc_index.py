@@ -0,0 +1,147 @@
+"""
+Persistent index of WooCommerce ids by product slug and SKU, so existence checks don't need a request
+"""
+import json
+
+from backend.utils import WC_SLUG_INDEX_KEY, WC_SKU_INDEX_KEY, WC_INDEX_WARMED_KEY
+from backend.utils.delta import get_timestamp
+from backend.utils.redis import get_redis_connection
+
+
+def is_index_warm():
+    """
+    :return: True if the index was built from WooCommerce, so a miss means the product doesn't exist
+    """
+    return bool(get_redis_connection().exists(WC_INDEX_WARMED_KEY))
+
+
+def clear_index():
+    """
+    Function to remove the whole index, e.g. before building it again.
+    """
+    get_redis_connection().delete(WC_SLUG_INDEX_KEY, WC_SKU_INDEX_KEY, WC_INDEX_WARMED_KEY)
+
+
+def mark_index_warm():
+    """
+    Function to record that the index holds every product of WooCommerce.
+    """
+    get_redis_connection().set(WC_INDEX_WARMED_KEY, get_timestamp())
+
+
+def index_products(products, parent_id=None):
+    """
+    Function to add products or variations returned by WooCommerce to the index.
+
+    :param products: List of product (or variation) dicts. Only 'id', 'slug', 'sku' and 'parent_id' are used
+    :param parent_id: Id of the parent product when indexing variations
+    """
+    slugs = dict()
+    skus = dict()
+    for product in products:
+        if not product or not product.get('id'):
+            continue
+        product_parent_id = parent_id or product.get('parent_id') or 0
+        if product.get('slug') and not product_parent_id:
+            slugs[product['slug']] = product['id']
+        if product.get('sku'):
+            skus[product['sku']] = json.dumps({'id': product['id'], 'parent_id': product_parent_id})
+
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    if slugs:
+        pipeline.hset(WC_SLUG_INDEX_KEY, mapping=slugs)
+    if skus:
+        pipeline.hset(WC_SKU_INDEX_KEY, mapping=skus)
+    pipeline.execute()
+
+
+def lookup_slug(slug):
+    """
+    :param slug: Slug of a product
+    :return: WooCommerce id of the product or None if it is not in the index
+    """
+    product_id = get_redis_connection().hget(WC_SLUG_INDEX_KEY, slug)
+    if product_id is None:
+        return None
+    return int(product_id)
+
+
+def lookup_sku(sku):
+    """
+    :param sku: SKU of a product or variation
+    :return: dict with the 'id' and 'parent_id' (0 for products) or None if it is not in the index
+    """
+    value = get_redis_connection().hget(WC_SKU_INDEX_KEY, sku)
+    if value is None:
+        return None
+    return json.loads(value)
+
+
+def lookup_slugs(slugs):
+    """
+    :param slugs: List of product slugs
+    :return: dict of slug -> WooCommerce id of the product or None if it is not in the index
+    """
+    slugs = list(slugs)
+    if not slugs:
+        return dict()
+    values = get_redis_connection().hmget(WC_SLUG_INDEX_KEY, slugs)
+    return {slug: int(value) if value is not None else None for slug, value in zip(slugs, values)}
+
+
+def lookup_skus(skus):
+    """
+    :param skus: List of SKUs of products or variations
+    :return: dict of SKU -> dict with the 'id' and 'parent_id' (0 for products) or None if it is not in the index
+    """
+    skus = list(skus)
+    if not skus:
+        return dict()
+    values = get_redis_connection().hmget(WC_SKU_INDEX_KEY, skus)
+    return {sku: json.loads(value) if value is not None else None for sku, value in zip(skus, values)}
+
+
+def remove_from_index(slugs=None, skus=None):
+    """
+    Function to remove deleted products and variations from the index.
+
+    :param slugs: List of product slugs
+    :param skus: List of SKUs
+    """
+    slugs = [slug for slug in slugs or [] if slug]
+    skus = [sku for sku in skus or [] if sku]
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    if slugs:
+        pipeline.hdel(WC_SLUG_INDEX_KEY, *slugs)
+    if skus:
+        pipeline.hdel(WC_SKU_INDEX_KEY, *skus)
+    pipeline.execute()
+
+
+def iter_indexed_slugs():
+    """
+    :return: generator yielding tuples of the slug and WooCommerce id of every indexed product
+    """
+    for slug, product_id in get_redis_connection().hscan_iter(WC_SLUG_INDEX_KEY):
+        yield slug.decode() if isinstance(slug, bytes) else slug, int(product_id)
+
+
+def iter_indexed_skus():
+    """
+    :return: generator yielding tuples of the SKU and the dict with the 'id' and 'parent_id' of every indexed product
+                and variation
+    """
+    for sku, value in get_redis_connection().hscan_iter(WC_SKU_INDEX_KEY):
+        yield sku.decode() if isinstance(sku, bytes) else sku, json.loads(value)
+
+
+def remove_variations_from_index(parent_ids):
+    """
+    Function to remove the variations of deleted variable products from the index. WooCommerce deletes them with
+    their parent, without listing them in the response.
+
+    :param parent_ids: List of ids of deleted products
+    """
+    parent_ids = set(parent_ids)
+    if parent_ids:
+        remove_from_index(skus=[sku for sku, entry in iter_indexed_skus() if entry['parent_id'] in parent_ids])
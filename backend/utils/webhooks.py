@@ -0,0 +1,116 @@
+"""
+Redis queue between the webhook receiver and the webhook worker.
+Ids are added to sets, so an item edited many times before the worker runs is only pushed once.
+"""
+import base64
+import hashlib
+import hmac
+
+from backend.utils import WEBHOOK_ITEM_IDS_KEY, WEBHOOK_VARIANT_IDS_KEY, WEBHOOK_NOTIFY_KEY
+from backend.utils.redis import get_redis_connection
+
+
+def verify_signature(body, signature, secret):
+    """
+    Function to check the X-Loyverse-Signature header of a webhook (base64 HMAC-SHA1 of the raw body).
+
+    :param body: Raw request body bytes
+    :param signature: Value of the signature header
+    :param secret: Webhook secret
+    :return: True if the signature matches
+    """
+    if not signature:
+        return False
+    expected = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha1).digest()).decode()
+    return hmac.compare_digest(expected, signature)
+
+
+def enqueue_ids(key, ids):
+    """
+    Function to queue ids for the worker and wake it up.
+
+    :param key: WEBHOOK_ITEM_IDS_KEY or WEBHOOK_VARIANT_IDS_KEY
+    :param ids: List of Loyverse ids
+    :return: number of ids that were not already queued
+    """
+    ids = [queued_id for queued_id in ids if queued_id]
+    if not ids:
+        return 0
+
+    pipeline = get_redis_connection().pipeline(transaction=False)
+    pipeline.sadd(key, *ids)
+    pipeline.rpush(WEBHOOK_NOTIFY_KEY, 1)
+    added, _ = pipeline.execute()
+    return added
+
+
+def enqueue_item_ids(item_ids):
+    """
+    :param item_ids: List of Loyverse item ids that changed
+    :return: number of ids that were not already queued
+    """
+    return enqueue_ids(WEBHOOK_ITEM_IDS_KEY, item_ids)
+
+
+def enqueue_variant_ids(variant_ids):
+    """
+    :param variant_ids: List of Loyverse variant ids whose stock changed
+    :return: number of ids that were not already queued
+    """
+    return enqueue_ids(WEBHOOK_VARIANT_IDS_KEY, variant_ids)
+
+
+def wait_for_events(timeout):
+    """
+    Function to block until an event is queued.
+
+    :param timeout: Maximum seconds to wait
+    :return: True if an event was queued, False on timeout
+    """
+    return get_redis_connection().blpop([WEBHOOK_NOTIFY_KEY], timeout=timeout) is not None
+
+
+def pop_ids(key):
+    """
+    Function to take every queued id at once. Ids queued afterwards are left for the next run.
+
+    :param key: WEBHOOK_ITEM_IDS_KEY or WEBHOOK_VARIANT_IDS_KEY
+    :return: sorted list of ids
+    """
+    pipeline = get_redis_connection().pipeline(transaction=True)
+    pipeline.smembers(key)
+    pipeline.delete(key)
+    members, _ = pipeline.execute()
+    return sorted(member.decode() for member in members)
+
+
+def pop_item_ids():
+    """
+    :return: sorted list of the queued Loyverse item ids
+    """
+    return pop_ids(WEBHOOK_ITEM_IDS_KEY)
+
+
+def pop_variant_ids():
+    """
+    :return: sorted list of the queued Loyverse variant ids
+    """
+    return pop_ids(WEBHOOK_VARIANT_IDS_KEY)
+
+
+def requeue_ids(key, ids):
+    """
+    Function to put ids back in the queue when pushing them failed, without waking the worker up.
+
+    :param key: WEBHOOK_ITEM_IDS_KEY or WEBHOOK_VARIANT_IDS_KEY
+    :param ids: List of Loyverse ids
+    """
+    if ids:
+        get_redis_connection().sadd(key, *ids)
+
+
+def clear_notifications():
+    """
+    Function to drop pending wake-ups once the queue was drained, since one run handles all of them.
+    """
+    get_redis_connection().delete(WEBHOOK_NOTIFY_KEY)
@@ -1,26 +1,46 @@
+import functools
+import hashlib
 import re
+import unicodedata
+from urllib.parse import quote
 
 from backend.utils import SLUG_PREFIXES
 
+_unwanted_characters = re.compile(r'[^\w\s-]')
+_separators = re.compile(r'[\s-]+')
 
-def generate_slug(category, entity_type):
+
+@functools.lru_cache(maxsize=None)
+def normalize_slug(name):
     """
-    Function to use the category name and create a slug from it.
-    TODO: We can use a library to slugify our strings but it needs to be a very strictly regulated system because they
-        are the only way of keeping things from being duplicated. In case a library updates and changes how they create
-        slugs, it could cause a serious problem of duplication in WooCommerce.
+    Function to turn a name into the part of a slug after its prefix. Letters and digits of every script are kept:
+    - compatibility characters are decomposed and accents removed ('Café' -> 'cafe', 'ﬁ' -> 'fi')
+    - case is folded ('Straße' -> 'strasse')
+    - punctuation is removed, and runs of spaces and dashes become a single dash
+    - characters that are not ASCII are percent-encoded in lower case, the form WordPress stores them in
+    Names left without any character get a hash of the name instead, so they still have a slug of their own.
+    The rules must not change: slugs are how objects are found again in WooCommerce (see utils/slugs.py).
 
-    :param category: Category name
-    :param entity_type: Type of entity to get prefix
-    :return: slug string
+    :param name: Category, attribute or attribute term name
+    :return: slug string without prefix
     """
-    prefix = SLUG_PREFIXES[entity_type]
+    text = unicodedata.normalize('NFKD', name)
+    text = ''.join(character for character in text if not unicodedata.combining(character)).casefold()
+    text = _unwanted_characters.sub('', text)
+    text = _separators.sub('-', text).strip('-')
+    if not text:
+        return hashlib.sha1(name.encode()).hexdigest()[:12]
+    return quote(text, safe='-_').lower()
+
 
-    slug = category.lower()
-    slug = re.sub('[^a-zA-B ]', '', slug)
-    slug = re.sub('\\s+-\\s+', '-', slug)
-    slug = re.sub('\\s+', '-', slug)
+def generate_slug(name, entity_type):
+    """
+    Function to create the slug of a name. Use utils.slugs.get_slug instead to get the slug a name was registered
+    with, which stays the same across runs and never collides with the slug of another name.
 
-    slug = '{}{}'.format(prefix, slug)
+    :param name: Category, attribute or attribute term name
+    :param entity_type: Type of entity to get prefix
+    :return: slug string
+    """
+    return '{}{}'.format(SLUG_PREFIXES[entity_type], normalize_slug(name))
 
-    return slug
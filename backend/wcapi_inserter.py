@@ -1,48 +1,178 @@
 """
 Script uses wcapi.py to access WooCommerce and insert product information to the WooCommerce system
 """
-
-from .utils import PROCESSED_DATA_PREFIX, get_milli_time, SLUG_PREFIXES
-from .utils.woocommerce import generate_slug
-from .drivers.wcapi import post_attribute, post_attribute_term, post_category, \
-    post_product, post_product_variation
-from .utils.redis import get_all_items
-
-
-def insert_to_woocommerce(debug=False):
+import json
+
+from .utils import get_milli_time, SLUG_PREFIXES, WOOCOMMERCE_WORKERS, \
+    WOOCOMMERCE_BATCH_SIZE, PRODUCT_FINGERPRINTS_KEY, VARIANT_FINGERPRINTS_KEY, chunk_list
+from .utils.concurrency import run_in_pool
+from .utils.slugs import get_slug
+from .drivers.wcapi import post_attribute, post_attribute_term, post_category, post_product, \
+    build_product_data, build_product_variation_data, batch_products, batch_product_variations, search_product, \
+    search_product_by_sku, delete_product, delete_product_variation, warm_product_index, load_taxonomy_cache, \
+    register_category_slugs, register_attribute_slugs
+from .utils.staging_index import iter_indexed_products, get_indexed_categories, get_indexed_attributes
+from .utils.delta import get_changed_products, get_deleted, clear_changes
+from .utils.fingerprint import get_fingerprints, is_unchanged, save_fingerprints, delete_fingerprints
+from .utils.wc_index import is_index_warm, lookup_slug
+from .utils.jobs import enqueue_jobs
+from .utils.records import Variant, Product, Attribute
+from .utils.images import image_changed
+from .utils.journal import start_run
+from .utils.metrics import time_stage
+
+
+def insert_to_woocommerce(workers=WOOCOMMERCE_WORKERS, only_changed=False, rebuild_index=False, queue=False,
+                          resume=False, debug=False):
     """
     Main pipeline
 
+    With more than one worker, independent creates inside each step run concurrently on a pool of threads. Steps still
+    run one after the other, so categories and attributes exist before products, and parent products before their
+    variations. The driver's rate limiter and in-flight cap apply to all workers.
+
     Steps:
     ======
-    1. Retrieve the list of products to upload
-    2. Get a list of categories to create from products list
-    3. Process them into their two different types, single products and variables
-    4. For each product, based on their type, decide attributes, and attribute terms to create
-    5. Create attributes, attribute terms, and categories through POST
-    6. Insert single products and parent products for variants through POST
-    7. Insert variants for variable products through POST
-    """
-    product_list = get_all_items(prefix=PROCESSED_DATA_PREFIX, as_list=True)
-    categories_dict = get_all_categories(product_list)
-    single_products, variable_products = determine_product_types(product_list)
-    attributes_dict = determine_attributes(variable_products)
+    0. Build the index of WooCommerce product ids if it doesn't exist yet, so existence checks are local lookups, and
+        load existing attributes, attribute terms and categories into the driver's taxonomy cache
+    1. Retrieve the list of products to upload, grouped by handle through the staging index
+    2. Process them into their two different types, single products and variables
+    3. Get the categories, attributes and attribute terms to create from the staging indexes (from the products when
+        only pushing changes)
+    4. Create attributes, attribute terms, and categories through POST
+    5. Insert single products (batched) and parent products for variants through POST
+    6. Insert variants for variable products through batch POSTs
+    7. When only pushing changes, delete the products and variations deleted in Loyverse
+
+    Steps 4 to 7 write every entity they push, with its WooCommerce id, to a journal of the run (see
+    utils/journal.py) as soon as WooCommerce answered. The journal is removed once the push completed. With
+    resume=True, entities in the journal of a push that didn't complete are not sent again.
+
+    With queue=True, steps 4 to 7 are not run here. They are split into jobs on the durable job queue instead, for
+    worker processes to push (see wcapi_jobs.py).
+
+    :param workers: Number of worker threads to use for each step
+    :param only_changed: Only push the products changed or deleted since the last push, as recorded by an incremental
+                extraction. Every variant of a changed product is pushed
+    :param rebuild_index: Build the index of WooCommerce product ids again, e.g. after products were edited in the
+                WooCommerce admin
+    :param queue: Queue the push as jobs instead of pushing in this process
+    :param resume: Continue the last push of the same type (full or only_changed) if it didn't complete, skipping what
+                its journal recorded. Without it, the journal of that push is discarded
+    :param debug: Boolean to print stuff on console for debugging
+    """
+    if only_changed:
+        changed_skus, product_list = get_changed_products()
+        if debug:
+            print("Pushing {} changed SKUs ({} products with their variants)".format(len(changed_skus),
+                                                                                   len(product_list)))
+    else:
+        product_list = iter_indexed_products()
 
+    single_products, variable_products = determine_product_types(product_list)
+    warm_product_index(rebuild=rebuild_index, workers=workers, debug=debug)
+    if only_changed:
+        categories_dict = get_all_categories(iter_staged_products(single_products, variable_products))
+        attributes_dict = determine_attributes(variable_products)
+    else:
+        # Every staged product is pushed, so the indexes hold the full groupings
+        categories_dict = dict.fromkeys(get_indexed_categories())
+        attributes_dict = {attribute: Attribute(name=attribute, terms=dict.fromkeys(terms))
+                           for attribute, terms in get_indexed_attributes().items()}
+    if queue:
+        deleted_skus, deleted_handles = get_deleted() if only_changed else (None, None)
+        enqueue_push(single_products, variable_products, categories_dict, attributes_dict,
+                     deleted_skus=deleted_skus, deleted_handles=deleted_handles, debug=debug)
+        # The changes are safe in the queue now
+        if only_changed:
+            clear_changes(changed_skus, deleted_skus, deleted_handles)
+        return
+
+    journal = start_run('changed' if only_changed else 'full', resume=resume)
+    if debug and resume:
+        print("Resuming push {}: {}".format(journal.run_id, journal.count() or 'nothing journaled yet'))
+    # Categories and attributes already in the journal don't need the cache to be found
+    if not is_taxonomy_journaled(journal, categories_dict, attributes_dict):
+        load_taxonomy_cache(workers=workers, debug=debug)
     start_time = get_milli_time()
-    categories_dict = create_categories(categories_dict, debug=debug)
-    attributes_dict = create_attributes(attributes_dict, debug=debug)
-    single_products = create_single_products(single_products, categories_dict, debug=debug)
-    variable_products = create_variable_products(variable_products, categories_dict, attributes_dict, debug=debug)
-    variable_products = create_variants(variable_products, attributes_dict, debug=debug)
+    with time_stage('categories') as stage:
+        categories_dict = create_categories(categories_dict, workers=workers, journal=journal, debug=debug)
+        stage.items = len(categories_dict)
+    with time_stage('attributes') as stage:
+        attributes_dict = create_attributes(attributes_dict, workers=workers, journal=journal, debug=debug)
+        stage.items = len(attributes_dict)
+    with time_stage('products') as stage:
+        single_products = create_single_products(single_products, categories_dict, workers=workers, journal=journal,
+                                                 debug=debug)
+        variable_products = create_variable_products(variable_products, categories_dict, attributes_dict,
+                                                     workers=workers, journal=journal, debug=debug)
+        stage.items = len(single_products) + len(variable_products)
+    with time_stage('variants') as stage:
+        variable_products = create_variants(variable_products, attributes_dict, workers=workers, journal=journal,
+                                            debug=debug)
+        stage.items = sum(len(variable_products[handle]['variants']) for handle in variable_products)
+    if only_changed:
+        deleted_skus, deleted_handles = get_deleted()
+        with time_stage('delete') as stage:
+            delete_products(deleted_skus, deleted_handles, workers=workers, journal=journal, debug=debug)
+            stage.items = len(deleted_skus) + len(deleted_handles)
+        clear_changes(changed_skus, deleted_skus, deleted_handles)
+    journal.finish()
     end_time = get_milli_time() - start_time
     print('Total Time Taken: {}ms ({}s)'.format(end_time, end_time / 1000))
 
 
+def get_push_jobs(single_products, variable_products, categories_dict, attributes_dict, deleted_skus=None,
+                  deleted_handles=None):
+    """
+    Function to split a push into jobs. Taxonomy jobs come first so products rarely have to create it themselves.
+
+    :param single_products: Dict containing dicts of information for single products
+    :param variable_products: Dict containing lists of variants of variable products
+    :param categories_dict: Dict with category names as keys
+    :param attributes_dict: Dict of attributes and their terms
+    :param deleted_skus: List of SKUs deleted in Loyverse
+    :param deleted_handles: List of handles deleted in Loyverse
+    :return: generator yielding tuples of the job type and its payload
+    """
+    if categories_dict:
+        yield 'categories', {'names': list(categories_dict)}
+    for attribute in attributes_dict:
+        yield 'attributes', {'name': attribute, 'terms': list(attributes_dict[attribute]['terms'])}
+
+    handles = list(single_products) + list(variable_products)
+    for handles_chunk in chunk_list(handles, WOOCOMMERCE_BATCH_SIZE):
+        skus = list()
+        for handle in handles_chunk:
+            if handle in single_products:
+                skus.append(single_products[handle]['SKU'])
+            else:
+                skus.extend(variant['SKU'] for variant in variable_products[handle]['variants'])
+        yield 'products', {'skus': skus}
+
+    if deleted_skus or deleted_handles:
+        yield 'delete', {'skus': list(deleted_skus or []), 'handles': list(deleted_handles or [])}
+
+
+def enqueue_push(single_products, variable_products, categories_dict, attributes_dict, deleted_skus=None,
+                 deleted_handles=None, debug=False):
+    """
+    Function to queue the jobs of a push. See get_push_jobs.
+
+    :return: number of jobs queued
+    """
+    queued = enqueue_jobs(get_push_jobs(single_products, variable_products, categories_dict, attributes_dict,
+                                        deleted_skus=deleted_skus, deleted_handles=deleted_handles))
+    if debug:
+        print("Queued {} push jobs".format(queued))
+    return queued
+
+
 def get_all_categories(product_list):
     """
     Function to get a unique list of categories out of the list of products.
 
-    :param product_list: List of products
+    :param product_list: List (or any iterable) of products
     :return: dict with category names as keys
     """
     categories_dict = dict()
@@ -53,41 +183,51 @@ def get_all_categories(product_list):
     return categories_dict
 
 
+def iter_staged_products(single_products, variable_products):
+    """
+    Function to go through every product of both types again once they are grouped.
+
+    :param single_products: Dict containing dicts of information for single products
+    :param variable_products: Dict containing lists of variants of variable products
+    :return: generator yielding product dicts
+    """
+    for handle in single_products:
+        yield single_products[handle]
+    for handle in variable_products:
+        for variant in variable_products[handle]['variants']:
+            yield variant
+
+
 def determine_product_types(product_list):
     """
     Function to go through a list of products and define their types.
     Two or more products with the same handle/name are variants of a variable product.
+    The products are only iterated once, so a generator streaming from redis can be passed in.
 
-    :param product_list: List of products containing both types of products
-    :return: tuple with a dict containing single products and a dict containing lists of variable products
+    :param product_list: List (or any iterable) of products containing both types of products, as staged dicts or
+                Variant records
+    :return: tuple with a dict containing Variant records of single products and a dict containing Product records of
+                variable products
     """
-    handle_count = dict()
+    handle_products = dict()
     for product in product_list:
-        if product['handle'] not in handle_count:
-            handle_count[product['handle']] = {'count': 1}
+        if not isinstance(product, Variant):
+            product = Variant.from_dict(product)
+        if product['handle'] not in handle_products:
+            handle_products[product['handle']] = [product]
         else:
-            handle_count[product['handle']]['count'] += 1
-
-    # Handles with count greater than one are variable products
-    for handle in handle_count:
-        if handle_count[handle]['count'] == 1:
-            handle_count[handle]['type'] = 'single'
-        else:
-            handle_count[handle]['type'] = 'variable'
+            handle_products[product['handle']].append(product)
 
     # Compile dicts
+    # Handles with count greater than one are variable products
     # All dicts because it will be easier to append more information to products later
     single_products = dict()
     variable_products = dict()
-    for product in product_list:
-        if handle_count[product['handle']]['type'] == 'single':
-            single_products[product['handle']] = product
+    for handle in handle_products:
+        if len(handle_products[handle]) == 1:
+            single_products[handle] = handle_products[handle][0]
         else:
-            # Some data duplication here but these are local dictionaries. Not sure if it's worth it to clean them
-            if product['handle'] in variable_products:
-                variable_products[product['handle']]['variants'].append(product)
-            else:
-                variable_products[product['handle']] = {'variants': [product]}
+            variable_products[handle] = Product(handle=handle, variants=handle_products[handle])
 
     return single_products, variable_products
 
@@ -98,81 +238,185 @@ def determine_attributes(variable_products):
     have any attributes.
 
     :param variable_products: Dict containing list of variations of variable products
-    :return: dict of attributes and their terms
+    :return: dict of Attribute records with their terms
     """
 
     # This is a complex dictionary.
     #   - The parent element keys are names of attributes
-    #   - The parent elements contain a 'terms' dictionary that has keys as the attribute term and it's value is the
-    #       attribute_term id coming from WooCommerce
-    #   - The parent elements will also be added with an id entry when the attribute is created in WooCommerce
+    #   - The parent elements are Attribute records with a 'terms' dictionary that has keys as the attribute term and
+    #       it's value is the attribute_term id coming from WooCommerce
+    #   - The parent elements will also be given a wc_id when the attribute is created in WooCommerce
     attributes = dict()
     for handle in variable_products:
         variable_product = variable_products[handle]
         for variation in variable_product['variants']:
             # These NoneType will be filled with WooCommerce Attribute Term IDs later
             if variation['option_1_name'] not in attributes:
-                attributes[variation['option_1_name']] = {'terms': {variation['option_1_value']: None}}
+                attributes[variation['option_1_name']] = Attribute(name=variation['option_1_name'],
+                                                                   terms={variation['option_1_value']: None})
             else:
                 attributes[variation['option_1_name']]['terms'][variation['option_1_value']] = None
 
     return attributes
 
 
-def create_categories(categories_dict, debug=False):
+def get_term_key(attribute, term):
+    """
+    :param attribute: Name of an attribute
+    :param term: Name of one of its terms
+    :return: key of the attribute term in the journal
+    """
+    return json.dumps([attribute, term])
+
+
+def is_taxonomy_journaled(journal, categories_dict, attributes_dict):
+    """
+    :param journal: RunJournal of the push
+    :param categories_dict: Dict of the category names to create
+    :param attributes_dict: Dict of the attributes to create, with their terms
+    :return: True if every category, attribute and attribute term is in the journal already
+    """
+    return all(journal.get('categories', category) for category in categories_dict) and \
+        all(journal.get('attributes', attribute) for attribute in attributes_dict) and \
+        all(journal.get('attribute_terms', get_term_key(attribute, term))
+            for attribute in attributes_dict for term in attributes_dict[attribute]['terms'])
+
+
+def get_journal_recorder(journal, kind, fingerprints, pending=(), **fields):
+    """
+    Function to get the on_chunk function of a batch, recording what every batch request pushed in the journal.
+
+    :param journal: RunJournal of the push or None
+    :param kind: Kind of entity in the journal, e.g. 'products'
+    :param fingerprints: Dict of key -> tuple with the new hash, from get_fingerprints
+    :param pending: Keys sent as creates that are updated afterwards if they already existed. Those aren't recorded
+                until the update
+    :param fields: Fields recorded with every entry, e.g. the parent_id of variations
+    :return: function for the on_chunk argument of the batch functions, or None without journal
+    """
+    if journal is None:
+        return None
+
+    def record(chunk_results):
+        journal.record(kind, {key: dict(fields, hash=fingerprints[key][0], wc_id=chunk_results[key][1]['id'])
+                              for key in chunk_results
+                              if chunk_results[key][0] is not None and not (key in pending and chunk_results[key][0])})
+
+    return record
+
+
+def create_categories(categories_dict, workers=1, journal=None, debug=False):
     """
     Function to create categories in WooCommerce.
 
     :param categories_dict: Dict to get category names from
+    :param workers: Number of categories to create concurrently
+    :param journal: RunJournal of the push. Categories in it are not sent again, created ones are recorded
     :param debug: Boolean to print stuff on console for debugging
     :returns: the same categories dict with ids assigned to the category names
     """
-    for category in categories_dict:
-        slug = generate_slug(category, 'category')
+    def create_category(category):
+        entry = journal.get('categories', category) if journal else None
+        if entry:
+            categories_dict[category] = entry['wc_id']
+            return
+
+        slug = get_slug('category', category)
         wc_category = post_category(category, slug)
         categories_dict[category] = wc_category['id']
+        if journal:
+            journal.record('categories', {category: {'wc_id': wc_category['id']}})
         if debug:
             print('Created/Retrieved category: {}'.format(category))
 
+    # Every name gets its slug before anything is sent, so names whose slugs collide are told apart
+    register_category_slugs(categories_dict, debug=debug)
+    run_in_pool(create_category, categories_dict, workers=workers)
+
     return categories_dict
 
 
-def create_attributes(attributes_dict, debug=False):
+def create_attributes(attributes_dict, workers=1, journal=None, debug=False):
     """
     Function to create attributes and attribute terms in WooCommerce System.
+    All attributes are created before any of the terms, since terms need the id of their attribute.
 
     :param attributes_dict: Dict containing attributes and their terms
+    :param workers: Number of attributes/terms to create concurrently
+    :param journal: RunJournal of the push. Attributes and terms in it are not sent again, created ones are recorded
     :param debug: Boolean to print stuff on console for debugging
     :return: the same dict with ids of attributes and terms added
     """
-    for attribute in attributes_dict:
-        attribute_slug = generate_slug(attribute, 'attribute')
+    def create_attribute(attribute):
+        entry = journal.get('attributes', attribute) if journal else None
+        if entry:
+            attributes_dict[attribute]['wc_id'] = entry['wc_id']
+            return
+
+        attribute_slug = get_slug('attribute', attribute)
         wc_attribute = post_attribute(attribute, attribute_slug)
         attributes_dict[attribute]['wc_id'] = wc_attribute['id']
+        if journal:
+            journal.record('attributes', {attribute: {'wc_id': wc_attribute['id']}})
         if debug:
             print('Created/Retrieved attribute: {}'.format(attribute))
 
+    def create_attribute_term(attribute_term):
         # Use attribute id to create terms for that attribute as well
-        for term in attributes_dict[attribute]['terms']:
-            term_slug = generate_slug(term, 'attribute_term')
-            wc_attribute_term = post_attribute_term(attributes_dict[attribute]['wc_id'], term, term_slug)
-            attributes_dict[attribute]['terms'][term] = wc_attribute_term['id']
-            if debug:
-                print('\tCreated/Retrieved attribute term: {}'.format(term))
+        attribute, term = attribute_term
+        entry = journal.get('attribute_terms', get_term_key(attribute, term)) if journal else None
+        if entry:
+            attributes_dict[attribute]['terms'][term] = entry['wc_id']
+            return
+
+        term_slug = get_slug('attribute_term', term, scope=attribute)
+        wc_attribute_term = post_attribute_term(attributes_dict[attribute]['wc_id'], term, term_slug)
+        attributes_dict[attribute]['terms'][term] = wc_attribute_term['id']
+        if journal:
+            journal.record('attribute_terms', {get_term_key(attribute, term): {'wc_id': wc_attribute_term['id']}})
+        if debug:
+            print('\tCreated/Retrieved attribute term: {} ({})'.format(term, attribute))
+
+    register_attribute_slugs(attributes_dict, debug=debug)
+    run_in_pool(create_attribute, attributes_dict, workers=workers)
+    attribute_terms = [(attribute, term) for attribute in attributes_dict
+                       for term in attributes_dict[attribute]['terms']]
+    run_in_pool(create_attribute_term, attribute_terms, workers=workers)
+
     return attributes_dict
 
 
-def create_single_products(single_products, categories_dict, debug=False):
+def create_single_products(single_products, categories_dict, workers=1, journal=None, debug=False):
     """
     Function to create single products in WooCommerce System.
+    Products are sent to the products batch endpoint, WOOCOMMERCE_BATCH_SIZE at a time.
+    Products whose fingerprint didn't change since the last push are skipped, changed ones are updated.
 
     :param single_products: Dict containing dicts of information for single products
     :param categories_dict: Dict containing category names and their WooCommerce id
+    :param workers: Number of batch requests to send concurrently
+    :param journal: RunJournal of the push. Products in it with the same content are not sent again, pushed ones are
+                recorded after every batch request
     :param debug: Boolean to print stuff on console for debugging
     :return: the same dict with ids of products added
     """
+    fingerprints = get_fingerprints(PRODUCT_FINGERPRINTS_KEY, single_products)
+    products_create = dict()
+    products_update = dict()
+    # Products the journal recorded, whose fingerprints may not have been saved before the push stopped
+    pushed = dict()
     for handle in single_products:
         product = single_products[handle]
+        new_hash, saved = fingerprints[handle]
+        if is_unchanged(new_hash, saved):
+            product['wc_id'] = saved['wc_id']
+            continue
+        entry = journal.get('products', handle, new_hash) if journal else None
+        if entry:
+            product['wc_id'] = entry['wc_id']
+            pushed[handle] = {'hash': new_hash, 'wc_id': entry['wc_id'], 'image_url': product.get('image_url')}
+            continue
+
         if not product['category_name']:
             category_id = None
         else:
@@ -183,34 +427,112 @@ def create_single_products(single_products, categories_dict, debug=False):
             image_urls = [product['image_url']]
         else:
             image_urls = None
-        already_exists, wc_product = post_product(product['name'], slug, 'simple', sku=product['SKU'],
-                                                  category_id=category_id, regular_price=str(product['price']),
-                                                  manage_stock=False, image_urls=image_urls)
-        single_products[handle]['wc_id'] = wc_product['id']
+        data = build_product_data(product['name'], slug, 'simple', sku=product['SKU'], category_id=category_id,
+                                  regular_price=str(product['price']), manage_stock=None, image_urls=image_urls)
+        if saved and saved.get('wc_id'):
+            products_update[handle] = get_update_data(data, saved['wc_id'], saved, product.get('image_url'))
+        else:
+            products_create[handle] = data
+
+    journaled = len(pushed)
+    results = batch_products(create=products_create, update=products_update, workers=workers, debug=debug,
+                             on_chunk=get_journal_recorder(journal, 'products', fingerprints, pending=products_create))
+
+    # Products that already existed with the same SKU are updated with the latest information
+    products_update = {handle: get_update_data(products_create[handle], results[handle][1]['id'])
+                       for handle in products_create if results[handle][0]}
+    if products_update:
+        results.update(batch_products(update=products_update, workers=workers, debug=debug,
+                                      on_chunk=get_journal_recorder(journal, 'products', fingerprints)))
+
+    for handle in results:
+        already_exists, wc_product = results[handle]
+        single_products[handle]['wc_id'] = wc_product.get('id') if already_exists is not None else None
+        if already_exists is not None:
+            pushed[handle] = {'hash': fingerprints[handle][0], 'wc_id': wc_product['id'],
+                              'image_url': single_products[handle].get('image_url')}
         if debug and already_exists is not None:
-            print("Created Product: {}. Already Existed: {}".format(handle, already_exists))
+            print("Created/Updated Product: {}. Already Existed: {}".format(handle, already_exists))
         elif debug and already_exists is None:
             print("Could not create product: {}. Error: {}".format(handle, wc_product))
+    save_fingerprints(PRODUCT_FINGERPRINTS_KEY, pushed)
 
-        # if already_exists:
-        # TODO: Perhaps update the product information if it already exists?
-        #   Definitely need to do so for quantity
+    if debug:
+        print("Single products: {} unchanged, {} in the journal, {} created or updated".format(
+            len(single_products) - len(results) - journaled, journaled, len(pushed) - journaled))
 
     return single_products
 
 
-def create_variable_products(variable_products, categories_dict, attributes_dict, debug=False):
+def get_update_data(data, wc_id, saved=None, image_url=None):
+    """
+    Function to turn the data of a product or variation into the data of an update.
+    Images are only sent again when the image url (or, with IMAGE_CHECK_CONTENT, its content) changed, since
+    WooCommerce downloads and processes them every time.
+
+    :param data: Data from build_product_data or build_product_variation_data
+    :param wc_id: WooCommerce id of the object to update
+    :param saved: Saved fingerprint of the object, if any
+    :param image_url: Current image url of the object
+    :return: dict with the data to send as an update
+    """
+    update_data = dict(data)
+    update_data['id'] = wc_id
+    if saved and saved.get('image_url') == image_url and not (image_url and image_changed(image_url)):
+        update_data.pop('images', None)
+    return update_data
+
+
+def get_variable_product_record(variable_product):
+    """
+    Function to compile the information a variable (parent) product is made of, for its fingerprint.
+
+    :param variable_product: Variable product and variants information
+    :return: dict of the parent product information
+    """
+    product = variable_product['variants'][0]
+    return {
+        'name': product['name'],
+        'category_name': product['category_name'],
+        'image_url': product.get('image_url'),
+        'option_1_name': product['option_1_name'],
+        'option_1_values': get_attribute_terms(variable_product),
+    }
+
+
+def create_variable_products(variable_products, categories_dict, attributes_dict, workers=1, journal=None,
+                             debug=False):
     """
     Function to create variable products in WooCommerce System.
+    Products whose fingerprint didn't change since the last push are skipped, changed ones are updated in a batch.
 
     :param variable_products: Dict containing dicts of information for variable products
     :param categories_dict: Dict containing category names and their WooCommerce id
     :param attributes_dict: Dict containing information about attributes
+    :param workers: Number of products to create concurrently
+    :param journal: RunJournal of the push. Products in it with the same content are not sent again, pushed ones are
+                recorded as soon as they are created
     :param debug: Boolean to print stuff on console for debugging
     :return: the same dict with ids of products added
     """
+    records = {handle: get_variable_product_record(variable_products[handle]) for handle in variable_products}
+    fingerprints = get_fingerprints(PRODUCT_FINGERPRINTS_KEY, records)
+    products_args = dict()
+    products_update = dict()
+    pushed = dict()
+
     for handle in variable_products:
         product = variable_products[handle]['variants'][0]
+        new_hash, saved = fingerprints[handle]
+        if is_unchanged(new_hash, saved):
+            variable_products[handle]['wc_id'] = saved['wc_id']
+            continue
+        entry = journal.get('products', handle, new_hash) if journal else None
+        if entry:
+            variable_products[handle]['wc_id'] = entry['wc_id']
+            pushed[handle] = {'hash': new_hash, 'wc_id': entry['wc_id'], 'image_url': records[handle]['image_url']}
+            continue
+
         variant_attribute_name = variable_products[handle]['variants'][0]['option_1_name']
         variant_attribute_id = attributes_dict[variant_attribute_name]['wc_id']
         variant_attribute_term_names = get_attribute_terms(variable_products[handle])
@@ -224,18 +546,51 @@ def create_variable_products(variable_products, categories_dict, attributes_dict
             image_urls = [product['image_url']]
         else:
             image_urls = None
-        already_exists, wc_product = post_product(product['name'], slug, 'variable', category_id=category_id,
-                                                  manage_stock=False, image_urls=image_urls,
-                                                  attribute_id=variant_attribute_id,
-                                                  attribute_options=variant_attribute_term_names,
-                                                  attribute_variation=True, attribute_visible=True)
-        variable_products[handle]['wc_id'] = wc_product['id']
+        products_args[handle] = dict(product_name=product['name'], slug=slug, product_type='variable',
+                                     category_id=category_id, manage_stock=False, image_urls=image_urls,
+                                     attribute_id=variant_attribute_id,
+                                     attribute_options=variant_attribute_term_names, attribute_variation=True,
+                                     attribute_visible=True)
+        if saved and saved.get('wc_id'):
+            products_update[handle] = get_update_data(build_product_data(**products_args[handle]), saved['wc_id'],
+                                                      saved, product.get('image_url'))
+
+    def create_variable_product(handle):
+        # Variable products have no SKU, so post_product searches for the slug before creating them
+        already_exists, wc_product = post_product(**products_args[handle])
+        variable_products[handle]['wc_id'] = wc_product.get('id')
+        if already_exists is None or not wc_product.get('id'):
+            if debug:
+                print("Could not create product: {}. Error: {}".format(handle, wc_product))
+            return
+        if already_exists:
+            # Update the product that was found with the latest information
+            products_update[handle] = get_update_data(build_product_data(**products_args[handle]), wc_product['id'])
+        else:
+            pushed[handle] = {'hash': fingerprints[handle][0], 'wc_id': wc_product['id'],
+                              'image_url': records[handle]['image_url']}
+            if journal:
+                journal.record('products', {handle: {'hash': fingerprints[handle][0], 'wc_id': wc_product['id']}})
         if debug:
             print("Created Product: {}. Already Existed: {}".format(handle, already_exists))
 
-        # if already_exists:
-        # TODO: Perhaps update the product information if it already exists?
-        #   Definitely need to do so for quantityvariable_products
+    run_in_pool(create_variable_product, [handle for handle in products_args if handle not in products_update],
+                workers=workers)
+
+    results = batch_products(update=products_update, workers=workers, debug=debug,
+                             on_chunk=get_journal_recorder(journal, 'products', fingerprints))
+    for handle in results:
+        already_exists, wc_product = results[handle]
+        if already_exists is None:
+            if debug:
+                print("Could not update product: {}. Error: {}".format(handle, wc_product))
+            continue
+        variable_products[handle]['wc_id'] = wc_product['id']
+        pushed[handle] = {'hash': fingerprints[handle][0], 'wc_id': wc_product['id'],
+                          'image_url': records[handle]['image_url']}
+        if debug:
+            print("Updated Product: {}".format(handle))
+    save_fingerprints(PRODUCT_FINGERPRINTS_KEY, pushed)
 
     return variable_products
 
@@ -254,40 +609,144 @@ def get_attribute_terms(product):
     return attribute_terms
 
 
-def create_variants(variable_products, attributes_dict, debug=False):
+def create_variants(variable_products, attributes_dict, workers=1, journal=None, debug=False):
     """
     Function to create variations for variable products in WooCommerce System.
+    Variations of each product are sent to its variations batch endpoint, WOOCOMMERCE_BATCH_SIZE at a time.
+    Variations whose fingerprint didn't change since the last push are skipped, changed ones are updated.
 
     :param variable_products: Dict containing dicts of information for variable products
     :param attributes_dict: Dictionary containing information of attributes
+    :param workers: Number of products whose variations are created concurrently
+    :param journal: RunJournal of the push. Variations in it with the same content and parent are not sent again,
+                pushed ones are recorded after every batch request
     :param debug: Boolean to print stuff on console for debugging
     :return: the same dict with ids of products added
     """
-    for handle in variable_products:
-        if 'image_url' in variable_products[handle] and variable_products[handle]['image_url']:
-            image_urls = [variable_products[handle]['image_url']]
-        else:
-            image_urls = None
-
-        for variant in variable_products[handle]['variants']:
-            already_exists, wc_product_variant = post_product_variation(variant['name'],
-                                                                        variable_products[handle]['wc_id'],
-                                                                        variant['SKU'], variant['price'],
-                                                                        image_urls=image_urls,
-                                                                        attribute_id=attributes_dict[
-                                                                            variant['option_1_name']]['wc_id'],
-                                                                        attribute_term_name=variant['option_1_value'],
-                                                                        manage_stock=False)
-            variant['wc_id'] = wc_product_variant['id']
+    def create_product_variants(handle):
+        parent_id = variable_products[handle].get('wc_id')
+        if not parent_id:
             if debug:
-                print("Created Product variation: {}. Already Existed: {}".format(handle, already_exists))
+                print("Skipping variations of product: {}. Parent product was not created.".format(handle))
+            return
+
+        variants_by_sku = {variant['SKU']: variant for variant in variable_products[handle]['variants']}
+        fingerprints = get_fingerprints(VARIANT_FINGERPRINTS_KEY, variants_by_sku)
+        variants_create = dict()
+        variants_update = dict()
+        # Old parent id -> SKU -> id of the variations that moved to this product
+        moved = dict()
+        pushed = dict()
+        for sku in variants_by_sku:
+            variant = variants_by_sku[sku]
+            new_hash, saved = fingerprints[sku]
+            # A variation moved to another parent has to be created again under the new one. The old variation holds
+            # the SKU until it is deleted
+            old_parent_id = old_variation_id = None
+            if saved and saved.get('parent_id') != parent_id:
+                old_parent_id, old_variation_id = saved.get('parent_id'), saved.get('wc_id')
+                saved = None
+            if is_unchanged(new_hash, saved):
+                variant['wc_id'] = saved['wc_id']
+                continue
+            entry = journal.get('variants', sku, new_hash) if journal else None
+            if entry and entry.get('parent_id') == parent_id:
+                variant['wc_id'] = entry['wc_id']
+                pushed[sku] = {'hash': new_hash, 'wc_id': entry['wc_id'], 'parent_id': parent_id}
+                continue
+
+            # Variations share the image of their item, which the parent product already added to the media library
+            image_urls = [variant['image_url']] if variant.get('image_url') else None
+            data = build_product_variation_data(variant['name'], variant['SKU'], variant['price'],
+                                                image_urls=image_urls,
+                                                attribute_id=attributes_dict[variant['option_1_name']]['wc_id'],
+                                                attribute_term_name=variant['option_1_value'], manage_stock=None)
+            if saved and saved.get('wc_id'):
+                variants_update[sku] = get_update_data(data, saved['wc_id'])
+            else:
+                variants_create[sku] = data
+                if old_parent_id and old_variation_id:
+                    moved.setdefault(old_parent_id, dict())[sku] = old_variation_id
 
-        # if already_exists:
-        # TODO: Perhaps update the product information if it already exists?
-        #   Definitely need to do so for quantityvariable_products
+        for old_parent_id in moved:
+            # If the delete fails the old variation still holds the SKU, and the create below reports it
+            deleted = batch_product_variations(old_parent_id, delete=moved[old_parent_id], debug=debug)
+            if debug:
+                for sku in deleted:
+                    if deleted[sku][0] is None:
+                        print("Could not delete moved product variation: {}. Error: {}".format(sku, deleted[sku][1]))
+
+        results = batch_product_variations(parent_id, create=variants_create, update=variants_update, debug=debug,
+                                           on_chunk=get_journal_recorder(journal, 'variants', fingerprints,
+                                                                         parent_id=parent_id))
+
+        for sku in results:
+            already_exists, wc_product_variant = results[sku]
+            variants_by_sku[sku]['wc_id'] = wc_product_variant.get('id') if already_exists is not None else None
+            if already_exists is not None:
+                pushed[sku] = {'hash': fingerprints[sku][0], 'wc_id': wc_product_variant['id'],
+                               'parent_id': parent_id}
+            if debug and already_exists is not None:
+                print("Created/Updated Product variation: {} ({}). Already Existed: {}".format(handle, sku,
+                                                                                               already_exists))
+            elif debug and already_exists is None:
+                print("Could not create product variation: {} ({}). Error: {}".format(handle, sku,
+                                                                                      wc_product_variant))
+        save_fingerprints(VARIANT_FINGERPRINTS_KEY, pushed)
+
+    run_in_pool(create_product_variants, variable_products, workers=workers)
 
     return variable_products
 
 
+def delete_products(deleted_skus, deleted_handles, workers=1, journal=None, debug=False):
+    """
+    Function to delete products and product variations deleted in Loyverse from WooCommerce System.
+
+    :param deleted_skus: List of SKUs of deleted single products and variations
+    :param deleted_handles: List of handles of deleted items. Removes the parent product of variable products
+    :param workers: Number of products to delete concurrently
+    :param journal: RunJournal of the push. Deletes in it are not sent again, sent ones are recorded
+    :param debug: Boolean to print stuff on console for debugging
+    """
+    def delete_sku(sku):
+        if journal and journal.get('deleted_skus', sku):
+            return
+        wc_product = search_product_by_sku(sku)
+        if not wc_product:
+            return
+        if wc_product.get('parent_id'):
+            delete_product_variation(wc_product['parent_id'], wc_product['id'])
+        else:
+            delete_product(wc_product['id'])
+        if journal:
+            journal.record('deleted_skus', {sku: {'wc_id': wc_product['id']}})
+        if debug:
+            print("Deleted Product: {}".format(sku))
+
+    def delete_handle(handle):
+        if journal and journal.get('deleted_handles', handle):
+            return
+        slug = '{}{}'.format(SLUG_PREFIXES['product'], handle)
+        if is_index_warm():
+            product_id = lookup_slug(slug)
+        else:
+            product_id = (search_product(slug) or {}).get('id')
+        if not product_id:
+            return
+        delete_product(product_id)
+        if journal:
+            journal.record('deleted_handles', {handle: {'wc_id': product_id}})
+        if debug:
+            print("Deleted Product: {}".format(handle))
+
+    run_in_pool(delete_sku, deleted_skus, workers=workers)
+    run_in_pool(delete_handle, deleted_handles, workers=workers)
+
+    # Single products are fingerprinted by handle, variations by SKU
+    delete_fingerprints(VARIANT_FINGERPRINTS_KEY, deleted_skus)
+    delete_fingerprints(PRODUCT_FINGERPRINTS_KEY, deleted_handles)
+
+
 if __name__ == '__main__':
     insert_to_woocommerce(debug=True)
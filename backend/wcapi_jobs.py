@@ -0,0 +1,181 @@
+"""
+WooCommerce push split into jobs on the durable job queue (see utils/jobs.py), so several worker processes or hosts
+can push in parallel and a crash only loses the job that was running.
+
+Job types:
+==========
+- categories: create categories
+- attributes: create attributes and their terms
+- products: upsert single and variable (parent) products of up to WOOCOMMERCE_BATCH_SIZE handles. Queues a variations
+    job for every variable product
+- variations: upsert the variations of one variable product
+- delete: delete products and variations deleted in Loyverse
+
+Every handler is idempotent: taxonomy comes from the driver's cache, products from the fingerprints and the index of
+WooCommerce ids, so a retried job only pushes what did not go through the first time.
+"""
+from .utils import PROCESSED_DATA_PREFIX, SLUG_PREFIXES, WOOCOMMERCE_WORKERS
+from .utils.jobs import JobError, enqueue_jobs, read_job, ack_job, fail_job, ensure_group, get_consumer_name
+from .utils.redis import get_items
+from .utils.records import Attribute
+from .utils.wc_index import lookup_slug
+from .utils.metrics import write_textfile
+from .drivers.wcapi import load_taxonomy_cache
+from .wcapi_inserter import create_categories, create_attributes, create_single_products, create_variable_products, \
+    create_variants, delete_products, determine_product_types, determine_attributes, get_all_categories, \
+    iter_staged_products
+
+
+def get_taxonomy(single_products, variable_products, workers=1, debug=False):
+    """
+    Function to get the ids of the categories and attributes products need, creating the ones that don't exist.
+    They normally come from the taxonomy cache without any request.
+
+    :return: tuple with the categories dict and the attributes dict
+    """
+    categories_dict = create_categories(get_all_categories(iter_staged_products(single_products, variable_products)),
+                                        workers=workers, debug=debug)
+    attributes_dict = create_attributes(determine_attributes(variable_products), workers=workers, debug=debug)
+    return categories_dict, attributes_dict
+
+
+def handle_categories(payload, workers=1, debug=False):
+    """
+    :param payload: dict with the category 'names'
+    """
+    create_categories(dict.fromkeys(payload['names']), workers=workers, debug=debug)
+
+
+def handle_attributes(payload, workers=1, debug=False):
+    """
+    :param payload: dict with the attribute 'name' and the names of its 'terms'
+    """
+    attribute = Attribute(name=payload['name'], terms=dict.fromkeys(payload['terms']))
+    create_attributes({attribute.name: attribute}, workers=workers, debug=debug)
+
+
+def handle_products(payload, workers=1, debug=False):
+    """
+    :param payload: dict with the 'skus' of every variant of the handles to push
+    """
+    single_products, variable_products = determine_product_types(get_items(payload['skus'], PROCESSED_DATA_PREFIX))
+    categories_dict, attributes_dict = get_taxonomy(single_products, variable_products, workers=workers, debug=debug)
+    create_single_products(single_products, categories_dict, workers=workers, debug=debug)
+    create_variable_products(variable_products, categories_dict, attributes_dict, workers=workers, debug=debug)
+
+    failed = [handle for handle in single_products if not single_products[handle].get('wc_id')]
+    failed += [handle for handle in variable_products if not variable_products[handle].get('wc_id')]
+    if failed:
+        raise JobError('Could not push products: {}'.format(', '.join(failed)))
+
+    # Only once every product was pushed, so retries of this job don't queue the same variations again. Parents
+    # pushed by a failed attempt are unchanged in the retry and still get their variations queued then
+    enqueue_jobs(('variations', {'parent_id': variable_products[handle]['wc_id'],
+                                 'skus': [variant['SKU'] for variant in variable_products[handle]['variants']]})
+                 for handle in variable_products)
+
+
+def handle_variations(payload, workers=1, debug=False):
+    """
+    :param payload: dict with the WooCommerce 'parent_id' and the 'skus' of the variants of one handle
+    """
+    single_products, variable_products = determine_product_types(get_items(payload['skus'], PROCESSED_DATA_PREFIX))
+    # Only the staged variants of a single handle are in the payload. If all but one were removed since, there is
+    # nothing left to push as variations
+    if not variable_products:
+        return
+
+    _, attributes_dict = get_taxonomy(dict(), variable_products, workers=workers, debug=debug)
+    for handle in variable_products:
+        variable_products[handle]['wc_id'] = payload['parent_id']
+    create_variants(variable_products, attributes_dict, workers=workers, debug=debug)
+
+    failed = [variant['SKU'] for handle in variable_products for variant in variable_products[handle]['variants']
+              if not variant.get('wc_id')]
+    if failed:
+        raise JobError('Could not push variations: {}'.format(', '.join(failed)))
+
+
+def handle_delete(payload, workers=1, debug=False):
+    """
+    :param payload: dict with the deleted 'skus' and 'handles'
+    """
+    delete_products(payload['skus'], payload['handles'], workers=workers, debug=debug)
+    slugs = ['{}{}'.format(SLUG_PREFIXES['product'], handle) for handle in payload['handles']]
+    remaining = [slug for slug in slugs if lookup_slug(slug)]
+    if remaining:
+        raise JobError('Could not delete products: {}'.format(', '.join(remaining)))
+
+
+JOB_HANDLERS = {
+    'categories': handle_categories,
+    'attributes': handle_attributes,
+    'products': handle_products,
+    'variations': handle_variations,
+    'delete': handle_delete,
+}
+
+
+def run_job(job, workers=1, debug=False):
+    """
+    Function to run a job with its handler, then ack it. If the handler raises, the error is recorded and the job is
+    left pending for a retry.
+
+    :param job: Job dict from read_job
+    :param workers: Number of worker threads the handler can use
+    :param debug: Boolean to print stuff on console for debugging
+    :return: True if the job succeeded
+    """
+    handler = JOB_HANDLERS.get(job['type'])
+    try:
+        if handler is None:
+            raise JobError('Unknown job type: {}'.format(job['type']))
+        handler(job['payload'], workers=workers, debug=debug)
+    except Exception as error:
+        fail_job(job, error)
+        if debug:
+            print("Job {} ({}) failed on attempt {}: {}".format(job['id'], job['type'], job['attempts'], error))
+        return False
+
+    ack_job(job)
+    if debug:
+        print("Job {} ({}) done".format(job['id'], job['type']))
+    return True
+
+
+def run_job_worker(consumer=None, workers=WOOCOMMERCE_WORKERS, burst=False, debug=False):
+    """
+    Main loop of a worker process. Any number of workers can run at once, on any host sharing the redis database.
+
+    :param consumer: Name of the worker in the consumer group. Defaults to the host name and process id
+    :param workers: Number of worker threads each job can use
+    :param burst: Stop once no job is left instead of waiting for new ones. Failed jobs are then left pending
+    :param debug: Boolean to print stuff on console for debugging
+    :return: tuple with the number of jobs that succeeded and failed
+    """
+    consumer = consumer or get_consumer_name()
+    ensure_group()
+    load_taxonomy_cache(workers=workers, debug=debug)
+
+    succeeded = 0
+    failed = 0
+    while True:
+        job = read_job(consumer)
+        if job is None:
+            if burst:
+                break
+            continue
+
+        if run_job(job, workers=workers, debug=debug):
+            succeeded += 1
+        else:
+            failed += 1
+        write_textfile('job_worker_{}'.format(consumer))
+
+    if debug:
+        print("Job worker {} stopped. Succeeded: {}. Failed: {}".format(consumer, succeeded, failed))
+    return succeeded, failed
+
+
+if __name__ == '__main__':
+    run_job_worker(debug=True)
@@ -0,0 +1,82 @@
+"""
+Worker pushing the changes queued by the Loyverse webhooks (see backend/app.py) to WooCommerce.
+Events arriving within a few seconds of each other are coalesced, then only the affected items are extracted and only
+their SKUs are pushed.
+"""
+import time
+
+from .loyverse_extractor import extract_loyverse_items
+from .stock_sync import sync_stock
+from .wcapi_inserter import insert_to_woocommerce
+from .utils import WEBHOOK_COALESCE_SECONDS, WEBHOOK_POLL_TIMEOUT, WEBHOOK_ITEM_IDS_KEY, WEBHOOK_VARIANT_IDS_KEY, \
+    WOOCOMMERCE_WORKERS
+from .utils.webhooks import wait_for_events, pop_item_ids, pop_variant_ids, requeue_ids, clear_notifications
+from .utils.metrics import write_textfile
+
+
+def process_queue(workers=WOOCOMMERCE_WORKERS, debug=False):
+    """
+    Function to push everything queued so far.
+    If a push fails, its ids are queued again for the next run, and so are the ids of the pushes it kept from
+    running.
+
+    :param workers: Number of concurrent workers for the WooCommerce push
+    :param debug: Boolean to print stuff on console for debugging
+    :return: tuple with the number of items and the number of variants processed
+    """
+    clear_notifications()
+    item_ids = pop_item_ids()
+    variant_ids = pop_variant_ids()
+    if debug and (item_ids or variant_ids):
+        print("Processing webhooks. Items: {}. Stock levels: {}".format(len(item_ids), len(variant_ids)))
+
+    if item_ids:
+        try:
+            extract_loyverse_items(item_ids, debug=debug)
+            insert_to_woocommerce(workers=workers, only_changed=True, debug=debug)
+        except Exception:
+            requeue_ids(WEBHOOK_ITEM_IDS_KEY, item_ids)
+            # The stock updates were popped as well and are not pushed in this run
+            requeue_ids(WEBHOOK_VARIANT_IDS_KEY, variant_ids)
+            raise
+
+    if variant_ids:
+        try:
+            sync_stock(variant_ids=variant_ids, workers=workers, debug=debug)
+        except Exception:
+            requeue_ids(WEBHOOK_VARIANT_IDS_KEY, variant_ids)
+            raise
+
+    return len(item_ids), len(variant_ids)
+
+
+def run_worker(coalesce_seconds=WEBHOOK_COALESCE_SECONDS, poll_timeout=WEBHOOK_POLL_TIMEOUT,
+               workers=WOOCOMMERCE_WORKERS, debug=False):
+    """
+    Main loop
+
+    Steps:
+    ======
+    1. Block until the receiver queues an event (or the poll timeout expires, to pick up re-queued ids)
+    2. Wait coalesce_seconds so the rest of a burst of edits is queued too
+    3. Push everything queued
+
+    :param coalesce_seconds: Seconds to wait after the first event of a burst
+    :param poll_timeout: Maximum seconds to block waiting for events
+    :param workers: Number of concurrent workers for the WooCommerce push
+    :param debug: Boolean to print stuff on console for debugging
+    """
+    while True:
+        if wait_for_events(poll_timeout):
+            time.sleep(coalesce_seconds)
+        try:
+            process_queue(workers=workers, debug=debug)
+        except Exception as error:
+            # Keep the worker alive. The failed ids were queued again and are retried on the next run
+            print("Webhook push failed: {}".format(error))
+            time.sleep(coalesce_seconds)
+        write_textfile('webhook_worker')
+
+
+if __name__ == '__main__':
+    run_worker(debug=True)